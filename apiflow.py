@@ -0,0 +1,141 @@
+#
+# API call flows shared by zgetproblem.py, zeventfinder.py, zgetinventory.py
+# and zgethistory.py
+#
+# The API logic of a script is written once, as a generator that yields the
+# calls it needs and gets their results back. The same generator runs with
+# the blocking ZabbixAPI (run) or with AsyncZabbixAPI for --async (async_run).
+# A flow can yield:
+#
+#   call(method, **params)    one API call, its result is sent back
+#   [calls and/or flows]      run at the same time, the list of results is sent back
+#   a number                  a pause of that many seconds
+#
+# A failed call is raised inside the generator, at the yield, so a flow can
+# handle it. What the generator returns is what run/async_run return.
+#
+import asyncio
+import concurrent.futures
+import contextlib
+import sys
+import time
+
+
+def call(method, **params):
+    ''' one API call of a flow, method like "host.get"'''
+    return (method, params)
+
+def chunked(method, idparam, ids, chunk=500, **params):
+    ''' the calls of method for ids, at most chunk ids per call'''
+    return [call(method, **{idparam: ids[i:i+chunk]}, **params) for i in range(0, len(ids), chunk)]
+
+def merged(results):
+    ''' merge the results of calls with preservekeys=1'''
+    merged = {}
+    for result in results:
+        if result:
+            merged.update(result)
+    return merged
+
+def api_method(zapi, method):
+    obj, name = method.split(".")
+    return getattr(getattr(zapi, obj), name)
+
+def run(zapi, flow, workers=1):
+    """
+    Run a flow with the blocking ZabbixAPI, the calls and flows of a list in
+    up to workers threads (nested lists one after the other)
+    """
+    result = None
+    error = None
+    while True:
+        try:
+            request = flow.throw(error) if error else flow.send(result)
+        except StopIteration as stop:
+            return stop.value
+        result = None
+        error = None
+        try:
+            if isinstance(request, (int, float)):
+                time.sleep(request)
+            elif isinstance(request, list):
+                if workers > 1 and len(request) > 1:
+                    with concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, len(request))) as executor:
+                        result = list(executor.map(lambda r: run_one(zapi, r), request))
+                else:
+                    result = [run_one(zapi, r) for r in request]
+            else:
+                result = run_one(zapi, request)
+        except Exception as e:
+            error = e
+
+def run_one(zapi, request):
+    if isinstance(request, tuple):
+        method, params = request
+        return api_method(zapi, method)(**params)
+    return run(zapi, request)
+
+async def async_run(zapi, flow, workers=None):
+    """
+    Run a flow with AsyncZabbixAPI, the calls and flows of a list at the same
+    time, with at most workers calls running at once (no limit by default)
+    """
+    semaphore = asyncio.Semaphore(workers) if workers else contextlib.nullcontext()
+    return await async_flow(zapi, flow, semaphore)
+
+async def async_flow(zapi, flow, semaphore):
+    result = None
+    error = None
+    while True:
+        try:
+            request = flow.throw(error) if error else flow.send(result)
+        except StopIteration as stop:
+            return stop.value
+        result = None
+        error = None
+        try:
+            if isinstance(request, (int, float)):
+                await asyncio.sleep(request)
+            elif isinstance(request, list):
+                result = list(await asyncio.gather(*[async_one(zapi, r, semaphore) for r in request]))
+            else:
+                result = await async_one(zapi, request, semaphore)
+        except Exception as e:
+            error = e
+
+async def async_one(zapi, request, semaphore):
+    if isinstance(request, tuple):
+        method, params = request
+        async with semaphore:
+            return await api_method(zapi, method)(**params)
+    return await async_flow(zapi, request, semaphore)
+
+@contextlib.asynccontextmanager
+async def async_login(url, user, password, verify=True):
+    """
+    AsyncZabbixAPI logged in to url; logged out and with its HTTP session
+    closed when done, also when the login itself fails
+    """
+    try:
+        import aiohttp
+        from zabbix_utils import AsyncZabbixAPI
+    except ImportError:
+        sys.exit("Error: --async needs zabbix_utils with the aiohttp module installed")
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=verify)) as session:
+        zapi = AsyncZabbixAPI(url=url, validate_certs=verify, client_session=session)
+        try:
+            await zapi.login(user=user, password=password)
+            yield zapi
+        except BaseException:
+            # the error of the flow is the one to report, not the one of the logout
+            with contextlib.suppress(Exception):
+                await zapi.logout()
+            raise
+        await zapi.logout()
+
+def run_async(flow, url, user, password, verify=True, workers=None):
+    ''' log in with AsyncZabbixAPI and run a flow (--async)'''
+    async def main():
+        async with async_login(url, user, password, verify) as zapi:
+            return await async_run(zapi, flow, workers)
+    return asyncio.run(main())
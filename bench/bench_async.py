@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+#
+# Benchmark the --async and multi-instance (-I) paths with API latency
+#
+# Runs zgetproblem.py, zeventfinder.py, zgetinventory.py and zgethistory.py
+# with and without --async against stand-in API servers that add --latency
+# seconds to every call, and zgetproblem.py once per server one after the
+# other against -I with all the servers. Prints the wall time (median of
+# --runs runs, including the start of the interpreter) and the number of API
+# calls, and checks that both paths print the same.
+#
+import argparse
+import re
+import statistics
+import sys
+import tempfile
+
+import standin
+
+def cases(fixture):
+    ''' (title, script, options) of the sync/async comparisons'''
+    hostids = [host['hostid'] for host in fixture.hosts[:10]]
+    groupids = [group['groupid'] for group in fixture.groups[:4]]
+    items = [item['itemid'] for item in fixture.items[:12]]
+    # a fixed period, so both runs get the same values
+    period = ['-s', str(fixture.now - 28800), '-t', '28800', '--no-cache']
+    return [
+        ("problems of 10 hosts by id", 'zgetproblem.py', ['-n', '-H'] + hostids + ['-L', '0']),
+        ("problems of all hosts", 'zgetproblem.py', ['--all-hosts', '-L', '0']),
+        ("events of 10 hosts by id", 'zeventfinder.py', ['-n', '-H'] + hostids + ['-L', '0']),
+        ("inventory of 4 groups by id, chunks of 25", 'zgetinventory.py',
+         ['-n', '-G'] + groupids + ['-A', '--chunk-size', '25']),
+        ("8h history of 12 items", 'zgethistory.py', period + items),
+        # the period of every batch in up to --slices calls
+        ("8h history of 12 items, --slices 8", 'zgethistory.py', period + ['--slices', '8'] + items),
+        ("last values of 12 items", 'zgethistory.py', ['-L', '--no-cache'] + items),
+    ]
+
+def timed(script, options):
+    ''' median wall time of args.runs runs, the output and the API calls of a run'''
+    times = []
+    for run in range(args.runs):
+        for server in servers:
+            server.reset()
+        proc = standin.run(script, options, home)
+        times.append(proc.elapsed)
+        calls = sum(len(server.reset()) for server in servers)
+    # the age of the problems changes with time
+    return statistics.median(times), re.sub(r' \[Age: [^]]*\]', '', proc.stdout), calls
+
+def report(title, sync, other):
+    same = sync[1] == other[1]
+    print("%-42s %8.2fs %8.2fs %6.1fx %6d %6d  %s" % (title, sync[0], other[0], sync[0] / other[0], sync[2],
+                                                     other[2], "same output" if same else "OUTPUT DIFFERS"))
+    return not same
+
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+                                 description='Benchmark the --async and multi-instance paths of the scripts against stand-in API servers with latency.',
+                                 epilog="""
+Needs aiohttp for --async. Exits with status 1 when the outputs differ.
+""")
+parser.add_argument('--latency', type=float, default=0.05,
+                    help='Seconds added to every API call, default is 0.05')
+parser.add_argument('--instances', type=int, default=4,
+                    help='Number of stand-in servers for the multi-instance case, default is 4')
+parser.add_argument('--hosts', type=int, default=200, help='Number of generated hosts per server, default is 200')
+parser.add_argument('--runs', type=int, default=3, help='Runs of every case, default is 3')
+args = parser.parse_args()
+
+servers = [standin.StandIn(standin.Fixture(hosts=args.hosts, seed=n + 1), latency=args.latency).start()
+           for n in range(args.instances)]
+names = ["zbx%d" % n for n in range(args.instances)]
+different = 0
+with tempfile.TemporaryDirectory() as home:
+    standin.write_config(home, servers[0].url, list(zip(names, [server.url for server in servers])))
+    print("%d ms latency per API call, median of %d runs" % (1000 * args.latency, args.runs))
+    print("%-42s %9s %9s %7s %6s %6s" % ("", "sync", "--async", "", "calls", ""))
+    for title, script, options in cases(servers[0].api.fx):
+        # the trigger cache of the first run would make the next ones cheaper
+        if script in ('zgetproblem.py', 'zeventfinder.py'):
+            options = options + ['--no-cache']
+        different += report(title, timed(script, options), timed(script, options + ['--async']))
+
+    print()
+    print("%-42s %9s %9s %7s %6s %6s" % ("", "one by one", "-I", "", "calls", ""))
+    single = [timed('zgetproblem.py', ['--all-hosts', '-L', '0', '--no-cache', '-I', name]) for name in names]
+    # the lines of all the servers, -I sorts them on time
+    one_by_one = (sum(s[0] for s in single), sorted("".join(s[1] for s in single).splitlines()),
+                  sum(s[2] for s in single))
+    for options in (['-I'] + names, ['-I'] + names + ['--async']):
+        multi = timed('zgetproblem.py', ['--all-hosts', '-L', '0', '--no-cache'] + options)
+        title = "problems of %d servers, %s" % (args.instances, "-I --async" if '--async' in options else "-I")
+        different += report(title, one_by_one, (multi[0], sorted(multi[1].splitlines()), multi[2]))
+for server in servers:
+    server.stop()
+
+if different:
+    sys.exit("Error: The output of %d case(s) differs" % different)
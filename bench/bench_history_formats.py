@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+#
+# Benchmark the output formats of zgethistory.py
+#
+# The writers: the inner loops of the text output, -F csv and -F npz of
+# zgethistory.py run over --records synthetic history records (as decoded
+# from the API, all fields strings), with the size of the output and the
+# time to read the values back.
+#
+# End to end (unless --no-end-to-end): zgethistory.py -F text/csv/npz for
+# --items float items over 6 days (8640 values each) from the stand-in API.
+#
+import argparse
+import csv
+import os
+import os.path
+import sys
+import tempfile
+import time
+
+import standin
+
+try:
+    import numpy
+except ImportError:
+    sys.exit("Error: bench_history_formats.py needs the numpy module")
+
+FIELDS = ['clock', 'ns', 'value']
+
+def write_text(path):
+    # HistoryWriter with -e, one item
+    with open(path, "w", encoding="utf-8") as out:
+        out.write("".join(format(record['clock'])+"."+format(record['ns'])+":"+format("%")+":"+
+                          format(record["value"])+"\n" for record in records))
+
+def write_csv(path):
+    # ColumnWriter, numeric items: joined as received
+    with open(path, "w", encoding="utf-8", newline="") as out:
+        out.write("".join("1001," + ",".join([record[field] for field in FIELDS]) + "\n" for record in records))
+
+def write_csv_module(path):
+    # ColumnWriter, text items: through the csv module for quoting
+    with open(path, "w", encoding="utf-8", newline="") as out:
+        csv.writer(out, lineterminator="\n").writerows(['1001'] + [record[field] for field in FIELDS]
+                                                        for record in records)
+
+def write_npz(path):
+    # ColumnWriter -F npz: typed columns decoded once from the strings
+    arrays = {field + "_0": numpy.array([record[field] for record in records],
+                                        dtype=numpy.float64 if field == 'value' else numpy.int64)
+              for field in FIELDS}
+    numpy.savez(path, items=numpy.array(['1001']), **arrays)
+
+def read_text(path):
+    with open(path, encoding="utf-8") as file:
+        return sum(float(line.rsplit(":", 1)[1]) for line in file)
+
+def read_csv(path):
+    with open(path, encoding="utf-8") as file:
+        return sum(float(line.rsplit(",", 1)[1]) for line in file)
+
+def read_npz(path):
+    with numpy.load(path) as data:
+        return data['value_0'].sum()
+
+def timed(function, *args):
+    started = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - started
+
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+                                 description='Benchmark the text, CSV and npz output of zgethistory.py.')
+parser.add_argument('--records', type=int, default=1000000,
+                    help='Number of synthetic records for the writers, default is 1000000')
+parser.add_argument('--items', type=int, default=20,
+                    help='Number of items fetched from the stand-in API end to end, default is 20')
+parser.add_argument('--no-end-to-end', help='Only benchmark the writers', action='store_true')
+args = parser.parse_args()
+
+records = [{'itemid': '1001', 'clock': str(1700000000 + i), 'ns': str(i * 7919 % 1000000000),
+            'value': "%.4f" % (i * 0.37 % 100)} for i in range(args.records)]
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    print("Writers, %d records" % args.records)
+    print("  %-22s %12s %10s %12s" % ("", "write Mrec/s", "MiB", "read Mrec/s"))
+    for name, write, read, suffix in [("text (-e)", write_text, read_text, ".txt"),
+                                      ("-F csv (join)", write_csv, read_csv, ".csv"),
+                                      ("-F csv (csv module)", write_csv_module, read_csv, ".csv"),
+                                      ("-F npz", write_npz, read_npz, ".npz")]:
+        path = os.path.join(tmpdir, "history" + suffix)
+        wtime = timed(write, path)
+        rtime = timed(read, path)
+        print("  %-22s %12.2f %10.1f %12.2f" % (name, args.records / wtime / 1e6, os.path.getsize(path) / 2**20,
+                                               args.records / rtime / 1e6))
+
+    if not args.no_end_to_end:
+        fixture = standin.Fixture(hosts=args.items, days=7)
+        server = standin.StandIn(fixture).start()
+        standin.write_config(tmpdir, server.url)
+        itemids = [item['itemid'] for item in fixture.items if item['key_'] == 'system.cpu.util']
+        period = ['-s', str(fixture.now - 6 * 86400), '-t', str(6 * 86400), '--no-cache'] + itemids
+        print()
+        print("zgethistory.py end to end, %d items of 6 days" % len(itemids))
+        print("  %-22s %12s %10s %12s" % ("", "seconds", "MiB", "Mrec/s"))
+        for name, options, outfile in [("text (-e)", ['-e'], None),
+                                       ("-F csv", ['-F', 'csv', '-o', 'history.csv'], 'history.csv'),
+                                       ("-F npz", ['-F', 'npz', '-o', 'history.npz'], 'history.npz')]:
+            proc = standin.run('zgethistory.py', options + period, tmpdir)
+            size = os.path.getsize(os.path.join(tmpdir, outfile)) if outfile else len(proc.stdout.encode())
+            count = sum(call['rows'] for call in server.reset() if call['method'] == 'history.get')
+            print("  %-22s %12.2f %10.1f %12.2f" % (name, proc.elapsed, size / 2**20, count / proc.elapsed / 1e6))
+        server.stop()
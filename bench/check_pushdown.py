@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+#
+# Check the server-side filters of zgetproblem.py and zeventfinder.py
+#
+# Runs the scripts as they were before the severity/tag/suppression filters
+# were pushed to problem.get and event.get (--before, by default the parent of
+# the first commit tagged [user-026]) and as they are now against the stand-in
+# API. The old output filtered afterwards (on the generated problems and
+# events) has to give the same rows as the new output, while
+# problem.get/event.get return fewer objects.
+#
+import argparse
+import re
+import sys
+import tempfile
+
+import standin
+
+# syslog lines of zgetproblem.py and the lines of zeventfinder.py, without the age
+PROBLEM_LINE = re.compile(r'^(.*?) \[([A-Z ]+|<Unknown Severity>)\] (\S+) \[(\d+)\] (.*) \((\S+)\) \[(Ack: \w+)\] \[Age: .*\]$')
+EVENT_LINE = re.compile(r'^(.*?) (\S+): (\w+) \[(\d+)\] (.*) \[(\S+)\]\((.*)\|(Ack: \w+)\)$')
+
+def severity(event):
+    return int(event['severity'])
+
+def tagged(event, tag, value=None, contains=False):
+    for etag in event['tags']:
+        if etag['tag'] == tag and (value is None or (value.lower() in etag['value'].lower() if contains
+                                                     else etag['value'] == value)):
+            return True
+    return False
+
+def monitored(event):
+    host = fixture.hostmap[fixture.triggermap[event['objectid']]['hostid']]
+    return host['status'] == '0' and host['maintenance_status'] == '0'
+
+# (new options, filter applied to the old output)
+PROBLEM_CASES = [
+    ([], lambda e: True),
+    (['--min-severity', 'average'], lambda e: severity(e) >= 3),
+    (['--min-severity', '2', '--max-severity', 'high'], lambda e: 2 <= severity(e) <= 4),
+    (['--tags', 'scope=availability'], lambda e: tagged(e, 'scope', 'availability')),
+    (['--tags', 'service=web', 'service=db'], lambda e: tagged(e, 'service', 'web') or tagged(e, 'service', 'db')),
+    (['--tags', 'scope~perf', 'service=mail', '--tag-evaltype', 'or'],
+     lambda e: tagged(e, 'scope', 'perf', True) or tagged(e, 'service', 'mail')),
+    (['--tags', 'scope', 'service=db'], lambda e: tagged(e, 'scope') and tagged(e, 'service', 'db')),
+    (['--suppressed', 'no'], lambda e: e['suppressed'] == '0'),
+    (['--suppressed', 'yes', '-A'], lambda e: e['suppressed'] == '1'),
+    (['--min-severity', 'warning', '--tags', 'service=web', '--suppressed', 'no', '-A'],
+     lambda e: severity(e) >= 2 and tagged(e, 'service', 'web') and e['suppressed'] == '0'),
+]
+
+EVENT_CASES = [
+    ([], lambda e: True),
+    (['-P', '--min-severity', 'high'], lambda e: severity(e) >= 4),
+    (['--max-severity', 'information'], lambda e: severity(e) <= 1),
+    (['-P', '--tags', 'service=db', '--suppressed', 'no'],
+     lambda e: tagged(e, 'service', 'db') and e['suppressed'] == '0'),
+    (['-m'], monitored),
+    (['-m', '-P', '--min-severity', 'average', '--tags', 'scope~avail'],
+     lambda e: monitored(e) and severity(e) >= 3 and tagged(e, 'scope', 'avail', True)),
+]
+
+def rows(output, pattern):
+    ''' the parsed lines of an output, eventid is the 4th field'''
+    found = []
+    for line in output.splitlines():
+        match = pattern.match(line)
+        if not match:
+            sys.exit("Error: Unexpected output line: " + line)
+        found.append(match.groups())
+    return found
+
+def check(script, before, common, cases, pattern, events):
+    failed = 0
+    for options, wanted in cases:
+        # the old script for the same selection, without the new options
+        old_options = [o for o in options if o in ('-A', '-P', '-O')]
+        server.reset()
+        old = rows(standin.run(before, common + old_options, home, check=False).stdout, pattern)
+        old_calls = server.reset()
+        # without the trigger cache, so both expand all the trigger descriptions
+        new = rows(standin.run(script, common + ['--no-cache'] + options, home, check=False).stdout, pattern)
+        new_calls = server.reset()
+
+        expected = [row for row in old if wanted(events[row[3]])]
+        method = 'problem.get' if script == 'zgetproblem.py' else 'event.get'
+        old_rows = sum(c['rows'] for c in old_calls if c['method'] == method)
+        new_rows = sum(c['rows'] for c in new_calls if c['method'] == method)
+        old_bytes = sum(c['response_bytes'] for c in old_calls)
+        new_bytes = sum(c['response_bytes'] for c in new_calls)
+        ok = new == expected and new_rows == len(expected) and (new_rows < old_rows or not options) \
+            and new_bytes < old_bytes
+        failed += not ok
+        print("%-4s %s %s" % ("ok" if ok else "FAIL", script, " ".join(options)))
+        print("     lines %d (expected %d of %d), %s rows %d -> %d, calls %d -> %d, response bytes %d -> %d" %
+              (len(new), len(expected), len(old), method, old_rows, new_rows, len(old_calls), len(new_calls),
+               old_bytes, new_bytes))
+        if new != expected and args.verbose:
+            for row in sorted(set(expected) - set(new)):
+                print("     missing: " + " ".join(row))
+            for row in sorted(set(new) - set(expected)):
+                print("     unexpected: " + " ".join(row))
+    return failed
+
+
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+                                 description='Check that the server-side filters of zgetproblem.py and zeventfinder.py return the same rows as filtering the old output.',
+                                 epilog="""
+Needs a git checkout, the old scripts are taken from the --before revision.
+Exits with status 1 when a case fails.
+""")
+parser.add_argument('--before',
+                    help='Git revision of the scripts without the filters, default is the parent of the first commit tagged [user-026]')
+parser.add_argument('--hosts', type=int, default=300, help='Number of generated hosts, default is 300')
+parser.add_argument('--seed', type=int, default=1, help='Seed of the generated data, default is 1')
+parser.add_argument('-v', '--verbose', help='Print the missing and unexpected lines', action='store_true')
+args = parser.parse_args()
+if not args.before:
+    args.before = standin.tagged_commit('user-026') + "^"
+
+fixture = standin.Fixture(hosts=args.hosts, seed=args.seed)
+server = standin.StandIn(fixture).start()
+with tempfile.TemporaryDirectory() as home:
+    standin.write_config(home, server.url)
+    failed = check('zgetproblem.py', standin.git_version('zgetproblem.py', args.before, home),
+                   ['--all-hosts', '-L', '0'], PROBLEM_CASES, PROBLEM_LINE,
+                   {p['eventid']: p for p in fixture.problems})
+    failed += check('zeventfinder.py', standin.git_version('zeventfinder.py', args.before, home),
+                    ['--all-hosts', '-L', '0'], EVENT_CASES, EVENT_LINE,
+                    {e['eventid']: e for e in fixture.events})
+server.stop()
+
+if failed:
+    sys.exit("Error: %d case(s) failed" % failed)
+print("All cases passed")
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+#
+# Measure the API traffic saved by requesting only the used fields
+#
+# Runs zgetproblem.py and zeventfinder.py as they were before and after the
+# problem/event/trigger lookups were trimmed to the fields that are printed
+# (--before and --after, by default the first commit tagged [user-027] and its
+# parent) against the stand-in API, and prints the response bytes and server
+# time of every API method.
+# The printed lines have to be the same.
+#
+# The server time is the time the stand-in needs to build and encode the
+# responses, it follows the amount of objects and fields (and the macro
+# expansion of trigger comments) but it is not the time of a real server.
+#
+import argparse
+import re
+import sys
+import tempfile
+
+import standin
+
+# (script, options) of every output mode; zeventfinder.py -i is left out,
+# before the trimmed lookups it failed sorting the events
+CASES = [('zgetproblem.py', []),
+         ('zgetproblem.py', ['-o', 'html']),
+         ('zgetproblem.py', ['-i']),
+         ('zeventfinder.py', [])]
+
+def measure(script, options):
+    '''
+    Run the script args.runs times, return the printed lines and the
+    {method: [calls, response bytes, server time]} of the fastest run
+    '''
+    best = None
+    for run in range(args.runs):
+        server.reset()
+        output = standin.run(script, ['--all-hosts', '-L', '0'] + options, home).stdout
+        methods = {}
+        for call in server.reset():
+            method = methods.setdefault(call['method'], [0, 0, 0.0])
+            method[0] += 1
+            method[1] += call['response_bytes']
+            method[2] += call['server_time']
+        if best is None or sum(m[2] for m in methods.values()) < sum(m[2] for m in best.values()):
+            best = methods
+    # the age of the problems changes with time
+    return re.sub(r' \[Age: [^]]*\]', '', output), best
+
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+                                 description='Measure the response bytes and server time saved by requesting only the used fields in zgetproblem.py and zeventfinder.py.',
+                                 epilog="""
+Needs a git checkout, the scripts are taken from the --before and --after
+revisions. Exits with status 1 when the printed lines differ.
+""")
+parser.add_argument('--before',
+                    help='Git revision of the scripts requesting all the fields, default is the parent of the --after one')
+parser.add_argument('--after',
+                    help='Git revision of the scripts requesting only the used fields, default is the first commit tagged [user-027]')
+parser.add_argument('--hosts', type=int, default=300, help='Number of generated hosts, default is 300')
+parser.add_argument('--seed', type=int, default=1, help='Seed of the generated data, default is 1')
+parser.add_argument('--runs', type=int, default=3,
+                    help='Runs of every case, the fastest one is reported, default is 3')
+args = parser.parse_args()
+if not args.after:
+    args.after = standin.tagged_commit('user-027')
+if not args.before:
+    args.before = args.after + "^"
+
+fixture = standin.Fixture(hosts=args.hosts, seed=args.seed)
+server = standin.StandIn(fixture).start()
+different = 0
+with tempfile.TemporaryDirectory() as home:
+    standin.write_config(home, server.url)
+    for script, options in CASES:
+        before_output, before = measure(standin.git_version(script, args.before, home), options)
+        after_output, after = measure(standin.git_version(script, args.after, home), options)
+        same = before_output == after_output
+        different += not same
+        print("%s %s (%d lines%s)" % (script, " ".join(options) or "(default output)",
+                                      len(after_output.splitlines()), "" if same else ", OUTPUT DIFFERS"))
+        print("  %-12s %12s %12s %7s %10s %10s %7s" % ("method", "bytes before", "bytes after", "saved",
+                                                         "ms before", "ms after", "saved"))
+        totals = [0, 0, 0.0, 0.0]
+        for method in sorted(set(before) | set(after)):
+            b = before.get(method, [0, 0, 0.0])
+            a = after.get(method, [0, 0, 0.0])
+            totals = [totals[0] + b[1], totals[1] + a[1], totals[2] + b[2], totals[3] + a[2]]
+            if method in ('apiinfo.version', 'user.login', 'user.logout'):
+                continue
+            label = method if b[0] == a[0] else "%s (%d/%d)" % (method, b[0], a[0])
+            print("  %-12s %12d %12d %6.0f%% %10.1f %10.1f %6.0f%%" %
+                  (label, b[1], a[1], 100.0 * (b[1] - a[1]) / max(b[1], 1),
+                   1000 * b[2], 1000 * a[2], 100.0 * (b[2] - a[2]) / max(b[2], 1e-9)))
+        print("  %-12s %12d %12d %6.0f%% %10.1f %10.1f %6.0f%%" %
+              ("total", totals[0], totals[1], 100.0 * (totals[0] - totals[1]) / max(totals[0], 1),
+               1000 * totals[2], 1000 * totals[3], 100.0 * (totals[2] - totals[3]) / max(totals[2], 1e-9)))
+server.stop()
+
+if different:
+    sys.exit("Error: The output of %d case(s) differs" % different)
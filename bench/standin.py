@@ -0,0 +1,799 @@
+#!/usr/bin/env python3
+#
+# Stand-in Zabbix API server for the scripts in bench/
+#
+# Serves a deterministic, generated data set (hosts, host groups, templates,
+# triggers, problems, events, items with history and trends) over JSON-RPC,
+# with optional injected latency. Every call is logged with the size of the
+# request and response and the time the server spent on it, so the scripts
+# can be run against it unchanged and their API traffic compared.
+#
+# Only the methods and parameters used by the z*.py scripts are implemented,
+# unknown parameters are ignored.
+#
+import argparse
+import configparser
+import json
+import math
+import os
+import os.path
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The repository root, where the z*.py scripts live
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SEVERITIES = ['NOT CLASSIFIED', 'INFORMATION', 'WARNING', 'AVERAGE', 'HIGH', 'DISASTER']
+
+# (name, key, value_type, units) of the items created on every host
+ITEMS = [("CPU utilization", "system.cpu.util", 0, "%"),
+         ("Free disk space on $1", "vfs.fs.size[/,free]", 3, "B"),
+         ("Free disk space on $1", "vfs.fs.size[/var,free]", 3, "B"),
+         ("Number of processes", "proc.num", 3, ""),
+         ("Load average ($1)", "system.cpu.load[avg1]", 0, ""),
+         ("Agent version", "agent.version", 1, "")]
+
+# (description, comments, expression) of the triggers created on every host
+TRIGGERS = [("High CPU utilization on {HOST.NAME}",
+             "CPU utilization on {HOST.NAME} ({HOST.HOST}) is too high for too long, "
+             "check the processes running on the host. Last value: {ITEM.LASTVALUE}",
+             "min(/{HOST.HOST}/system.cpu.util,5m)>90"),
+            ("{HOST.NAME}: Disk space is low",
+             "Free disk space on / of {HOST.NAME} is below the threshold. "
+             "Clean up or extend the filesystem before it fills up. Last value: {ITEM.LASTVALUE}",
+             "last(/{HOST.HOST}/vfs.fs.size[/,free])<1G"),
+            ("Too many processes on {HOST.NAME}",
+             "The number of processes on {HOST.NAME} has been above the limit for 5 minutes.",
+             "min(/{HOST.HOST}/proc.num,5m)>500"),
+            ("{HOST.NAME} is unavailable by ICMP",
+             "Last three attempts returned timeout. Please check device connectivity of {HOST.NAME}.",
+             "max(/{HOST.HOST}/icmpping,#3)=0"),
+            ("Zabbix agent on {HOST.NAME} is not available",
+             "For passive checks only, the availability of the agent(s) and a host is used "
+             "with {$AGENT.TIMEOUT} as a time threshold.",
+             "max(/{HOST.HOST}/zabbix[host,agent,available],{$AGENT.TIMEOUT})=0"),
+            ("{HOST.NAME} has been restarted",
+             "The host uptime is less than 10 minutes.",
+             "last(/{HOST.HOST}/system.uptime)<10m")]
+
+TEMPLATES = ["Linux by Zabbix agent", "ICMP Ping", "Zabbix server health", "Apache by HTTP",
+             "MySQL by Zabbix agent"]
+
+INVENTORY_FIELDS = ['type', 'name', 'alias', 'os', 'os_short', 'serialno_a', 'tag',
+                    'macaddress_a', 'hardware', 'software', 'contact', 'location', 'vendor', 'model']
+
+# Fields of the objects as returned with output=extend (Zabbix 7.0)
+HOST_DEFAULTS = {'proxyid': '0', 'ipmi_authtype': '-1', 'ipmi_privilege': '2', 'ipmi_username': '',
+                 'ipmi_password': '', 'maintenanceid': '0', 'maintenance_type': '0',
+                 'maintenance_from': '0', 'flags': '0', 'templateid': '0', 'tls_connect': '1',
+                 'tls_accept': '1', 'tls_issuer': '', 'tls_subject': '', 'custom_interfaces': '0',
+                 'vendor_name': '', 'vendor_version': '', 'proxy_groupid': '0', 'monitored_by': '0',
+                 'active_available': '1', 'assigned_proxyid': '0'}
+TRIGGER_DEFAULTS = {'url': '', 'value': '0', 'error': '', 'templateid': '0', 'type': '0', 'state': '0',
+                    'flags': '0', 'recovery_mode': '0', 'recovery_expression': '', 'correlation_mode': '0',
+                    'correlation_tag': '', 'manual_close': '0', 'opdata': '', 'event_name': '',
+                    'url_name': ''}
+EVENT_DEFAULTS = {'source': '0', 'object': '0', 'c_eventid': '0', 'correlationid': '0', 'userid': '0',
+                  'cause_eventid': '0', 'opdata': '', 'urls': []}
+ITEM_DEFAULTS = {'type': '0', 'snmp_oid': '', 'delay': '1m', 'history': '31d', 'trends': '365d',
+                 'status': '0', 'trapper_hosts': '', 'templateid': '0', 'valuemapid': '0', 'params': '',
+                 'ipmi_sensor': '', 'authtype': '0', 'username': '', 'password': '', 'publickey': '',
+                 'privatekey': '', 'flags': '0', 'interfaceid': '0', 'description': '', 'inventory_link': '0',
+                 'lifetime': '30d', 'evaltype': '0', 'jmx_endpoint': '', 'master_itemid': '0', 'timeout': '',
+                 'url': '', 'query_fields': [], 'posts': '', 'status_codes': '200', 'follow_redirects': '1',
+                 'post_type': '0', 'http_proxy': '', 'headers': [], 'retrieve_mode': '0', 'request_method': '0',
+                 'output_format': '0', 'ssl_cert_file': '', 'ssl_key_file': '', 'ssl_key_password': '',
+                 'verify_peer': '0', 'verify_host': '0', 'allow_traps': '0', 'state': '0', 'error': '',
+                 'prevvalue': ''}
+
+
+class Fixture:
+    """
+    Deterministic data set: the same arguments always give the same objects,
+    apart from the clocks which are relative to "now".
+    Every 17th host is disabled, every 13th host is in maintenance and every
+    19th host stopped sending values two days ago (its items have no last value).
+    """
+
+    def __init__(self, hosts=200, groups=10, seed=1, now=None, days=7):
+        rnd = random.Random(seed)
+        self.now = int(now or time.time())
+        self.days = days
+        self.groups = [{'groupid': str(100 + i), 'name': "Group %02d" % i, 'flags': '0',
+                        'uuid': "%032x" % (100 + i)} for i in range(groups)]
+        self.templates = [{'templateid': str(200 + i), 'host': "Template " + name, 'name': name,
+                           'description': "Generated template " + name, 'uuid': "%032x" % (200 + i)}
+                          for i, name in enumerate(TEMPLATES)]
+        self.hosts = []
+        self.interfaces = []
+        self.host_groups = {}
+        self.host_templates = {}
+        self.inventory = {}
+        for i in range(hosts):
+            hostid = str(10001 + i)
+            name = "host%04d" % (i + 1)
+            self.hosts.append(dict(HOST_DEFAULTS, hostid=hostid, host=name, name=name.upper(),
+                                   status='1' if i % 17 == 16 else '0',
+                                   maintenance_status='1' if i % 13 == 12 else '0',
+                                   description="Generated host %d" % (i + 1),
+                                   inventory_mode='-1' if i % 11 == 10 else '0',
+                                   uuid="%032x" % (10001 + i)))
+            self.host_groups[hostid] = [self.groups[i % groups]['groupid']] + \
+                ([self.groups[(i // groups) % groups]['groupid']] if i % 3 == 0 else [])
+            self.host_templates[hostid] = [self.templates[0]['templateid'], self.templates[1]['templateid']] + \
+                [self.templates[2 + i % 3]['templateid']]
+            if i % 11 != 10:
+                self.inventory[hostid] = {
+                    'type': rnd.choice(['server', 'vm', 'container']), 'name': name, 'alias': '',
+                    'os': rnd.choice(['Linux 6.1.0-18-amd64', 'Linux 5.14.0-362.el9.x86_64',
+                                      'Windows Server 2022']),
+                    'os_short': rnd.choice(['debian', 'rhel', 'windows']),
+                    'serialno_a': "SN%08d" % rnd.randrange(10**8), 'tag': '',
+                    'macaddress_a': "52:54:00:%02x:%02x:%02x" % (rnd.randrange(256), rnd.randrange(256),
+                                                                 rnd.randrange(256)),
+                    'hardware': '', 'software': '', 'contact': "ops-%d@example.com" % (i % 4),
+                    'location': rnd.choice(['dc1', 'dc2', 'cloud']),
+                    'vendor': rnd.choice(['Dell', 'HPE', 'Lenovo', 'QEMU']),
+                    'model': rnd.choice(['R640', 'DL360', 'SR650', 'Standard PC'])}
+            self.interfaces.append({'interfaceid': str(30001 + i), 'hostid': hostid, 'main': '1', 'type': '1',
+                                    'useip': '1', 'ip': "10.%d.%d.%d" % (i // 65536, (i // 256) % 256, i % 256),
+                                    'dns': '', 'port': '10050', 'available': '1', 'error': '',
+                                    'errors_from': '0', 'disable_until': '0'})
+
+        self.triggers = []
+        self.trigger_tags = {}
+        self.items = []
+        for host in self.hosts:
+            for j, (description, comments, expression) in enumerate(TRIGGERS):
+                triggerid = str(int(host['hostid']) * 100 + j)
+                self.triggers.append(dict(TRIGGER_DEFAULTS, triggerid=triggerid, description=description,
+                                          comments=comments, expression=expression, status='0',
+                                          priority=str(rnd.randrange(6)), hostid=host['hostid'],
+                                          lastchange=str(self.now - rnd.randrange(86400 * days)),
+                                          uuid="%032x" % int(triggerid)))
+                self.trigger_tags[triggerid] = [{'tag': 'scope', 'value': rnd.choice(['availability',
+                                                                                      'performance',
+                                                                                      'capacity'])},
+                                                {'tag': 'service', 'value': rnd.choice(['web', 'db', 'mail'])}]
+            for j, (name, key, value_type, units) in enumerate(ITEMS):
+                itemid = str(int(host['hostid']) * 100 + j)
+                self.items.append(dict(ITEM_DEFAULTS, itemid=itemid, hostid=host['hostid'], name=name,
+                                       key_=key, value_type=str(value_type), units=units,
+                                       uuid="%032x" % int(itemid)))
+        self.stopped = {host['hostid']: self.now - 2 * 86400 for i, host in enumerate(self.hosts) if i % 19 == 18}
+        for item in self.items:
+            if item['hostid'] in self.stopped:
+                item.update(lastclock='0', lastns='0', lastvalue='')
+                continue
+            clock = self.now - self.now % 60
+            item['lastclock'] = str(clock)
+            item['lastns'] = '0'
+            item['lastvalue'] = self.value(item, clock)
+
+        # Problems are the open problem events, events also contain the
+        # resolved problems and their recovery (OK) events. They all happened
+        # in the last days-1 days, so they stay inside the default time period
+        # (one week) of the scripts while a check is running
+        self.problems = []
+        self.events = []
+        eventid = 1000000
+        for trigger in self.triggers:
+            for n in range(rnd.choice([0, 0, 0, 1, 1, 2])):
+                eventid += 2
+                clock = self.now - rnd.randrange(86400 * (days - 1))
+                event = dict(EVENT_DEFAULTS, eventid=str(eventid), objectid=trigger['triggerid'],
+                             clock=str(clock), ns=str(rnd.randrange(10**9)), name=trigger['description'],
+                             severity=trigger['priority'], acknowledged=str(int(rnd.random() < 0.3)),
+                             suppressed=str(int(rnd.random() < 0.1)), r_eventid='0', value='1',
+                             tags=[dict(tag) for tag in self.trigger_tags[trigger['triggerid']]])
+                if n == 0 and rnd.random() < 0.6:
+                    self.problems.append(dict(event, r_clock='0', r_ns='0'))
+                    self.events.append(event)
+                else:
+                    rclock = min(self.now, clock + rnd.randrange(60, 7200))
+                    self.events.append(dict(event, r_eventid=str(eventid + 1)))
+                    self.events.append(dict(event, eventid=str(eventid + 1), clock=str(rclock), value='0',
+                                            severity='0', r_eventid='0'))
+
+        self.hostmap = {host['hostid']: host for host in self.hosts}
+        self.triggermap = {trigger['triggerid']: trigger for trigger in self.triggers}
+
+    def value(self, item, clock):
+        ''' the value of an item at a given clock, as a string like the API returns it'''
+        phase = int(item['itemid']) % 97
+        level = math.sin(clock / 3600.0 + phase)
+        if item['value_type'] == '0':
+            return "%.4f" % (50 + 40 * level)
+        elif item['value_type'] == '3':
+            return str(int(2**30 * (2 + level)))
+        return "7.0.%d" % (clock // 86400 % 10)
+
+    def expand(self, text, trigger):
+        ''' expand the host macros the way expandDescription/expandComment do'''
+        host = self.hostmap[trigger['hostid']]
+        return text.replace("{HOST.NAME}", host['name']).replace("{HOST.HOST}", host['host'])
+
+
+# Parameter helpers
+def idlist(value):
+    if value is None:
+        return None
+    if not isinstance(value, list):
+        value = [value]
+    return set(str(v) for v in value)
+
+def project(obj, output, private=()):
+    ''' apply the output parameter to an object'''
+    if output in (None, 'extend', True):
+        return {k: v for k, v in obj.items() if k not in private}
+    if isinstance(output, str):
+        output = [output]
+    return {k: obj[k] for k in output if k in obj and k not in private}
+
+def match_filter(obj, filter):
+    for field, wanted in (filter or {}).items():
+        if field not in obj:
+            continue
+        if not isinstance(wanted, list):
+            wanted = [wanted]
+        if str(obj[field]) not in [str(w) for w in wanted]:
+            return False
+    return True
+
+def match_search(obj, search, params):
+    ''' case-insensitive search, like the API: substring unless startSearch'''
+    for field, pattern in (search or {}).items():
+        if field not in obj or pattern is None:
+            continue
+        patterns = pattern if isinstance(pattern, list) else [pattern]
+        found = False
+        for pattern in patterns:
+            pattern = re.escape(str(pattern))
+            if params.get('searchWildcardsEnabled'):
+                pattern = pattern.replace(r'\*', '.*')
+            if not params.get('startSearch'):
+                pattern = '.*' + pattern
+            if re.match(pattern, str(obj[field]), re.IGNORECASE | re.DOTALL):
+                found = True
+        if not found:
+            return False
+    return True
+
+def sort_limit(objs, params):
+    fields = params.get('sortfield')
+    if fields:
+        orders = params.get('sortorder', 'ASC')
+        if not isinstance(fields, list):
+            fields = [fields]
+        if not isinstance(orders, list):
+            orders = [orders] * len(fields)
+        for field, order in reversed(list(zip(fields, orders + ['ASC'] * len(fields)))):
+            objs.sort(key=lambda o: int(o[field]) if str(o.get(field, '')).lstrip('-').isdigit()
+                      else str(o.get(field, '')), reverse=(order == 'DESC'))
+    if params.get('limit'):
+        objs = objs[:int(params['limit'])]
+    return objs
+
+def tag_match(tags, wanted):
+    for tag in tags:
+        if tag['tag'] != wanted['tag']:
+            continue
+        operator = int(wanted.get('operator', 0))
+        value = wanted.get('value', '')
+        if operator == 4 or (operator == 1 and tag['value'] == value) or \
+                (operator == 0 and value.lower() in tag['value'].lower()):
+            return True
+    return False
+
+def tags_match(tags, wanted, evaltype):
+    if not wanted:
+        return True
+    results = [tag_match(tags, w) for w in wanted]
+    if int(evaltype or 0) == 2:
+        return any(results)
+    # And/Or: tags with the same name are or-ed, different names and-ed
+    names = {}
+    for w, result in zip(wanted, results):
+        names[w['tag']] = names.get(w['tag'], False) or result
+    return all(names.values())
+
+
+class API:
+    '''The JSON-RPC methods, method "host.get" is API.host_get()'''
+
+    def __init__(self, fixture):
+        self.fx = fixture
+        self.sessions = set()
+
+    def call(self, method, params):
+        handler = getattr(self, method.replace('.', '_'), None)
+        if handler is None:
+            raise ValueError("Incorrect method \"%s\"." % method)
+        return handler(params or {})
+
+    def apiinfo_version(self, params):
+        return "7.0.0"
+
+    def user_login(self, params):
+        if params.get('password') != 'zabbix':
+            raise ValueError("Incorrect user name or password or account is temporarily blocked.")
+        sessionid = "%032x" % random.getrandbits(128)
+        self.sessions.add(sessionid)
+        return sessionid
+
+    def user_checkAuthentication(self, params):
+        if params.get('sessionid') not in self.sessions:
+            raise ValueError("Session terminated, re-login, please.")
+        return {'sessionid': params['sessionid']}
+
+    def user_logout(self, params):
+        return True
+
+    def result(self, objs, params, key):
+        if params.get('countOutput'):
+            return str(len(objs))
+        objs = sort_limit(objs, params)
+        if params.get('preservekeys'):
+            return {o[key]: o for o in objs}
+        return objs
+
+    def select_hosts(self, spec, hostids):
+        return [project(self.fx.hostmap[h], spec) for h in hostids]
+
+    # host groups, templates, hosts and interfaces
+    def hostgroup_get(self, params):
+        groupids = idlist(params.get('groupids'))
+        hostids = idlist(params.get('hostids'))
+        result = []
+        for group in self.fx.groups:
+            members = [h for h, g in self.fx.host_groups.items() if group['groupid'] in g]
+            if groupids is not None and group['groupid'] not in groupids:
+                continue
+            if hostids is not None and not hostids.intersection(members):
+                continue
+            if not match_filter(group, params.get('filter')) or \
+                    not match_search(group, params.get('search'), params):
+                continue
+            obj = project(group, params.get('output'))
+            if params.get('selectHosts'):
+                obj['hosts'] = self.select_hosts(params['selectHosts'], members)
+            result.append(obj)
+        return self.result(result, params, 'groupid')
+
+    def hostgroup_exists(self, params):
+        return any(g['groupid'] == str(params.get('groupid')) or g['name'] == params.get('name')
+                   for g in self.fx.groups)
+
+    def template_get(self, params):
+        templateids = idlist(params.get('templateids'))
+        hostids = idlist(params.get('hostids'))
+        result = []
+        for template in self.fx.templates:
+            members = [h for h, t in self.fx.host_templates.items() if template['templateid'] in t]
+            if templateids is not None and template['templateid'] not in templateids:
+                continue
+            if hostids is not None and not hostids.intersection(members):
+                continue
+            if not match_filter(template, params.get('filter')) or \
+                    not match_search(template, params.get('search'), params):
+                continue
+            obj = project(template, params.get('output'))
+            if params.get('selectHosts'):
+                obj['hosts'] = self.select_hosts(params['selectHosts'], members)
+            if params.get('selectParentTemplates'):
+                obj['parentTemplates'] = []
+            result.append(obj)
+        return self.result(result, params, 'templateid')
+
+    def host_objects(self, params):
+        hostids = idlist(params.get('hostids'))
+        groupids = idlist(params.get('groupids'))
+        templateids = idlist(params.get('templateids'))
+        for host in self.fx.hosts:
+            hostid = host['hostid']
+            if hostids is not None and hostid not in hostids:
+                continue
+            if groupids is not None and not groupids.intersection(self.fx.host_groups[hostid]):
+                continue
+            if templateids is not None and not templateids.intersection(self.fx.host_templates[hostid]):
+                continue
+            if params.get('monitored_hosts') and host['status'] != '0':
+                continue
+            if params.get('withInventory') and hostid not in self.fx.inventory:
+                continue
+            if not match_filter(host, params.get('filter')) or \
+                    not match_search(host, params.get('search'), params):
+                continue
+            yield host
+
+    def host_get(self, params):
+        result = []
+        for host in self.host_objects(params):
+            hostid = host['hostid']
+            obj = project(host, params.get('output'))
+            inventory = params.get('selectInventory')
+            if inventory:
+                if hostid in self.fx.inventory:
+                    obj['inventory'] = dict(project(self.fx.inventory[hostid], inventory), hostid=hostid,
+                                            inventory_mode=host['inventory_mode'])
+                else:
+                    obj['inventory'] = []
+            for select in ['selectHostGroups', 'selectGroups']:
+                if params.get(select):
+                    obj['hostgroups' if select == 'selectHostGroups' else 'groups'] = \
+                        [project(g, params[select]) for g in self.fx.groups
+                         if g['groupid'] in self.fx.host_groups[hostid]]
+            if params.get('selectParentTemplates'):
+                obj['parentTemplates'] = [project(t, params['selectParentTemplates']) for t in self.fx.templates
+                                          if t['templateid'] in self.fx.host_templates[hostid]]
+            if params.get('selectInterfaces'):
+                obj['interfaces'] = [project(i, params['selectInterfaces']) for i in self.fx.interfaces
+                                     if i['hostid'] == hostid]
+            result.append(obj)
+        return self.result(result, params, 'hostid')
+
+    def host_exists(self, params):
+        return any(h['hostid'] == str(params.get('hostid')) or h['host'] == params.get('host')
+                   for h in self.fx.hosts)
+
+    def hostinterface_get(self, params):
+        hostids = idlist(params.get('hostids'))
+        result = [project(i, params.get('output')) for i in self.fx.interfaces
+                  if (hostids is None or i['hostid'] in hostids) and match_filter(i, params.get('filter'))]
+        return self.result(result, params, 'interfaceid')
+
+    def graph_get(self, params):
+        # two graphs per host, from its items
+        graphids = idlist(params.get('graphids'))
+        hostids = idlist(params.get('hostids'))
+        result = []
+        for host in self.fx.hosts:
+            hostid = host['hostid']
+            if hostids is not None and hostid not in hostids:
+                continue
+            for j, (name, key) in enumerate([("CPU utilization", 'system.cpu.util'),
+                                             ("Disk space usage", 'vfs.fs.size[/,free]')]):
+                graphid = str(int(hostid) * 10 + j)
+                if graphids is not None and graphid not in graphids:
+                    continue
+                obj = project({'graphid': graphid, 'name': name, 'width': '900', 'height': '200',
+                               'graphtype': '0'}, params.get('output'))
+                if params.get('selectGraphItems'):
+                    obj['gitems'] = [{'gitemid': item['itemid'], 'graphid': graphid, 'itemid': item['itemid'],
+                                      'sortorder': '0', 'color': '1A7C11', 'drawtype': '0', 'yaxisside': '0',
+                                      'calc_fnc': '2', 'type': '0'}
+                                     for item in self.fx.items if item['hostid'] == hostid and item['key_'] == key]
+                if params.get('selectHosts'):
+                    obj['hosts'] = self.select_hosts(params['selectHosts'], [hostid])
+                result.append(obj)
+        return self.result(result, params, 'graphid')
+
+    # triggers, problems and events
+    def trigger_get(self, params):
+        triggerids = idlist(params.get('triggerids'))
+        hostids = idlist(params.get('hostids'))
+        groupids = idlist(params.get('groupids'))
+        result = []
+        for trigger in self.fx.triggers:
+            if triggerids is not None and trigger['triggerid'] not in triggerids:
+                continue
+            if hostids is not None and trigger['hostid'] not in hostids:
+                continue
+            if groupids is not None and not groupids.intersection(self.fx.host_groups[trigger['hostid']]):
+                continue
+            if not match_filter(trigger, params.get('filter')):
+                continue
+            obj = project(trigger, params.get('output'), private=('hostid',))
+            if params.get('expandDescription') and 'description' in obj:
+                obj['description'] = self.fx.expand(obj['description'], trigger)
+            if params.get('expandComment') and 'comments' in obj:
+                obj['comments'] = self.fx.expand(obj['comments'], trigger)
+            if params.get('selectHosts'):
+                obj['hosts'] = self.select_hosts(params['selectHosts'], [trigger['hostid']])
+            result.append(obj)
+        return self.result(result, params, 'triggerid')
+
+    def event_objects(self, events, params):
+        eventids = idlist(params.get('eventids'))
+        objectids = idlist(params.get('objectids'))
+        hostids = idlist(params.get('hostids'))
+        groupids = idlist(params.get('groupids'))
+        severities = idlist(params.get('severities'))
+        for event in events:
+            trigger = self.fx.triggermap[event['objectid']]
+            if eventids is not None and event['eventid'] not in eventids:
+                continue
+            if objectids is not None and event['objectid'] not in objectids:
+                continue
+            if hostids is not None and trigger['hostid'] not in hostids:
+                continue
+            if groupids is not None and not groupids.intersection(self.fx.host_groups[trigger['hostid']]):
+                continue
+            if 'value' in params and event['value'] not in idlist(params['value']):
+                continue
+            if 'acknowledged' in params and event['acknowledged'] != str(int(bool(params['acknowledged']))):
+                continue
+            if 'suppressed' in params and event['suppressed'] != str(int(bool(params['suppressed']))):
+                continue
+            if severities is not None and event['severity'] not in severities:
+                continue
+            if params.get('time_from') and int(event['clock']) < int(params['time_from']):
+                continue
+            if params.get('time_till') and int(event['clock']) > int(params['time_till']):
+                continue
+            if params.get('eventid_from') and int(event['eventid']) < int(params['eventid_from']):
+                continue
+            if not tags_match(event['tags'], params.get('tags'), params.get('evaltype')):
+                continue
+            yield event, trigger
+
+    def events(self, events, params):
+        result = []
+        for event, trigger in self.event_objects(events, params):
+            obj = project(event, params.get('output'), private=('tags',))
+            if params.get('selectTags'):
+                obj['tags'] = [project(t, params['selectTags']) for t in event['tags']]
+            if params.get('selectHosts'):
+                obj['hosts'] = self.select_hosts(params['selectHosts'], [trigger['hostid']])
+            if params.get('selectRelatedObject'):
+                obj['relatedObject'] = project(trigger, params['selectRelatedObject'], private=('hostid',))
+            result.append(obj)
+        return self.result(result, params, 'eventid')
+
+    def problem_get(self, params):
+        return self.events(self.fx.problems, params)
+
+    def event_get(self, params):
+        return self.events(self.fx.events, params)
+
+    # items, history and trends
+    def item_get(self, params):
+        itemids = idlist(params.get('itemids'))
+        hostids = idlist(params.get('hostids'))
+        groupids = idlist(params.get('groupids'))
+        templateids = idlist(params.get('templateids'))
+        filter = dict(params.get('filter') or {})
+        hostnames = filter.pop('host', params.get('host'))
+        if hostnames is not None:
+            hostnames = idlist(hostnames)
+        if params.get('group'):
+            groupids = set(g['groupid'] for g in self.fx.groups if g['name'] == params['group'])
+        result = []
+        for item in self.fx.items:
+            host = self.fx.hostmap[item['hostid']]
+            if itemids is not None and item['itemid'] not in itemids:
+                continue
+            if hostids is not None and item['hostid'] not in hostids:
+                continue
+            if groupids is not None and not groupids.intersection(self.fx.host_groups[item['hostid']]):
+                continue
+            if templateids is not None and not templateids.intersection(self.fx.host_templates[item['hostid']]):
+                continue
+            if hostnames is not None and host['host'] not in hostnames:
+                continue
+            if params.get('monitored') and host['status'] != '0':
+                continue
+            obj = dict(item)
+            if params.get('expandName'):
+                obj['name'] = expand_name(item['name'], item['key_'])
+            if not match_filter(obj, filter) or not match_search(obj, params.get('search'), params):
+                continue
+            obj = project(obj, params.get('output'))
+            if params.get('selectHosts'):
+                obj['hosts'] = self.select_hosts(params['selectHosts'], [item['hostid']])
+            result.append(obj)
+        return self.result(result, params, 'itemid')
+
+    def history_items(self, params, value_types=None):
+        itemids = idlist(params.get('itemids'))
+        for item in self.fx.items:
+            if itemids is not None and item['itemid'] not in itemids:
+                continue
+            if value_types is not None and item['value_type'] not in value_types:
+                continue
+            yield item
+
+    def history_get(self, params):
+        now = self.fx.now - self.fx.now % 60
+        tfrom = max(int(params.get('time_from') or 0), now - 86400 * self.fx.days)
+        ttill = min(int(params.get('time_till') or now), now)
+        start = tfrom + (-tfrom) % 60
+        result = []
+        for item in self.history_items(params, idlist(params.get('history', 3))):
+            for clock in range(start, min(ttill, self.fx.stopped.get(item['hostid'], ttill)) + 1, 60):
+                result.append({'itemid': item['itemid'], 'clock': str(clock), 'value': self.fx.value(item, clock),
+                               'ns': str(int(item['itemid']) % 1000 * 1000)})
+        result = [project(r, params.get('output')) for r in result]
+        return self.result(result, params, 'itemid')
+
+    def trend_get(self, params):
+        now = self.fx.now - self.fx.now % 3600
+        tfrom = max(int(params.get('time_from') or 0), now - 86400 * self.fx.days)
+        ttill = min(int(params.get('time_till') or now), now)
+        start = tfrom + (-tfrom) % 3600
+        result = []
+        for item in self.history_items(params, {'0', '3'}):
+            for clock in range(start, min(ttill, self.fx.stopped.get(item['hostid'], ttill)) + 1, 3600):
+                values = [float(self.fx.value(item, c)) for c in range(clock, clock + 3600, 600)]
+                fmt = "%.4f" if item['value_type'] == '0' else "%d"
+                result.append({'itemid': item['itemid'], 'clock': str(clock), 'num': '60',
+                               'value_min': fmt % min(values), 'value_avg': fmt % (sum(values) / len(values)),
+                               'value_max': fmt % max(values)})
+        result = [project(r, params.get('output')) for r in result]
+        return self.result(result, params, 'itemid')
+
+def expand_name(name, key):
+    ''' replace $1..$9 in an item name by the parameters of its key'''
+    if '[' not in key:
+        return name
+    keyparams = key[key.index('[') + 1:key.rindex(']')].split(',')
+    for n in range(9, 0, -1):
+        name = name.replace("$%d" % n, keyparams[n - 1] if n <= len(keyparams) else "")
+    return name
+
+
+class StandIn:
+    """
+    Run the stand-in server in a background thread:
+
+        server = StandIn(Fixture(hosts=500), latency=0.05).start()
+        ... server.url, server.calls ...
+        server.stop()
+
+    latency is added to every call, methods listed in fail answer with an
+    API error. Every call is appended to calls as a dict with method,
+    params, request_bytes, response_bytes, server_time (seconds, without
+    the injected latency) and rows (number of objects in the result).
+    """
+
+    def __init__(self, fixture=None, latency=0.0, fail=(), port=0):
+        self.api = API(fixture or Fixture())
+        self.latency = latency
+        self.fail = set(fail)
+        self.calls = []
+        self.lock = threading.Lock()
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                started = time.perf_counter()
+                request = json.loads(body)
+                method = request.get('method', '')
+                params = request.get('params')
+                response = {'jsonrpc': '2.0', 'id': request.get('id')}
+                result = None
+                try:
+                    if method in standin.fail:
+                        raise ValueError("Injected failure of %s." % method)
+                    result = response['result'] = standin.api.call(method, params)
+                except Exception as e:
+                    response['error'] = {'code': -32500, 'message': "Application error.", 'data': str(e)}
+                out = json.dumps(response).encode()
+                elapsed = time.perf_counter() - started
+                with standin.lock:
+                    standin.calls.append({'method': method, 'params': params, 'request_bytes': len(body),
+                                          'response_bytes': len(out), 'server_time': elapsed,
+                                          'rows': len(result) if isinstance(result, (list, dict)) else 1})
+                if standin.latency:
+                    time.sleep(standin.latency)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+        class Server(ThreadingHTTPServer):
+            # the default backlog of 5 makes concurrent clients wait for a SYN retry
+            request_queue_size = 128
+            daemon_threads = True
+
+        self.httpd = Server(('127.0.0.1', port), Handler)
+        self.url = "http://127.0.0.1:%d/" % self.httpd.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset(self):
+        with self.lock:
+            calls, self.calls = self.calls, []
+        return calls
+
+
+def write_config(home, url, instances=()):
+    """
+    Write $HOME/.zabbix-api.conf for the stand-in at url, with a
+    [Zabbix API <name>] section for every name in instances (the url of an
+    instance can also be given as a (name, url) tuple)
+    """
+    config = configparser.ConfigParser()
+    config["Zabbix API"] = {'username': 'Admin', 'password': 'zabbix', 'api': url, 'no_verify': 'false'}
+    for instance in instances:
+        name, iurl = instance if isinstance(instance, tuple) else (instance, url)
+        config["Zabbix API " + name] = {'username': 'Admin', 'password': 'zabbix', 'api': iurl,
+                                        'no_verify': 'false'}
+    path = os.path.join(home, ".zabbix-api.conf")
+    with open(path, "w") as f:
+        config.write(f)
+    return path
+
+def run(script, args, home, cwd=None, check=True):
+    """
+    Run one of the scripts (a name in the repository root or a path) with
+    HOME set to home, return the CompletedProcess with an extra elapsed
+    attribute (wall time in seconds)
+    """
+    if not os.path.isabs(script):
+        script = os.path.join(ROOT, script)
+    env = dict(os.environ, HOME=home, TZ='UTC')
+    started = time.perf_counter()
+    proc = subprocess.run([sys.executable, script] + list(args), env=env, cwd=cwd or home,
+                          capture_output=True, text=True)
+    proc.elapsed = time.perf_counter() - started
+    if check and proc.returncode != 0:
+        sys.exit("Error: %s %s failed (%d):\n%s" % (os.path.basename(script), " ".join(args),
+                                                    proc.returncode, proc.stderr))
+    return proc
+
+def git_version(script, rev, directory):
+    ''' write the script as it was in git revision rev to directory, return its path'''
+    source = subprocess.run(["git", "-C", ROOT, "show", "%s:%s" % (rev, script)], capture_output=True,
+                            text=True, check=True).stdout
+    path = os.path.join(directory, "%s-%s" % (rev, script))
+    with open(path, "w") as f:
+        f.write(source)
+    return path
+
+def tagged_commit(tag):
+    '''
+    the first commit whose subject starts with [tag] (the request of a change,
+    like user-026), so the revisions of a change survive a rebase
+    '''
+    commits = subprocess.run(["git", "-C", ROOT, "log", "--reverse", "--format=%h", "--grep=^\\[%s\\]" % tag],
+                             capture_output=True, text=True, check=True).stdout.split()
+    if not commits:
+        sys.exit("Error: No commit tagged [%s] in this checkout, give the revisions with --before/--after" % tag)
+    return commits[0]
+
+def summary(calls):
+    ''' number of calls, response bytes and server time of a list of calls'''
+    return (len(calls), sum(c['response_bytes'] for c in calls), sum(c['server_time'] for c in calls))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     description='Stand-in Zabbix API server with generated data.', epilog="""
+Serve the generated data set until interrupted, e.g. to try a script by hand:
+
+standin.py --port 18080 --latency 0.05 --hosts 500 --home /tmp/standin
+HOME=/tmp/standin zgetproblem.py --all-hosts
+""")
+    parser.add_argument('--port', type=int, default=18080, help='Port to listen on, default is 18080')
+    parser.add_argument('--hosts', type=int, default=200, help='Number of hosts, default is 200')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the generated data, default is 1')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every call')
+    parser.add_argument('--home', help='Write a .zabbix-api.conf for the server in this directory')
+    args = parser.parse_args()
+
+    server = StandIn(Fixture(hosts=args.hosts, seed=args.seed), latency=args.latency, port=args.port)
+    if args.home:
+        write_config(args.home, server.url)
+    print("Serving %d hosts on %s" % (args.hosts, server.url))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,30 @@
+#
+# Topology snapshot file shared by zsnapshot.py and the finder scripts
+#
+# zsnapshot.py saves the hosts, groups, templates, interfaces and graphs with
+# their links and name indexes as gzipped JSON, by default one file per API
+# URL/user in $HOME/.cache/zabbix-api-utils, and the finders read it back
+# with --offline or --snapshot FILE.
+#
+import gzip
+import json
+import sys
+
+from triggercache import cachefile_path, replaced_file
+
+
+def snapshot_path(api, username):
+    ''' Default snapshot location, one per URL/user'''
+    return cachefile_path(api, username, "snapshot") + ".gz"
+
+def load_snapshot(path):
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError) as e:
+        sys.exit("Error: Could not read snapshot " + path + " (" + str(e) + "), run zsnapshot.py first")
+
+def save_snapshot(path, snapshot):
+    ''' Write the snapshot, readable only by the owner'''
+    with replaced_file(path, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as file:
+        json.dump(snapshot, file, separators=(',', ':'))
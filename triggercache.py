@@ -0,0 +1,132 @@
+#
+# Trigger metadata cache shared by zgetproblem.py and zeventfinder.py
+#
+# Expanded trigger descriptions (with their hosts) are kept per API URL/user
+# in $HOME/.cache/zabbix-api-utils/triggers-<hash>.json, so the macro
+# expansion on the server side is only done for new, changed or expired
+# triggers. Descriptions with macros ({ITEM.LASTVALUE}, {HOST.NAME}, ...) are
+# not cached: their values change between runs, so they are expanded on
+# every run.
+#
+# cachefile_path and replaced_file are used for the other cache files too.
+#
+import contextlib
+import hashlib
+import json
+import os
+import os.path
+import tempfile
+import time
+
+from apiflow import chunked, merged
+
+
+def cachefile_path(api, username, name):
+    """
+    Return the path of a per URL/user cache file in $HOME/.cache/zabbix-api-utils
+    """
+    cachedir = os.path.join(os.getenv("HOME", "."), ".cache", "zabbix-api-utils")
+    key = hashlib.sha1((api + "|" + username).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(cachedir, name + "-" + key + ".json")
+
+@contextlib.contextmanager
+def replaced_file(path, mode="w"):
+    """
+    Open a temporary file of its own next to path, readable by the owner
+    only, that replaces path when the block ends without error; concurrent
+    runs never write the same file and readers never see a partial one
+    """
+    fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                   prefix=os.path.basename(path) + ".")
+    try:
+        with os.fdopen(fd, mode, **({} if "b" in mode else {'encoding': "utf-8"})) as file:
+            yield file
+        os.replace(tmpfile, path)
+    except BaseException:
+        os.unlink(tmpfile)
+        raise
+
+def load_trigger_cache(cachefile):
+    try:
+        with open(cachefile, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def has_macros(description):
+    return "{" in description
+
+def save_trigger_cache(cachefile, cache, ttl, now):
+    ''' Write the cache without the entries older than ttl seconds or with macros'''
+    cache = {t: c for t, c in cache.items() if now - c['fetched'] <= ttl and not has_macros(c['raw'])}
+    try:
+        os.makedirs(os.path.dirname(cachefile), mode=0o700, exist_ok=True)
+        with replaced_file(cachefile) as file:
+            json.dump(cache, file)
+    except OSError:
+        pass
+
+def stale_triggers(cache, current, ttl, now):
+    """
+    Return the triggerids in current (raw definitions) that have to be
+    expanded again, refresh priority and status of the others
+    """
+    stale = []
+    for triggerid, trigger in current.items():
+        cached = cache.get(triggerid)
+        if (not cached or cached['raw'] != trigger['description'] or now - cached['fetched'] > ttl
+                or has_macros(cached['raw'])):
+            stale.append(triggerid)
+        else:
+            cached['priority'] = trigger['priority']
+            cached['status'] = trigger['status']
+    return stale
+
+def update_trigger_cache(cache, current, expanded, now):
+    for triggerid, trigger in expanded.items():
+        if triggerid not in current:
+            continue
+        cache[triggerid] = {
+            'description': trigger['description'],
+            'raw': current[triggerid]['description'],
+            'priority': current[triggerid]['priority'],
+            'status': current[triggerid]['status'],
+            'hosts': [{'host': h['host']} for h in trigger['hosts']],
+            'fetched': now
+        }
+
+def get_triggers(triggerids, cachefile=None, ttl=3600):
+    """
+    API flow (see apiflow.py) returning trigger description (with expanded
+    macros), priority, status and host keyed by triggerid, like
+    trigger.get(preservekeys=1) would.
+    Expanded triggers are kept in cachefile: a cheap trigger.get without macro
+    expansion revalidates them while the triggers that are not cached at all
+    are expanded, and only changed triggers or triggers older than ttl seconds
+    are expanded afterwards. Triggers with macros in their description are
+    never saved, so they are expanded on every run.
+    """
+    triggerids = list(set(str(t) for t in triggerids))
+    if not cachefile:
+        return merged((yield chunked('trigger.get', 'triggerids', triggerids,
+                                     output=['triggerid', 'description', 'priority', 'status'],
+                                     expandDescription=1, preservekeys=1, selectHosts=['host'])))
+    cache = load_trigger_cache(cachefile)
+    missing = [t for t in triggerids if t not in cache]
+    # Raw (unexpanded) definitions: no macro expansion on the server side
+    raw = chunked('trigger.get', 'triggerids', triggerids,
+                  output=['triggerid', 'description', 'priority', 'status'], preservekeys=1)
+    results = yield raw + chunked('trigger.get', 'triggerids', missing, output=['triggerid', 'description'],
+                                  expandDescription=1, preservekeys=1, selectHosts=['host'])
+    current = merged(results[:len(raw)])
+    expanded = merged(results[len(raw):])
+    now = int(time.time())
+    update_trigger_cache(cache, current, expanded, now)
+    stale = [t for t in stale_triggers(cache, current, ttl, now) if t not in expanded]
+    if stale:
+        expanded = merged((yield chunked('trigger.get', 'triggerids', stale, output=['triggerid', 'description'],
+                                         expandDescription=1, preservekeys=1, selectHosts=['host'])))
+        update_trigger_cache(cache, current, expanded, now)
+    if current:
+        save_trigger_cache(cachefile, cache, ttl, now)
+    return {t: cache[t] for t in current if t in cache}
@@ -9,6 +9,8 @@ import sys
 import textwrap
 import time
 from zabbix_utils import ZabbixAPI
+from triggercache import cachefile_path, get_triggers
+import apiflow
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
 
@@ -84,6 +86,32 @@ def alertstatusmap(status, atype=0):
     return map[status]
 
 
+# Zabbix severity parser: accepts a numeric level (0-5) or a severity name
+def severityparse(value):
+    names = ['NOT CLASSIFIED', 'INFORMATION',
+             'WARNING', 'AVERAGE', 'HIGH', 'DISASTER']
+    value = value.strip().upper().replace('_', ' ')
+    if value.isdigit() and int(value) < 6:
+        return int(value)
+    if value in names:
+        return names.index(value)
+    raise argparse.ArgumentTypeError("invalid severity: %s" % value)
+
+# Zabbix tag filter parser:
+#  "tag"       -> tag exists
+#  "tag=value" -> tag equals value
+#  "tag~value" -> tag contains value
+def tagparse(value):
+    if '=' in value:
+        tag, tvalue = value.split('=', 1)
+        return {'tag': tag, 'value': tvalue, 'operator': 1}
+    elif '~' in value:
+        tag, tvalue = value.split('~', 1)
+        return {'tag': tag, 'value': tvalue, 'operator': 0}
+    else:
+        return {'tag': value, 'operator': 4}
+
+
 # set default vars
 try:
     defconf = os.getenv("HOME") + "/.zabbix-api.conf"
@@ -133,8 +161,27 @@ group3.add_argument('-s', '--start-time',
                     help='Unix timestamp to search from', type=int)
 group3.add_argument(
     '-f', '--follow', help='Follow events as they occur', action='store_true')
+parser.add_argument('--min-severity', type=severityparse,
+                    help='Only show events with at least this severity (name or 0-5)')
+parser.add_argument('--max-severity', type=severityparse,
+                    help='Only show events with at most this severity (name or 0-5)')
+parser.add_argument('--tags', type=tagparse, nargs='+',
+                    help='Only show events matching these tags: "tag" (exists), "tag=value" (equals) or "tag~value" (contains)')
+parser.add_argument('--tag-evaltype', choices=["and", "or"], default="and",
+                    help='How to combine multiple --tags, default is and.')
+parser.add_argument('--suppressed', choices=["yes", "no"],
+                    help='Only show suppressed (yes) or unsuppressed (no) events, default is both.')
+parser.add_argument(
+    '-m', '--monitored', help='Only show events for monitored hosts (enabled and not in maintenance)', action='store_true')
+parser.add_argument('--cache-ttl', type=int, default=3600,
+                    help='Seconds before a cached trigger description is expanded again, default is 3600. '
+                         'Descriptions with macros ({ITEM.LASTVALUE}, {HOST.NAME}, ...) are not cached '
+                         'and expanded on every run.')
+parser.add_argument('--no-cache', help='Do not use the trigger metadata cache', action='store_true')
 parser.add_argument(
     '-i', '--ids', help='Output only eventids', action='store_true')
+parser.add_argument('--async', dest='use_async', action='store_true',
+                    help='Use the asyncio API client (needs aiohttp): independent API calls are run at the same time')
 parser.add_argument('-u', '--username', help='User for the Zabbix api')
 parser.add_argument('-p', '--password',
                     help='Password for the Zabbix api user')
@@ -197,26 +244,28 @@ if noverify == True:
 else:
     verify = True
 
-# Create instance, get url, login and password from user config file
-zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
-
 ##################################
 # Start actual API logic
 ##################################
 
+# Expanded trigger descriptions are cached between runs
+if args.no_cache:
+    trigger_cache = None
+else:
+    trigger_cache = cachefile_path(api, username, "triggers")
+
 # Base API call
-call = {'sortfield': 'clock', 'sortorder': 'DESC',
-        'output': 'extend', 'source': 0}
+call = {'sortfield': 'clock', 'sortorder': 'DESC', 'source': 0}
 
 if args.limit != 0:
     call['limit'] = args.limit
 
+# Only request the fields we actually use: host, trigger description and
+# severity are taken from the trigger.get below
 if args.ids:
-    call['output'] = 'eventid'
+    call['output'] = ['eventid']
 else:
-    call['output'] = 'extend'
-    call['selectHosts'] = 'extend'
-    call['selectRelatedObject'] = 'extend'
+    call['output'] = ['eventid', 'clock', 'value', 'acknowledged', 'objectid']
 
 if args.problem:
     call['value'] = 1
@@ -235,114 +284,160 @@ if args.time_period != 0:
     else:
         call['time_from'] = int(time.time())-args.time_period
 
-if args.hostgroups:
-    if args.numeric:
-        # We are getting numeric hostgroup ID's, let put them in a list
-        # (ignore any non digit items)
-        hgids = [s for s in args.hostgroups if s.isdigit()]
-        for hgid in hgids:
-            exists = zapi.hostgroup.exists(groupid=hgid)
-            if not exists:
-                sys.exit("Error: Hostgroupid "+hgid+" does not exist")
-    else:
-        # We are using hostgroup names, let's resolve them to ids.
-        # First, get the named hostgroups via an API call
-        hglookup = zapi.hostgroup.get(filter=({'name': args.hostgroups}))
-
-        # hgids will hold the numeric hostgroup ids
-        hgids = []
-        for hg in range(len(hglookup)):
-            # Create the list of hostgroup ids
-            hgids.append(int(hglookup[hg]['groupid']))
-
-    if len(hgids) > 0:
-        call['groupids'] = hgids
-    else:
-        sys.exit("Error: No hostgroups found")
-
-elif args.hostnames:
-    if args.numeric:
-        # We are getting numeric host ID's, let put them in a list
-        # (ignore any non digit items)
-        hids = [s for s in args.hostnames if s.isdigit()]
-        for hid in hids:
-            exists = zapi.host.exists(hostid=hid)
-            if not exists:
-                sys.exit("Error: Hostid "+hid+" does not exist")
-    else:
-        # We are using hostnames, let's resolve them to ids.
-        # Get hosts via an API call
-        hlookup = zapi.host.get(
-            output='hostid', filter=({'host': args.hostnames}))
-        hids = []
-        for h in range(len(hlookup)):
-            # Create the list of hostgroup ids
-            hids.append(int(hlookup[h]['hostid']))
-
-    if len(hids) > 0:
-        call['hostids'] = hids
-    else:
-        sys.exit("Error: No hosts found")
-
-elif args.triggerids:
-    tids = [s for s in args.triggerids]
-    if len(tids) > 0:
-        call['objectids'] = tids
+# Let the server do the filtering on severity, tags and suppression
+if args.min_severity is not None or args.max_severity is not None:
+    minsev = args.min_severity if args.min_severity is not None else 0
+    maxsev = args.max_severity if args.max_severity is not None else 5
+    if minsev > maxsev:
+        sys.exit("Error: --min-severity is higher than --max-severity")
+    call['severities'] = list(range(minsev, maxsev+1))
+
+if args.tags:
+    call['tags'] = args.tags
+    # evaltype: 0 - And/Or, 2 - Or
+    if args.tag_evaltype == "or":
+        call['evaltype'] = 2
     else:
-        sys.exit("Error: No triggers found")
+        call['evaltype'] = 0
+
+if args.suppressed:
+    call['suppressed'] = (args.suppressed == "yes")
+
+def print_events(events, triggers=None):
+    '''
+    print events (only eventids without triggers), return the last eventid
+    '''
+    if triggers is None:
+        for event in sorted(events, key=lambda e: int(e['eventid'])):
+            eventid = event['eventid']
+            print(eventid)
+        return eventid
+    #for event in sorted(events):
+    for event in events:
+        eventid = event['eventid']
+        etime = timestr(event['clock'])
+        hostname = "<Unknown Host>"
+        trigger = "<Unknown Trigger>"
+        triggerid = "<Unknown Triggerid>"
+        severity = "<Unknown Severity>"
+        try:
+            hostname = triggers[event['objectid']
+                                ]['hosts'][0]['host']
+            trigger = triggers[event['objectid']]['description']
+            severity = severitymap(
+                triggers[event['objectid']]['priority'])
+            triggerid = event['objectid']
+        except:
+            pass
+        state = statusmap(event['value'])
+        acked = ackmap(event['acknowledged'])
+        if acked == True:
+            acknowledged = "Ack: Yes"
+        else:
+            acknowledged = "Ack: No"
+        print("%s %s: %s [%s] %s [%s](%s|%s)" % (etime, hostname, state, eventid, trigger, triggerid, severity, acknowledged))
+        if args.follow:
+            sys.stdout.flush()
+    return eventid
+
+def find_events():
+    '''
+    API flow (see apiflow.py): select the hosts, then print the events (every
+    5 seconds the new ones with --follow)
+    '''
+    if args.hostgroups:
+        if args.numeric:
+            # We are getting numeric hostgroup ID's, let put them in a list
+            # (ignore any non digit items)
+            hgids = [s for s in args.hostgroups if s.isdigit()]
+            exists = yield [apiflow.call('hostgroup.exists', groupid=hgid) for hgid in hgids]
+            for hgid, found in zip(hgids, exists):
+                if not found:
+                    sys.exit("Error: Hostgroupid "+hgid+" does not exist")
+        else:
+            # We are using hostgroup names, let's resolve them to ids.
+            # First, get the named hostgroups via an API call
+            hglookup = yield apiflow.call('hostgroup.get', output=['groupid'], filter=({'name': args.hostgroups}))
+
+            # hgids will hold the numeric hostgroup ids
+            hgids = [int(hg['groupid']) for hg in hglookup]
+
+        if len(hgids) > 0:
+            call['groupids'] = hgids
+        else:
+            sys.exit("Error: No hostgroups found")
+
+    elif args.hostnames:
+        if args.numeric:
+            # We are getting numeric host ID's, let put them in a list
+            # (ignore any non digit items)
+            hids = [s for s in args.hostnames if s.isdigit()]
+            exists = yield [apiflow.call('host.exists', hostid=hid) for hid in hids]
+            for hid, found in zip(hids, exists):
+                if not found:
+                    sys.exit("Error: Hostid "+hid+" does not exist")
+        else:
+            # We are using hostnames, let's resolve them to ids.
+            # Get hosts via an API call
+            hlookup = yield apiflow.call('host.get', output='hostid', filter=({'host': args.hostnames}))
+            hids = [int(h['hostid']) for h in hlookup]
+
+        if len(hids) > 0:
+            call['hostids'] = hids
+        else:
+            sys.exit("Error: No hosts found")
+
+    elif args.triggerids:
+        tids = [s for s in args.triggerids]
+        if len(tids) > 0:
+            call['objectids'] = tids
+        else:
+            sys.exit("Error: No triggers found")
+
+    if args.monitored:
+        # Resolve the enabled hosts that are not in maintenance with a single
+        # host.get and let event.get only return events for those hosts
+        hcall = {'output': ['hostid'],
+                 'monitored_hosts': True,
+                 'filter': {'maintenance_status': 0}}
+        if 'groupids' in call:
+            hcall['groupids'] = call['groupids']
+        if 'hostids' in call:
+            hcall['hostids'] = call['hostids']
+        mhosts = yield apiflow.call('host.get', **hcall)
+        call['hostids'] = [int(h['hostid']) for h in mhosts]
+        if len(call['hostids']) == 0:
+            sys.exit("Error: No monitored hosts found")
 
-try:
     while True:
-        events = zapi.event.get(**call)
+        events = yield apiflow.call('event.get', **call)
         if events:
             if args.ids:
-                for event in sorted(events):
-                    eventid = event['eventid']
-                    print(eventid)
+                eventid = print_events(events)
             else:
                 triggerids = [event['objectid'] for event in events]
-                triggers = zapi.trigger.get(triggerids=triggerids, output='extend',
-                                            expandDescription=1, preservekeys=1, expandComment=1, selectHosts='extend')
-                #for event in sorted(events):
-                for event in events:
-                    eventid = event['eventid']
-                    etime = timestr(event['clock'])
-                    hostname = "<Unknown Host>"
-                    trigger = "<Unknown Trigger>"
-                    triggerid = "<Unknown Triggerid>"
-                    severity = "<Unknown Severity>"
-                    try:
-                        hostname = triggers[event['objectid']
-                                            ]['hosts'][0]['host']
-                        trigger = triggers[event['objectid']]['description']
-                        severity = severitymap(
-                            triggers[event['objectid']]['priority'])
-                        triggerid = event['objectid']
-                    except:
-                        pass
-                    state = statusmap(event['value'])
-                    acked = ackmap(event['acknowledged'])
-                    if acked == True:
-                        acknowledged = "Ack: Yes"
-                    else:
-                        acknowledged = "Ack: No"
-                    print("%s %s: %s [%s] %s [%s](%s|%s)" % (etime, hostname, state, eventid, trigger, triggerid, severity, acknowledged))
-                    if args.follow:
-                        sys.stdout.flush()
+                triggers = yield from get_triggers(triggerids, trigger_cache, args.cache_ttl)
+                eventid = print_events(events, triggers)
         if not args.follow and not events:
             sys.exit("Error: No events found.")
 
         if not args.follow:
             break
-        call['eventid_from'] = int(eventid)+1
-        try:
-            del call['time_till']
-        except:
-            pass
-        time.sleep(5)
+        if events:
+            call['eventid_from'] = int(eventid)+1
+        call.pop('time_till', None)
+        yield 5
 
+try:
+    if args.use_async:
+        apiflow.run_async(find_events(), api, username, password, verify)
+    else:
+        # Create instance, get url, login and password from user config file
+        zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
+        try:
+            apiflow.run(zapi, find_events())
+        finally:
+            zapi.logout()
 except KeyboardInterrupt:
     pass
-
-zapi.logout()
 # And we're done...
@@ -4,6 +4,8 @@
 #
 import argparse
 import configparser
+import csv
+import math
 import os
 import os.path
 import distutils.util
@@ -11,13 +13,21 @@ import requests
 import time
 import sys
 import json
+import re
 import shutil
 import urllib3
 urllib3.disable_warnings()
 from io import StringIO
 from io import BytesIO
+from urllib.parse import urlparse
 from PIL import Image
+from PIL import UnidentifiedImageError
+from PIL import ImageDraw
+from PIL import ImageFont
 from zabbix_utils import ZabbixAPI
+from zabbix_utils import APIRequestError
+
+from triggercache import cachefile_path, replaced_file
 
 # define config helper function
 
@@ -34,6 +44,412 @@ def ConfigSectionMap(section):
             dict1[option] = None
     return dict1
 
+# units for relative times in Zabbix notation (now-1h, now-7d)
+TIME_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800, 'M': 2592000, 'y': 31536000}
+
+# longer periods are drawn from trends
+TRENDS_PERIOD = 2 * 86400
+
+def parse_time(value, now):
+    """
+    Convert a time in Zabbix notation (now, now-1h, a Unix timestamp or
+    "YYYY-MM-DD HH:MM:SS") to a Unix timestamp, for the local renderer
+    """
+    if value == 'now':
+        return now
+    match = re.match(r'now-(\d+)([smhdwMy]?)\Z', value)
+    if match:
+        return now - int(match.group(1)) * TIME_UNITS[match.group(2)]
+    if value.isdigit():
+        return int(value)
+    for timeformat in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return int(time.mktime(time.strptime(value, timeformat)))
+        except ValueError:
+            pass
+    sys.exit("Error: Time " + value + " can only be used with the frontend")
+
+def graph_items(zapi, graph):
+    """
+    Return the graph items (from selectGraphItems) in drawing order, with
+    the host, name, value type and units of their items
+    """
+    gitems = sorted(graph['gitems'], key=lambda gitem: int(gitem['sortorder']))
+    items = {item['itemid']: item for item in zapi.item.get(output=['itemid', 'name', 'key_', 'value_type', 'units'],
+                                                          selectHosts=['host'],
+                                                          itemids=[gitem['itemid'] for gitem in gitems])}
+    for gitem in gitems:
+        item = items[gitem['itemid']]
+        gitem.update(host=item['hosts'][0]['host'], name=item['name'], key_=item['key_'],
+                     value_type=item['value_type'], units=item['units'])
+    return gitems
+
+def graph_values(zapi, gitems, stime, etime, trends):
+    """
+    Return the history or trends of the graph items ({itemid: records} in
+    time order), with one history.get per value type or one trend.get
+    """
+    byvaluetype = {}
+    for gitem in gitems:
+        byvaluetype.setdefault(gitem['value_type'], []).append(gitem['itemid'])
+    if trends:
+        results = [zapi.trend.get(itemids=[gitem['itemid'] for gitem in gitems], time_from=stime, time_till=etime,
+                                  output='extend')]
+    else:
+        results = [zapi.history.get(itemids=itemids, history=value_type, time_from=stime, time_till=etime,
+                                    output='extend', sortfield='clock', sortorder='ASC')
+                   for value_type, itemids in byvaluetype.items()]
+    values = {gitem['itemid']: [] for gitem in gitems}
+    for records in results:
+        for record in records:
+            values[record['itemid']].append(record)
+    for records in values.values():
+        # trend.get does not sort
+        records.sort(key=lambda record: int(record['clock']))
+    return values
+
+def item_stats(records, trends):
+    """
+    Return the min, avg, max and last value of an item keyed by the graph
+    item function (calc_fnc: 1 min, 2 avg, 4 max, 9 last), None without values
+    """
+    if not records:
+        return None
+    if trends:
+        low = min(float(record['value_min']) for record in records)
+        high = max(float(record['value_max']) for record in records)
+        avg = sum(float(record['value_avg']) for record in records) / len(records)
+        last = float(records[-1]['value_avg'])
+    else:
+        values = [float(record['value']) for record in records]
+        low, high, avg, last = min(values), max(values), sum(values) / len(values), values[-1]
+    return {'1': low, '2': avg, '4': high, '9': last}
+
+def pixel_columns(records, stime, etime, width, trends):
+    """
+    Reduce the records of an item to (min, avg, max) per pixel column, None
+    for the columns without values
+    """
+    columns = [None] * width
+    period = max(etime - stime, 1)
+    for record in records:
+        x = min((int(record['clock']) - stime) * width // period, width - 1)
+        if x < 0:
+            continue
+        if trends:
+            low, avg, high = float(record['value_min']), float(record['value_avg']), float(record['value_max'])
+        else:
+            low = avg = high = float(record['value'])
+        column = columns[x]
+        if column is None:
+            columns[x] = [low, avg, high, 1]
+        else:
+            column[0] = min(column[0], low)
+            column[1] += avg
+            column[2] = max(column[2], high)
+            column[3] += 1
+    return [None if column is None else (column[0], column[1] / column[3], column[2]) for column in columns]
+
+def interpolate(values):
+    """
+    Fill the columns between two values linearly, the ones before the first
+    and after the last value stay None
+    """
+    known = [x for x, value in enumerate(values) if value is not None]
+    filled = list(values)
+    for left, right in zip(known, known[1:]):
+        for x in range(left + 1, right):
+            filled[x] = values[left] + (values[right] - values[left]) * (x - left) / (right - left)
+    return filled
+
+def axis_range(low, high):
+    """
+    Round an axis range to grid steps of 1, 2 or 5 times a power of 10
+    """
+    if high <= low:
+        high = low + 1
+    raw = (high - low) / 5
+    magnitude = 10 ** math.floor(math.log10(raw))
+    step = next(size * magnitude for size in (1, 2, 5, 10) if size * magnitude >= raw)
+    return math.floor(low / step) * step, math.ceil(high / step) * step, step
+
+def format_value(value, units):
+    # large values with K/M/G/T like the frontend, powers of 1024 for bytes
+    base = 1024 if units in ('B', 'Bps') else 1000
+    for power, prefix in ((4, 'T'), (3, 'G'), (2, 'M'), (1, 'K')):
+        if abs(value) >= base ** power:
+            return "%.4g %s%s" % (value / base ** power, prefix, units)
+    return ("%.4g %s" % (value, units)).strip()
+
+def color(gitem, lighten=0.0):
+    rgb = [int(gitem['color'][i:i+2], 16) for i in (0, 2, 4)]
+    return tuple(int(c + (255 - c) * lighten) for c in rgb)
+
+def draw_legend(draw, font, gitems, stats, x, y, pie=False):
+    total = sum(stats[gitem['gitemid']] for gitem in gitems if stats[gitem['gitemid']] is not None) if pie else 0
+    for gitem in gitems:
+        draw.rectangle([x, y + 2, x + 8, y + 10], fill=color(gitem), outline="black")
+        text = gitem['host'] + ": " + gitem['name']
+        value = stats[gitem['gitemid']]
+        if value is None:
+            text += "  [no data]"
+        elif pie:
+            text += "  " + format_value(value, gitem['units']) + ("  (%.1f%%)" % (value * 100 / total) if total else "")
+        else:
+            text += "  min " + format_value(value['1'], gitem['units']) + "  avg " + format_value(value['2'], gitem['units']) + \
+                    "  max " + format_value(value['4'], gitem['units'])
+        draw.text((x + 14, y), text, fill="black", font=font)
+        y += 14
+
+def render_lines(graph, gitems, values, stime, etime, width, height, trends):
+    """
+    Draw a normal (graphtype 0) or stacked (graphtype 1) graph of width x
+    height pixels plus axes and legend
+    """
+    stacked = graph['graphtype'] == '1'
+    right = any(gitem['yaxisside'] == '1' for gitem in gitems)
+    left_margin, right_margin, top_margin = 70, 70 if right else 20, 15
+    legend = 14 * len(gitems) + 10 if graph.get('show_legend', '1') == '1' else 0
+    image = Image.new("RGB", (width + left_margin + right_margin, height + top_margin + 30 + legend), "white")
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+
+    # one value per pixel column (by the item function), plus min/max for "all" (calc_fnc 7)
+    series = {}
+    for gitem in gitems:
+        columns = pixel_columns(values[gitem['itemid']], stime, etime, width, trends)
+        index = {'1': 0, '4': 2}.get(gitem['calc_fnc'], 1)
+        line = interpolate([None if column is None else column[index] for column in columns])
+        band = None
+        if gitem['calc_fnc'] == '7':
+            band = (interpolate([None if column is None else column[0] for column in columns]),
+                    interpolate([None if column is None else column[2] for column in columns]))
+        series[gitem['gitemid']] = (line, band)
+
+    # stacked items start on top of the previous items of the same axis
+    bases = {}
+    if stacked:
+        tops = {'0': [0.0] * width, '1': [0.0] * width}
+        for gitem in gitems:
+            line = series[gitem['gitemid']][0]
+            bases[gitem['gitemid']] = tops[gitem['yaxisside']]
+            tops[gitem['yaxisside']] = [base + (value or 0.0) for base, value in zip(tops[gitem['yaxisside']], line)]
+            series[gitem['gitemid']] = ([None if value is None else top for value, top in zip(line, tops[gitem['yaxisside']])], None)
+
+    # axis ranges, calculated from the values or fixed (ymin_type/ymax_type 1)
+    axes = {}
+    for side in ('0', '1'):
+        drawn = [value for gitem in gitems if gitem['yaxisside'] == side
+                 for part in (series[gitem['gitemid']][0],) + (series[gitem['gitemid']][1] or ())
+                 for value in part if value is not None]
+        if not drawn:
+            continue
+        low = min(drawn + [0.0]) if stacked else min(drawn)
+        high = max(drawn)
+        if graph.get('ymin_type') == '1':
+            low = float(graph['yaxismin'])
+        if graph.get('ymax_type') == '1':
+            high = float(graph['yaxismax'])
+        axes[side] = axis_range(low, high)
+
+    def ypos(value, side):
+        low, high, step = axes[side]
+        y = top_margin + height - (value - low) * height / (high - low)
+        return min(max(y, top_margin), top_margin + height)
+
+    # horizontal grid and axis labels
+    draw.rectangle([left_margin, top_margin, left_margin + width, top_margin + height], outline="gray")
+    for side, units in (('0', next((g['units'] for g in gitems if g['yaxisside'] == '0'), '')),
+                        ('1', next((g['units'] for g in gitems if g['yaxisside'] == '1'), ''))):
+        if side not in axes:
+            continue
+        low, high, step = axes[side]
+        count = int(round((high - low) / step))
+        for i in range(count + 1):
+            value = low + i * step
+            y = ypos(value, side)
+            draw.line([left_margin, y, left_margin + width, y], fill=(225, 225, 225))
+            label = format_value(value, units)
+            if side == '0':
+                draw.text((left_margin - 4 - draw.textlength(label, font=font), y - 6), label, fill="black", font=font)
+            else:
+                draw.text((left_margin + width + 4, y - 6), label, fill="black", font=font)
+
+    # vertical grid with time labels
+    period = max(etime - stime, 1)
+    step = next((size for size in (60, 300, 600, 1800, 3600, 10800, 21600, 43200, 86400, 604800, 2592000)
+                 if size >= period / 8), 2592000)
+    timeformat = "%H:%M" if period <= 86400 else "%m-%d %H:%M" if period <= 604800 else "%Y-%m-%d"
+    for clock in range(stime - stime % step + step, etime, step):
+        x = left_margin + (clock - stime) * width / period
+        draw.line([x, top_margin, x, top_margin + height], fill=(225, 225, 225))
+        label = time.strftime(timeformat, time.localtime(clock))
+        draw.text((x - draw.textlength(label, font=font) / 2, top_margin + height + 4), label, fill="black", font=font)
+
+    # the items, by draw style (drawtype): 0 line, 1 filled region, 2 bold line, 3 dot, 4 dashed line, 5 gradient line
+    for gitem in gitems:
+        side = gitem['yaxisside']
+        if side not in axes:
+            continue
+        line, band = series[gitem['gitemid']]
+        points = [(left_margin + x, ypos(value, side)) for x, value in enumerate(line) if value is not None]
+        if not points:
+            continue
+        if band:
+            low, high = band
+            draw.polygon([(left_margin + x, ypos(value, side)) for x, value in enumerate(high) if value is not None] +
+                         [(left_margin + x, ypos(value, side)) for x, value in reversed(list(enumerate(low))) if value is not None],
+                         fill=color(gitem, 0.75))
+        if stacked or gitem['drawtype'] in ('1', '5'):
+            if stacked:
+                base = bases[gitem['gitemid']]
+                bottom = [(left_margin + x, ypos(base[x], side)) for x, value in reversed(list(enumerate(line))) if value is not None]
+            else:
+                zero = min(max(0.0, axes[side][0]), axes[side][1])
+                bottom = [(points[-1][0], ypos(zero, side)), (points[0][0], ypos(zero, side))]
+            draw.polygon(points + bottom, fill=color(gitem, 0.5 if gitem['drawtype'] == '5' else 0.0))
+        if gitem['drawtype'] == '3':
+            draw.point(points, fill=color(gitem))
+        elif gitem['drawtype'] == '4':
+            for i in range(0, len(points) - 1, 8):
+                draw.line(points[i:i+5], fill=color(gitem), width=1)
+        else:
+            draw.line(points, fill=color(gitem), width=2 if gitem['drawtype'] == '2' else 1)
+
+    if legend:
+        stats = {gitem['gitemid']: item_stats(values[gitem['itemid']], trends) for gitem in gitems}
+        draw_legend(draw, font, gitems, stats, left_margin, top_margin + height + 24)
+    return image
+
+def render_pie(graph, gitems, values, width, height, trends):
+    """
+    Draw a pie (graphtype 2) or exploded (graphtype 3) graph, one slice per
+    item; a graph sum item (type 2) is the whole pie
+    """
+    legend = 14 * len(gitems) + 10 if graph.get('show_legend', '1') == '1' else 0
+    image = Image.new("RGB", (width, height + legend), "white")
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+    stats = {}
+    for gitem in gitems:
+        itemstats = item_stats(values[gitem['itemid']], trends)
+        stats[gitem['gitemid']] = None if itemstats is None else itemstats.get(gitem['calc_fnc'], itemstats['2'])
+    slices = [gitem for gitem in gitems if gitem['type'] != '2' and stats[gitem['gitemid']]]
+    total = next((stats[gitem['gitemid']] for gitem in gitems if gitem['type'] == '2'), None) or \
+            sum(stats[gitem['gitemid']] for gitem in slices)
+    radius = (min(width, height) - 40) / 2
+    offset = radius / 10 if graph['graphtype'] == '3' else 0
+    angle = -90.0
+    for gitem in slices:
+        extent = stats[gitem['gitemid']] * 360 / total if total else 0
+        middle = math.radians(angle + extent / 2)
+        x = width / 2 + offset * math.cos(middle)
+        y = height / 2 + offset * math.sin(middle)
+        draw.pieslice([x - radius, y - radius, x + radius, y + radius], angle, angle + extent,
+                      fill=color(gitem), outline="white")
+        angle += extent
+    if legend:
+        draw_legend(draw, font, [gitem for gitem in gitems if gitem['type'] != '2'], stats, 10, height, pie=True)
+    return image
+
+# graph item axis (yaxisside) and function (calc_fnc) names for exports
+AXES = {'0': 'left', '1': 'right'}
+FUNCTIONS = {'1': 'min', '2': 'avg', '4': 'max', '7': 'all', '9': 'last'}
+
+def number(value):
+    # unsigned values stay integers
+    return int(value) if value.isdigit() else float(value)
+
+def export_graph(gitems, values, trends):
+    """
+    Write the graph items and their values as CSV (one row per value) or as
+    NDJSON (one object per item with its values)
+    """
+    fields = ['value_min', 'value_avg', 'value_max'] if trends else ['value']
+    out = sys.stdout if args.filename == "-" else open(args.filename, "w", encoding="utf-8", newline="")
+    if args.export == 'csv':
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(['itemid', 'host', 'name', 'key', 'units', 'color', 'axis', 'function', 'clock'] + fields)
+    for gitem in gitems:
+        info = {'itemid': gitem['itemid'], 'host': gitem['host'], 'name': gitem['name'], 'key': gitem['key_'],
+                'units': gitem['units'], 'color': gitem['color'],
+                'axis': AXES.get(gitem['yaxisside'], gitem['yaxisside']),
+                'function': FUNCTIONS.get(gitem['calc_fnc'], gitem['calc_fnc'])}
+        records = values[gitem['itemid']]
+        if args.export == 'csv':
+            writer.writerows(list(info.values()) + [record['clock']] + [record[field] for field in fields]
+                             for record in records)
+        else:
+            info['columns'] = ['clock'] + fields
+            info['values'] = [[int(record['clock'])] + [number(record[field]) for field in fields] for record in records]
+            out.write(json.dumps(info) + "\n")
+    if out is not sys.stdout:
+        out.close()
+
+# start of every PNG file, anything else from the frontend is the login page
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+def load_sessions(cachefile):
+    """
+    Return the sessions saved by a previous run: 'zbx_session' the frontend
+    cookie, 'api_session' the API session id
+    """
+    try:
+        with open(cachefile, "r", encoding="utf-8") as file:
+            sessions = json.load(file)
+        return sessions if isinstance(sessions, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def save_sessions(cachefile, sessions):
+    # readable by the user only, the sessions are as good as the password
+    try:
+        os.makedirs(os.path.dirname(cachefile), mode=0o700, exist_ok=True)
+        with replaced_file(cachefile) as file:
+            json.dump(sessions, file)
+    except OSError:
+        pass
+
+def api_login(sessions):
+    """
+    Return a ZabbixAPI logged in with the API session of a previous run while
+    the server still knows it (user.checkAuthentication needs no login), else
+    with a new session saved for the next runs, and whether the session is
+    kept. With --no-cache or before Zabbix 5.4 (no token login) a plain login
+    that has to be logged out.
+    """
+    zapi = ZabbixAPI(url=api, validate_certs=verify)
+    if args.no_cache or zapi.version < 5.4:
+        zapi.login(user=username, password=password)
+        return zapi, False
+    sessionid = sessions.get('api_session')
+    if sessionid:
+        try:
+            zapi.user.checkAuthentication(sessionid=sessionid)
+        except APIRequestError:
+            sessionid = None
+    if not sessionid:
+        sessionid = zapi.user.login(username=username, password=password)
+        sessions['api_session'] = sessionid
+        save_sessions(cachefile, sessions)
+    zapi.login(token=sessionid)
+    return zapi, True
+
+def session_cookie(session, cookie=None):
+    """
+    Return the zbx_session cookie in the session: the one the frontend sent
+    when it sent one, else the saved cookie we put there
+    """
+    values = [jarcookie.value for jarcookie in session.cookies if jarcookie.name == 'zbx_session']
+    return next((value for value in values if value != cookie), cookie if cookie in values else None)
+
+def save_image(image):
+    # write the graph to file or stdout
+    if args.filename == "-":
+        image.save(sys.stdout.buffer, "PNG")
+    else:
+        image.save(args.filename)
+
 # set default vars
 try:
     defconf = os.getenv("HOME") + "/.zabbix-api.conf"
@@ -55,6 +471,23 @@ To use this type of storage, create a conf file (the default is $HOME/.zabbix-ap
  api=https://zabbix.mycompany.com/path/to/zabbix/frontend/
  no_verify=true
 
+The frontend and API sessions are saved (readable by the user only) per
+URL/user in $HOME/.cache/zabbix-api-utils and reused by the next runs, with a
+new login only when the frontend answers with its login page instead of a
+graph or the API no longer knows the session (Zabbix 5.4 and later, older
+servers get a login and logout per run).
+
+With -L the graph is drawn locally with Pillow from the history (trends for
+periods longer than 2 days or with --trends) of its items, fetched with one
+history.get per value type. This needs no frontend login and puts no load on
+the frontend; times must be now, now-N[smhdwMy], a Unix timestamp or
+"YYYY-MM-DD HH:MM:SS".
+
+With -E the numbers behind the graph are written instead, fetched the same
+way: as CSV with one row per value (itemid, host, name, key, units, color,
+axis, function, clock and value, or value_min, value_avg and value_max from
+trends), or as NDJSON with one object per item holding its values.
+
 """)
 parser.add_argument('graphid', help='The graph that we are going to download')
 parser.add_argument('-f', '--filename', required=True,
@@ -73,6 +506,14 @@ parser.add_argument('-W', '--width', type=int,
                     help='Width of the graph (defaults to the graph default)')
 parser.add_argument('-H', '--height', type=int,
                     help='Height of the graph (defaults to the graph default)')
+parser.add_argument('-L', '--local', action='store_true',
+                    help='Draw the graph locally from history/trends instead of downloading it from the frontend')
+parser.add_argument('--trends', action='store_true',
+                    help='With -L or -E, use trends (the default for periods longer than 2 days)')
+parser.add_argument('-E', '--export', choices=['csv', 'ndjson'],
+                    help='Write the graph items and their values as CSV or NDJSON to the file instead of a graph')
+parser.add_argument('--no-cache', action='store_true',
+                    help='Log in to the frontend and the API instead of reusing the sessions saved by a previous run')
 args = parser.parse_args()
 
 # load config module
@@ -127,8 +568,12 @@ if noverify == True:
 else:
     verify = True
 
+# The frontend and API sessions of a previous run are reused, saved per URL/user
+cachefile = cachefile_path(api, username, "frontend")
+sessions = load_sessions(cachefile)
+
 # Create instance, get url, login and password from user config file
-zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
+zapi, keep_session = api_login(sessions)
 
 ##################################
 # Start actual API logic
@@ -137,8 +582,11 @@ zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
 # set the graphid we are looking for (passed from command line)
 graphid = args.graphid
 
-# Find graph from API
-graph = zapi.graph.get(output="extend", graphids=graphid)
+# Find graph from API, with its items to draw it locally
+if args.local or args.export:
+    graph = zapi.graph.get(output="extend", graphids=graphid, selectGraphItems="extend")
+else:
+    graph = zapi.graph.get(output="extend", graphids=graphid)
 
 if graph:
     # print(format(graph))
@@ -152,6 +600,30 @@ if graph:
     else:
         height = graph[0]['height']
 
+    if args.local or args.export:
+        # Draw or export the graph from history/trends, no frontend involved
+        now = int(time.time())
+        stime = parse_time(args.starttime or 'now-1h', now)
+        etime = parse_time(args.endtime or 'now', now)
+        trends = args.trends or etime - stime > TRENDS_PERIOD
+        gitems = graph_items(zapi, graph[0])
+        values = graph_values(zapi, gitems, stime, etime, trends)
+        if args.export:
+            export_graph(gitems, values, trends)
+        elif graph[0]['graphtype'] in ("2", "3"):
+            graphpng = render_pie(graph[0], gitems, values, int(width), int(height), trends)
+            save_image(graphpng)
+        else:
+            graphpng = render_lines(graph[0], gitems, values, stime, etime, int(width), int(height), trends)
+            save_image(graphpng)
+        if not keep_session:
+            zapi.logout()
+        sys.exit()
+
+    # the rest is done by the frontend
+    if not keep_session:
+        zapi.logout()
+
     # Select the right graph generator according to graph type
     # type 3 = Exploded graph
     if graph[0]['graphtype'] == "3":
@@ -192,31 +664,51 @@ if graph:
     # setup a session object so we can reuse session cookies
     session = requests.session()
 
-    # use data and not params to avoid login in clear text in the apache logs
-    login = session.post(loginurl, data=logindata, headers=headers, verify=verify)
-
-    #session_cookies = session.cookies.get_dict()
-    #print(session_cookies)
+    cookie = None if args.no_cache else sessions.get('zbx_session')
+    # Build the request for the graph
+    graphurl = api + "/" + generator + "?graphid=" + str(graphid) + "&from=" + str(starttime) + "&to=" + str(endtime) + "&width=" + str(width) + "&height=" + str(height) + "&profileIdx=web.graphs.filter"
 
-    # See if we logged in successfully
     try:
-        if session.cookies['zbx_session']:
-            # Build the request for the graph
-            graphurl = api + "/" + generator + "?graphid=" + str(graphid) + "&from=" + str(starttime) + "&to=" + str(endtime) + "&width=" + str(width) + "&height=" + str(height) + "&profileIdx=web.graphs.filter"
-            # get the graph
-            graphreq = session.get(graphurl, verify=verify) #, headers=headers)
-            # read the data as an image
-            graphpng = Image.open(BytesIO(graphreq.content))
-            # and write it to file
-            if args.filename == "-":
-                graphpng.save(sys.stdout, "PNG")
-            else:
-                graphpng.save(args.filename)
-    except:
+        if cookie:
+            # scoped like the cookie the frontend sets, so a new one replaces it
+            frontend = urlparse(api)
+            session.cookies.set('zbx_session', cookie, domain=frontend.hostname, path=frontend.path or "/")
+        else:
+            # use data and not params to avoid login in clear text in the apache logs
+            login = session.post(loginurl, data=logindata, headers=headers, verify=verify)
+
+        #session_cookies = session.cookies.get_dict()
+        #print(session_cookies)
+
+        # See if we logged in successfully
+        if not session_cookie(session, cookie):
+            sys.exit("Error: Could not log in to retrieve graph")
+        # get the graph
+        graphreq = session.get(graphurl, verify=verify) #, headers=headers)
+        if cookie and not graphreq.content.startswith(PNG_SIGNATURE):
+            # the saved session expired and we got the login page, log in once more
+            session.cookies.clear()
+            cookie = None
+            login = session.post(loginurl, data=logindata, headers=headers, verify=verify)
+            graphreq = session.get(graphurl, verify=verify)
+    except requests.RequestException as e:
+        sys.exit("Error: Could not retrieve graph (" + str(e) + ")")
+
+    if not graphreq.content.startswith(PNG_SIGNATURE):
         sys.exit("Error: Could not log in to retrieve graph")
+    zbx_session = session_cookie(session, cookie)
+    if zbx_session and zbx_session != cookie:
+        sessions['zbx_session'] = zbx_session
+        save_sessions(cachefile, sessions)
+    try:
+        # read the data as an image
+        graphpng = Image.open(BytesIO(graphreq.content))
+        # and write it to file
+        save_image(graphpng)
+    except (UnidentifiedImageError, OSError) as e:
+        sys.exit("Error: Could not save graph (" + str(e) + ")")
 else:
+    if not keep_session:
+        zapi.logout()
     sys.exit("Error: Could not find graphid " + graphid)
 
-# And we're done...
-#zapi.logout()
-
@@ -7,8 +7,11 @@
 #
 import argparse
 import configparser
+import csv
+import json
 import os
 import os.path
+import re
 import distutils.util
 import requests
 import time
@@ -16,6 +19,8 @@ import sys
 from io import StringIO
 #from PIL import Image
 from zabbix_utils import ZabbixAPI
+import apiflow
+from triggercache import cachefile_path, replaced_file
 
 # define config helper function
 
@@ -51,9 +56,52 @@ To use this type of storage, create a conf file (the default is $HOME/.zabbix-ap
  api=https://zabbix.mycompany.com/path/to/zabbix/frontend/
  no_verify=true
 
+Items can be given as itemids or as host:key, e.g. "web001:system.uname".
+With -G the arguments are item keys (wildcards allowed) on all the hosts of
+a hostgroup. The item names are resolved once and kept in a cache in
+$HOME/.cache/zabbix-api-utils, so repeated runs skip the item lookup.
+
+With -G/-T the history of all the matching items is fetched in batches of
+items of the same value type (--batch), --workers calls at a time, and
+written as one stream with every line tagged with host:key, or to one file
+per host with -O:
+
+ zgethistory.py -G "Linux servers" -t 2592000 --trends -O capacity "vfs.fs.size[/,pused]"
+
+With -L the last value of many items is printed, taken from the lastvalue
+and lastclock item fields with a single item.get:
+
+ zgethistory.py -L 1001 1002 "web001:system.uname" "web002:system.uname"
+ zgethistory.py -L -G "Linux servers" system.uname
+
+With -M the items are resampled on a common time grid of STEP seconds, the
+last value at or before each grid point (forward filled), and written as one
+wide matrix: a CSV with a clock column and one column per item, or a .npy
+(clock as the first column) or .npz (clock, values and items arrays) file
+with --matrix-file. This needs numpy:
+
+ zgethistory.py -G "Linux servers" -t 86400 -M 300 --matrix-file load.npz "system.cpu.load[all,avg1]"
+
+With -D the values of every numeric item are reduced to about N points that
+keep the shape of the series for plotting, with Largest-Triangle-Three-Buckets
+(the default) or the minimum and maximum of every bucket (--downsample-method
+minmax):
+
+ zgethistory.py -t 2592000 -D 2000 -e 1030
+
+With -F csv the values are written as CSV, one row per value with the item,
+clock, ns and value (clock, num, value_min, value_avg and value_max with
+--trends). With -F npz the values are decoded once into typed arrays and
+saved with numpy to the -o file: an items array with the item labels and
+for item N the int64 arrays clock_N and ns_N (num_N with --trends) and the
+value_N array, float64 for float and uint64 for unsigned items (value_min_N,
+value_avg_N and value_max_N with --trends):
+
+ zgethistory.py -G "Linux servers" -t 86400 -F npz -o load.npz "system.cpu.load[all,avg1]"
+
 """)
 parser.add_argument(
-    'itemid', help='The item that we are going to query the history from')
+    'itemid', nargs='+', help='The item(s) that we are going to query the history from (itemid or host:key, item key with -G)')
 parser.add_argument('-u', '--username',
                     help='User for the Zabbix api and frontend')
 parser.add_argument('-p', '--password', help='Password for the Zabbix user')
@@ -70,6 +118,42 @@ parser.add_argument('-C', '--count', type=int,
                     help='Number of values returned')
 parser.add_argument('-e', '--extended',
                     help='Returns timestamps (Unixtime in nanoseconds), units and values seperated by a ":"', action='store_true')
+parser.add_argument('-L', '--latest', action='store_true',
+                    help='Print the last value of the item(s) from item.get instead of querying the history')
+parser.add_argument('--latest-window', type=int, default=604800,
+                    help='With -L, how far back (in seconds) to look in history for items without a last value (defaults to 604800)')
+group = parser.add_mutually_exclusive_group()
+group.add_argument('-G', '--hostgroup',
+                   help='Query the given item key(s) on all the hosts of this hostgroup (wildcards "*" allowed in the keys)')
+group.add_argument('-T', '--template',
+                   help='Query the given item key(s) on all the hosts linked to this template (wildcards "*" allowed in the keys)')
+parser.add_argument('--trends', action='store_true',
+                    help='Get hourly min/avg/max values from trends instead of history (numeric items only)')
+parser.add_argument('--batch', type=int, default=20,
+                    help='Number of items of the same value type fetched with one history.get/trend.get call, default is 20')
+parser.add_argument('--workers', type=int, default=4,
+                    help='Number of history.get/trend.get calls running at the same time, default is 4')
+parser.add_argument('-O', '--output-dir',
+                    help='Write one file per host (HOST.tsv, lines tagged with the item key) in this directory instead of to stdout')
+parser.add_argument('-M', '--matrix', type=int, metavar='STEP',
+                    help='Write the numeric items as one matrix, resampled on a grid of STEP seconds and forward filled (needs numpy)')
+parser.add_argument('--matrix-file',
+                    help='With -M, write the matrix to this file instead of stdout, .npy and .npz files are written as numpy arrays, anything else as CSV')
+parser.add_argument('-D', '--downsample', type=int, metavar='N',
+                    help='Reduce the values of every numeric item to N points, keeping the shape of the series for plotting')
+parser.add_argument('--downsample-method', choices=['lttb', 'minmax'], default='lttb',
+                    help='With -D, Largest-Triangle-Three-Buckets or the min and max value of every bucket, default is lttb')
+parser.add_argument('-F', '--format', choices=['text', 'csv', 'npz'], default='text',
+                    help='Output format: text lines (the default), CSV rows or typed numpy arrays in a .npz file (needs numpy)')
+parser.add_argument('-o', '--outfile',
+                    help='With -F, write to this file instead of stdout (needed for npz)')
+parser.add_argument('--cache-ttl', type=int, default=86400,
+                    help='Seconds before a cached item name/itemid mapping is looked up again, default is 86400.')
+parser.add_argument('--no-cache', help='Do not use the item name cache', action='store_true')
+parser.add_argument('--async', dest='use_async', action='store_true',
+                    help='Use the asyncio API client (needs aiohttp): independent API calls are run at the same time')
+parser.add_argument('--slices', type=int, default=1,
+                    help='Split the time period of every history.get/trend.get call in up to N calls (at most one per hour), run at the same time with --async; default is 1')
 args = parser.parse_args()
 
 # load config module
@@ -119,68 +203,574 @@ if not password:
 if not api:
     sys.exit("Error: API URL is not set")
 
+if args.matrix is not None and args.matrix < 1:
+    sys.exit("Error: The matrix step must be at least 1 second")
+
+if args.downsample is not None and args.downsample < 3:
+    sys.exit("Error: Downsampling needs at least 3 points")
+
+if args.matrix and args.output_dir:
+    sys.exit("Error: -M and -O can not be used together")
+
+if args.format != 'text' and (args.matrix or args.output_dir):
+    sys.exit("Error: -F can not be used together with -M or -O")
+
+if args.format == 'npz' and not args.outfile:
+    sys.exit("Error: -F npz needs an output file (-o)")
+
 if noverify == True:
     verify = False
 else:
     verify = True
 
-# Create instance, get url, login and password from user config file
-zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
-
 ##################################
 # Start actual API logic
 ##################################
 
-# set the hostname we are looking for
-itemid = args.itemid
+# item fields needed to query the history
+ITEM_FIELDS = ['itemid', 'key_', 'value_type', 'units']
 
-# Find graph from API
-item = zapi.item.get(output="extend", itemids=itemid)
+# Item name cache
+def load_item_cache(cachefile):
+    try:
+        with open(cachefile, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
 
-if item:
+def save_item_cache(cachefile, cache):
+    try:
+        os.makedirs(os.path.dirname(cachefile), mode=0o700, exist_ok=True)
+        with replaced_file(cachefile) as file:
+            json.dump(cache, file)
+    except OSError:
+        pass
 
-    # Get the right valuetype for the item
-    # 0 - float
-    # 1 - character
-    # 2 - log
-    # 3 - numeric unsigned
-    # 4 - text
-    valtype = item[0]['value_type']
+def cache_key(spec, scope=None):
+    # keys on a hostgroup/template are cached per ('group'|'template', name) scope
+    if scope and not spec.isdigit():
+        return "@" + scope[0] + "=" + scope[1] + ":" + spec
+    return spec
 
-    # Get units for the item
-    unit = item[0]['units']
+def cached_items(cache, specs, ttl, scope=None):
+    """
+    Split the item arguments in the ones found in the cache ({spec: [items]})
+    and the ones that have to be looked up
+    """
+    found = {}
+    missing = []
+    now = time.time()
+    for spec in specs:
+        entry = cache.get(cache_key(spec, scope))
+        if entry and now - entry['time'] < ttl:
+            found[spec] = [dict(item) for item in entry['items']]
+        else:
+            missing.append(spec)
+    return found, missing
 
-    # Set time period
-    period = args.timeperiod
+def item_lookups(specs, scope=None, hostids=None):
+    """
+    Return the item.get parameters to resolve the item arguments, with the
+    arguments each one resolves: all the itemids in one call, all the
+    host:key pairs in one call and one call per key with -G/-T (on the
+    hostgroup name, or on the hostids linked to the template)
+    """
+    lookups = []
+    itemids = [spec for spec in specs if spec.isdigit()]
+    names = [spec for spec in specs if not spec.isdigit()]
+    if itemids:
+        lookups.append((itemids, {'itemids': itemids}))
+    if scope:
+        for spec in names:
+            params = {'search': {'key_': spec}, 'searchWildcardsEnabled': True, 'startSearch': True}
+            if scope[0] == 'group':
+                params['group'] = scope[1]
+            else:
+                params['hostids'] = hostids
+            lookups.append(([spec], params))
+    else:
+        pairs = [spec.split(":", 1) for spec in names if ":" in spec]
+        if pairs:
+            # host and key_ filters select the cross product, match_items keeps the pairs asked for
+            lookups.append((names, {'filter': {'host': list(set(pair[0] for pair in pairs)),
+                                               'key_': list(set(pair[1] for pair in pairs))}}))
+    return lookups
+
+def match_items(specs, items, scope=None):
+    """
+    Return the items of one lookup each argument stands for
+    """
+    found = {}
+    for item in items:
+        item['host'] = item.pop('hosts')[0]['host']
+    for spec in specs:
+        if spec.isdigit():
+            found[spec] = [item for item in items if item['itemid'] == spec]
+        elif scope:
+            # like the API search, "*" is the only wildcard (keys contain [ and ])
+            pattern = re.compile(".*".join(re.escape(part) for part in spec.split("*")) + r"\Z")
+            found[spec] = [item for item in items if pattern.match(item['key_'])]
+        else:
+            host, key = spec.split(":", 1) if ":" in spec else (None, spec)
+            found[spec] = [item for item in items if item['host'] == host and item['key_'] == key]
+    return found
+
+def store_items(cache, found, scope=None):
+    now = time.time()
+    for spec, items in found.items():
+        if items:
+            cache[cache_key(spec, scope)] = {'time': now, 'items': [{field: item[field] for field in ITEM_FIELDS + ['host']}
+                                                                    for item in items]}
+
+def template_hostids(templates):
+    if not templates:
+        sys.exit("Error: Could not find template " + args.template)
+    return [host['hostid'] for host in templates[0]['hosts']]
+
+def resolve_items(specs, cache, ttl, scope=None, output=ITEM_FIELDS):
+    """
+    API flow (see apiflow.py) mapping the item arguments to their items
+    ({spec: [items]}), from the cache when possible and with as few item.get
+    calls as possible otherwise, run at the same time
+    """
+    found, missing = cached_items(cache, specs, ttl, scope)
+    hostids = None
+    if missing and scope and scope[0] == 'template':
+        hostids = template_hostids((yield apiflow.call('template.get', output=['templateid'], selectHosts=['hostid'],
+                                                       filter={'host': scope[1]})))
+    lookups = item_lookups(missing, scope, hostids)
+    results = yield [apiflow.call('item.get', output=output, selectHosts=['host'], **params)
+                     for lookup_specs, params in lookups]
+    for (lookup_specs, params), items in zip(lookups, results):
+        matched = match_items(lookup_specs, items, scope)
+        store_items(cache, matched, scope)
+        found.update(matched)
+    return found
+
+def item_list(specs, found):
+    """
+    Return (label, item) for every item in argument order, labeled with the
+    argument or with host:key when an argument stands for several items
+    """
+    itemlist = []
+    for spec in specs:
+        items = found.get(spec)
+        if not items:
+            print("Could not find " + ("itemid " if spec.isdigit() else "item ") + spec)
+        elif len(items) == 1 and not scope:
+            itemlist.append((spec, items[0]))
+        else:
+            itemlist.extend((item['host'] + ":" + item['key_'], item) for item in items)
+    return itemlist
+
+def latest_values(items, window):
+    """
+    API flow (see apiflow.py) filling in lastvalue/lastclock from history for
+    the items without a last value in item.get (nothing received recently),
+    looking back window seconds, one value type at a time
+    """
+    now = int(time.time())
+    bytype = {}
+    for item in items:
+        if item['lastclock'] == '0':
+            bytype.setdefault(item['value_type'], {}).setdefault(item['itemid'], []).append(item)
+    yield [latest_of_type(value_type, missing, now, window) for value_type, missing in bytype.items()]
+
+def latest_of_type(value_type, missing, now, window):
+    """
+    Items of the same value type share one history.get per slice of time, going
+    back from now with slices that double in length (1h, 2h, 4h...); items are
+    left out of the older slices once their last value was found.
+    """
+    ttill = now
+    span = 3600
+    while missing and ttill >= now-window:
+        tfrom = max(ttill-span+1, now-window)
+        records = yield apiflow.call('history.get', itemids=list(missing), history=value_type, time_from=tfrom,
+                                     time_till=ttill, output='extend', sortfield='clock', sortorder='DESC')
+        # newest first, the first record of an item is its last value
+        for record in records:
+            for item in missing.pop(record['itemid'], []):
+                item['lastvalue'] = record['value']
+                item['lastclock'] = record['clock']
+                item['lastns'] = record['ns']
+        ttill = tfrom-1
+        span *= 2
+
+def print_latest(itemlist, tagged):
+    for label, item in itemlist:
+        if item['lastclock'] == '0':
+            print("No values returned for " + ("itemid " if label.isdigit() else "item ") + label)
+        else:
+            if args.extended:
+                value = format(item['lastclock'])+"."+format(item['lastns'])+":"+format(item['units'])+":"+format(item['lastvalue'])
+            else:
+                value = format(item['lastvalue'])
+            if tagged:
+                # tag the values when there are many items
+                value = label + "\t" + value
+            print(value)
+
+def format_record(record, unit):
+    if args.trends:
+        if args.extended:
+            return (format(record['clock'])+":"+format(unit)+":"+format(record['value_min'])+":"+
+                    format(record['value_avg'])+":"+format(record['value_max']))
+        return format(record['value_avg'])
+    if args.extended:
+        return format(record['clock'])+"."+format(record['ns'])+":"+format(unit)+":"+format(record["value"])
+    return format(record["value"])
+
+def lttb(records, points, field):
+    """
+    Largest-Triangle-Three-Buckets: keep the first and last record and from
+    each of the points-2 buckets in between the record making the largest
+    triangle with the previously kept record and the average of the next bucket
+    """
+    x = [int(record['clock']) for record in records]
+    y = [float(record[field]) for record in records]
+    size = (len(records) - 2) / (points - 2)
+    kept = [records[0]]
+    a = 0
+    for bucket in range(points - 2):
+        start = int(bucket * size) + 1
+        end = int((bucket + 1) * size) + 1
+        # average of the next bucket, the last record for the last one
+        next_end = min(int((bucket + 2) * size) + 1, len(records))
+        avg_x = sum(x[end:next_end]) / (next_end - end)
+        avg_y = sum(y[end:next_end]) / (next_end - end)
+        best = max(range(start, end),
+                   key=lambda i: abs((x[a] - avg_x) * (y[i] - y[a]) - (x[a] - x[i]) * (avg_y - y[a])))
+        kept.append(records[best])
+        a = best
+    kept.append(records[-1])
+    return kept
+
+def minmax(records, points, field):
+    """
+    Keep the records with the minimum and maximum value of each of points/2
+    buckets, in time order
+    """
+    size = len(records) / (points // 2)
+    kept = []
+    for bucket in range(points // 2):
+        indexes = range(int(bucket * size), int((bucket + 1) * size))
+        low = min(indexes, key=lambda i: float(records[i][field]))
+        high = max(indexes, key=lambda i: float(records[i][field]))
+        kept.extend(records[i] for i in sorted({low, high}))
+    return kept
 
-    # set the starting time for the item
+def downsample(item, records):
+    """
+    Reduce the records of a numeric item to about --downsample points
+    """
+    if item['value_type'] not in ('0', '3') or len(records) <= args.downsample:
+        return records
+    field = 'value_avg' if args.trends else 'value'
+    if args.downsample_method == 'minmax':
+        return minmax(records, args.downsample, field)
+    return lttb(records, args.downsample, field)
+
+class HistoryWriter:
+    """
+    Write the history of the items to stdout, every line tagged with the
+    item when there are many, or to one HOST.tsv file per host in outdir
+    """
+    def __init__(self, tagged, outdir=None):
+        self.tagged = tagged
+        self.outdir = outdir
+        self.files = {}
+        if outdir:
+            os.makedirs(outdir, exist_ok=True)
+
+    def write(self, label, item, records):
+        if not records:
+            print("No values returned for " + ("itemid " if label.isdigit() else "item ") + label)
+            return
+        if args.downsample:
+            records = downsample(item, records)
+        if self.outdir:
+            out = self.files.get(item['host'])
+            if out is None:
+                out = open(os.path.join(self.outdir, item['host'] + ".tsv"), "w", encoding="utf-8")
+                self.files[item['host']] = out
+            prefix = item['key_'] + "\t"
+        else:
+            out = sys.stdout
+            prefix = label + "\t" if self.tagged else ""
+        out.write("".join(prefix + format_record(record, item['units']) + "\n" for record in records))
+
+    def close(self):
+        for out in self.files.values():
+            out.close()
+
+class MatrixWriter:
+    """
+    Resample the history of the numeric items on a grid of step seconds from
+    stime to etime as it comes in, one column per item holding the last value
+    at or before each grid point, and write the matrix to outfile on close
+    """
+    def __init__(self, itemlist, stime, etime, step, outfile=None):
+        try:
+            import numpy
+        except ImportError:
+            sys.exit("Error: -M needs the numpy module")
+        self.numpy = numpy
+        self.outfile = outfile
+        self.columns = {}
+        self.labels = []
+        for label, item in itemlist:
+            if item['value_type'] not in ('0', '3'):
+                print("Warning: Skipping non-numeric item " + label + " in the matrix", file=sys.stderr)
+                continue
+            self.columns[(label, item['itemid'])] = len(self.labels)
+            self.labels.append(label)
+        # grid points on multiples of step, so matrices of different runs line up
+        self.clock = numpy.arange(stime - stime % step, etime + 1, step, dtype=numpy.int64)
+        self.values = numpy.full((len(self.clock), len(self.labels)), numpy.nan)
+
+    def write(self, label, item, records):
+        numpy = self.numpy
+        column = self.columns.get((label, item['itemid']))
+        if column is None:
+            return
+        if not records:
+            print("No values returned for " + ("itemid " if label.isdigit() else "item ") + label, file=sys.stderr)
+            return
+        field = 'value_avg' if args.trends else 'value'
+        clocks = numpy.fromiter((record['clock'] for record in records), dtype=numpy.int64, count=len(records))
+        values = numpy.fromiter((record[field] for record in records), dtype=numpy.float64, count=len(records))
+        order = numpy.argsort(clocks, kind='stable')
+        clocks, values = clocks[order], values[order]
+        # index of the last record at or before every grid point, -1 before the first one
+        last = numpy.searchsorted(clocks, self.clock, side='right') - 1
+        self.values[:, column] = numpy.where(last >= 0, values[numpy.maximum(last, 0)], numpy.nan)
+
+    def close(self):
+        numpy = self.numpy
+        if self.outfile and self.outfile.endswith(".npz"):
+            numpy.savez_compressed(self.outfile, clock=self.clock, values=self.values, items=numpy.array(self.labels))
+        elif self.outfile and self.outfile.endswith(".npy"):
+            numpy.save(self.outfile, numpy.column_stack((self.clock, self.values)))
+        else:
+            out = open(self.outfile, "w", encoding="utf-8", newline="") if self.outfile else sys.stdout
+            writer = csv.writer(out, lineterminator="\n")
+            writer.writerow(["clock"] + self.labels)
+            # empty cells before the first value of an item
+            cells = numpy.char.mod("%.10g", self.values)
+            cells[numpy.isnan(self.values)] = ""
+            writer.writerows([clock] + row for clock, row in zip(self.clock.tolist(), cells.tolist()))
+            if self.outfile:
+                out.close()
+
+# record fields written by ColumnWriter
+HISTORY_FIELDS = ['clock', 'ns', 'value']
+TREND_FIELDS = ['clock', 'num', 'value_min', 'value_avg', 'value_max']
+
+class ColumnWriter:
+    """
+    Write the history as CSV rows (item and record fields) or as typed numpy
+    arrays per item, saved to a .npz file on close
+    """
+    def __init__(self, fmt, outfile=None):
+        self.fmt = fmt
+        self.outfile = outfile
+        self.fields = TREND_FIELDS if args.trends else HISTORY_FIELDS
+        self.labels = []
+        self.arrays = {}
+        if fmt == 'npz':
+            try:
+                import numpy
+            except ImportError:
+                sys.exit("Error: -F npz needs the numpy module")
+            self.numpy = numpy
+        else:
+            self.out = open(outfile, "w", encoding="utf-8", newline="") if outfile else sys.stdout
+            self.writer = csv.writer(self.out, lineterminator="\n")
+            self.writer.writerow(['item'] + self.fields)
+
+    def dtype(self, item, field):
+        numpy = self.numpy
+        if not field.startswith('value'):
+            return numpy.int64
+        if item['value_type'] == '0':
+            return numpy.float64
+        if item['value_type'] == '3':
+            return numpy.uint64
+        return numpy.str_
+
+    def write(self, label, item, records):
+        if not records:
+            print("No values returned for " + ("itemid " if label.isdigit() else "item ") + label, file=sys.stderr)
+            return
+        if args.downsample:
+            records = downsample(item, records)
+        if self.fmt == 'csv':
+            if item['value_type'] in ('0', '3'):
+                # numbers need no quoting: joined as received, no conversion
+                prefix = label + "," if not any(char in label for char in ',"\n') else '"' + label.replace('"', '""') + '",'
+                self.out.write("".join(prefix + ",".join([record[field] for field in self.fields]) + "\n"
+                                       for record in records))
+            else:
+                self.writer.writerows([label] + [record[field] for field in self.fields] for record in records)
+            return
+        # decoded once from the JSON strings into typed columns
+        column = str(len(self.labels))
+        self.labels.append(label)
+        for field in self.fields:
+            self.arrays[field + "_" + column] = self.numpy.array([record[field] for record in records],
+                                                                 dtype=self.dtype(item, field))
+
+    def close(self):
+        if self.fmt == 'npz':
+            self.numpy.savez(self.outfile, items=self.numpy.array(self.labels), **self.arrays)
+        elif self.outfile:
+            self.out.close()
+
+def history_writer(itemlist, stime, etime):
+    if args.format != 'text':
+        return ColumnWriter(args.format, args.outfile)
+    if args.matrix:
+        return MatrixWriter(itemlist, stime, etime, args.matrix, args.matrix_file)
+    return HistoryWriter(len(itemlist) > 1, args.output_dir)
+
+def history_batches(itemlist):
+    """
+    Split the items in batches of at most --batch items with the same value
+    type, so each batch is one history.get (or trend.get) call
+    """
+    bytype = {}
+    for label, item in itemlist:
+        bytype.setdefault(item['value_type'], []).append((label, item))
+    batches = []
+    for entries in bytype.values():
+        for start in range(0, len(entries), args.batch):
+            batches.append(entries[start:start+args.batch])
+    return batches
+
+def history_params(batch, tfrom, ttill):
+    params = {'itemids': [item['itemid'] for label, item in batch], 'time_from': tfrom, 'time_till': ttill,
+              'output': 'extend'}
+    if not args.trends:
+        # Get the right valuetype for the items
+        # 0 - float
+        # 1 - character
+        # 2 - log
+        # 3 - numeric unsigned
+        # 4 - text
+        params['history'] = batch[0][1]['value_type']
+        params['sortfield'] = 'clock'
+        params['sortorder'] = 'ASC'
+    return params
+
+def split_records(batch, records):
+    """
+    Return (label, item, records) for every item of a batch
+    """
+    byitem = {}
+    for record in records:
+        byitem.setdefault(record['itemid'], []).append(record)
+    if args.trends:
+        # trend.get does not sort
+        for itemrecords in byitem.values():
+            itemrecords.sort(key=lambda record: int(record['clock']))
+    return [(label, item, byitem.get(item['itemid'], [])) for label, item in batch]
+
+def fetch_batch(batch, stime, etime):
+    """
+    API flow (see apiflow.py) returning (label, item, records) for every item
+    of a batch, the time period split in up to --slices calls (at most one per
+    hour); time_till is inclusive so slices must not share their boundaries
+    """
+    period = etime - stime
+    slices = max(1, min(args.slices, period // 3600))
+    step = period // slices + 1
+    bounds = [(t, min(t+step-1, etime)) for t in range(stime, etime+1, step)]
+    method = 'trend.get' if args.trends else 'history.get'
+    results = yield [apiflow.call(method, **history_params(batch, tfrom, ttill)) for tfrom, ttill in bounds]
+    return split_records(batch, [record for result in results for record in result])
+
+def time_range():
+    # Set time period and the starting time for the item
+    period = args.timeperiod
     if args.starttime:
         stime = int(args.starttime)
     else:
         stime = int(time.time()-period)
-
     etime = int(stime+period)
+    return stime, etime
+
+# -G/-T: the keys are looked up on a hostgroup or on the hosts linked to a template
+if args.hostgroup:
+    scope = ('group', args.hostgroup)
+elif args.template:
+    scope = ('template', args.template)
+else:
+    scope = None
+
+if args.no_cache:
+    cachefile = None
+    item_cache = {}
+else:
+    cachefile = cachefile_path(api, username, "itemnames")
+    item_cache = load_item_cache(cachefile)
+
+def get_latest():
+    ''' API flow (see apiflow.py) printing the last values of the items (-L)'''
+    # Last values of all the items from one item.get, history only for the ones without
+    found = yield from resolve_items(args.itemid, item_cache, args.cache_ttl, scope,
+                                     ITEM_FIELDS + ['lastvalue', 'lastclock', 'lastns'])
+    itemlist = item_list(args.itemid, found)
+    cached = [item for label, item in itemlist if 'lastclock' not in item]
+    if cached:
+        # resolved from the cache, only the last values are needed
+        last = {item['itemid']: item for item in (yield apiflow.call('item.get',
+                                                                     output=['itemid', 'lastvalue', 'lastclock', 'lastns'],
+                                                                     itemids=list(set(item['itemid'] for item in cached))))}
+        for item in cached:
+            item.update(last.get(item['itemid'], {'lastvalue': '', 'lastclock': '0', 'lastns': '0'}))
+    yield from latest_values([item for label, item in itemlist], args.latest_window)
+    if cachefile:
+        save_item_cache(cachefile, item_cache)
+    print_latest(itemlist, len(args.itemid) > 1 or len(itemlist) > 1)
+
+def get_history():
+    ''' API flow (see apiflow.py) writing the history of the items'''
+    # Find the items, from the cache when they were looked up before
+    found = yield from resolve_items(args.itemid, item_cache, args.cache_ttl, scope)
+    if cachefile:
+        save_item_cache(cachefile, item_cache)
+    itemlist = item_list(args.itemid, found)
+    stime, etime = time_range()
+    writer = history_writer(itemlist, stime, etime)
 
     if args.count:
-        # count to use for limiit
-        count = int(args.count)
-        itemhist = zapi.history.get(itemids=itemid, history=valtype,
-                                    time_from=stime, time_till=etime, output='extend', limit=count)
-    else:
-        itemhist = zapi.history.get(
-            itemids=itemid, history=valtype, time_from=stime, time_till=etime, output='extend')
-    if itemhist:
-        if args.extended:
-            for record in itemhist:
-                print((format(record['clock'])+"."+format(record['ns']
-                                                         )+":"+format(unit)+":"+format(record["value"])))
-        else:
-            for record in itemhist:
-                print((format(record["value"])))
+        # count to use for limit, it applies to all the items of a call: one call per item
+        results = yield [apiflow.call('history.get', itemids=item['itemid'], history=item['value_type'],
+                                      time_from=stime, time_till=etime, output='extend', limit=int(args.count))
+                         for label, item in itemlist]
+        for (label, item), itemhist in zip(itemlist, results):
+            writer.write(label, item, itemhist)
     else:
-        print("No values returned for itemid " + itemid)
-else:
-        print("Could not find itemid " + itemid)
+        # The items in batches of the same value type, --workers calls at a time.
+        # Batches are written in order, a window of 4 * --workers batches at a
+        # time, so only that many batches are kept in memory
+        batches = history_batches(itemlist)
+        window = 4 * args.workers
+        for start in range(0, len(batches), window):
+            for batch in (yield [fetch_batch(batch, stime, etime) for batch in batches[start:start+window]]):
+                for label, item, records in batch:
+                    writer.write(label, item, records)
+    writer.close()
 
-zapi.logout()
+flow = get_latest() if args.latest else get_history()
+if args.use_async:
+    apiflow.run_async(flow, api, username, password, verify, args.workers)
+else:
+    # Create instance, get url, login and password from user config file
+    zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
+    try:
+        apiflow.run(zapi, flow, args.workers)
+    finally:
+        zapi.logout()
 # And we're done...
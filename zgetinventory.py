@@ -3,14 +3,20 @@
 # zabbix_utils is needed, see https://github.com/zabbix/python-zabbix-utils
 #
 import argparse
+import collections
 import configparser
 import os
 import os.path
 import sys
 import distutils.util
 import csv
+import gzip
+import json
 import io
+import itertools
 from zabbix_utils import ZabbixAPI
+import apiflow
+from triggercache import replaced_file
 
 # define config helper function
 
@@ -50,16 +56,28 @@ Usage example(s):
 Get some inventory fields in CSV for a specific host:
 zgetinventory.py -H MYHOST -F "os" "vendor" "contact"
 
+How many hosts per OS and per vendor:
+zgetinventory.py --all-hosts --count-by os vendor
+
+How many hosts per combination of OS and vendor:
+zgetinventory.py --all-hosts --count-by os vendor --joint
+
+Nightly export of the changes only, since the previous run:
+zgetinventory.py --all-hosts -A --changes ~/inventory.snapshot.gz
+
 """)
 
 group = parser.add_mutually_exclusive_group(required=True)
-group2 = parser.add_mutually_exclusive_group(required=True)
+group2 = parser.add_mutually_exclusive_group(required=False)
+group3 = parser.add_mutually_exclusive_group(required=False)
 group.add_argument('-H', '--hostnames',
                    help='Hostname(s) to find inventory data for', nargs='+')
 group.add_argument('-G', '--hostgroups',
                    help='Switch inventory mode on all hosts in these hostgroup(s)', nargs='+')
 group.add_argument(
     '--all-hosts', help='Switch inventory mode on *ALL* hosts, use with caution', action='store_true')
+parser.add_argument('--async', dest='use_async', action='store_true',
+                    help='Use the asyncio API client (needs aiohttp): independent API calls are run at the same time')
 parser.add_argument('-u', '--username', help='User for the Zabbix api')
 parser.add_argument('-p', '--password',
                     help='Password for the Zabbix api user')
@@ -80,7 +98,21 @@ group2.add_argument('-A', '--all-fields',
                     help='returns data from all inventory fields', action='store_true')
 group2.add_argument(
     '-F', '--fields', help='A list of inventory fields to return', nargs='+')
+parser.add_argument('--chunk-size', type=int, default=500,
+                    help='Fetch the inventory in chunks of this many hosts, default is 500, so large host sets do not time out. Chunks are halved automatically when the frontend runs out of memory or time. Set to 0 to fetch everything with one call')
+parser.add_argument('--workers', type=int, default=4,
+                    help='Number of chunks fetched at the same time with --chunk-size, default is 4')
+group3.add_argument('--changes', metavar='SNAPSHOT',
+                    help='Only print added/removed hosts and changed fields since the last run, as saved in the SNAPSHOT file (created/updated on every run)')
+group3.add_argument('--count-by', metavar='FIELD', nargs='+',
+                    help='Instead of the CSV, print how many hosts have each value of these inventory fields, one table per field; use "hostgroup" to count by host group')
+parser.add_argument('--joint', action='store_true',
+                    help='With --count-by, print a single table of the combinations of the values of the fields')
 args = parser.parse_args()
+if args.count_by and (args.all_fields or args.fields):
+    parser.error("argument --count-by: not allowed with argument %s" % ("-A/--all-fields" if args.all_fields else "-F/--fields"))
+if args.joint and not args.count_by:
+    parser.error("argument --joint: only allowed with argument --count-by")
 
 # load config module
 Config = configparser.ConfigParser()
@@ -134,151 +166,302 @@ if noverify == True:
 else:
     verify = True
 
-# Create instance, get url, login and password from user config file
-zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
-
 ##################################
 # Start actual API logic
 ##################################
 
-if args.all_hosts:
-    # Make a list of all hosts
-    hlookup = zapi.host.get()
+# Fields to fetch
+if args.count_by:
+    # Only what is needed for the counts, "hostgroup" is not an inventory field
+    qfields = [f for f in args.count_by if f != "hostgroup"]
+    select_inventory = qfields
+elif args.all_fields:
+    qfields = None
+    select_inventory = True
+elif args.fields:
+    qfields = []
+    for qfield in args.fields:
+        qfields.append(qfield)
+    select_inventory = qfields
 else:
+    # uhm... what were we supposed to do?
+    sys.exit("Error: One of -A, -F or --count-by is required")
+
+# Host selection and inventory are fetched with a single host.get,
+# these parameters are shared by the normal and the async path
+hparams = {'output': ['hostid', 'host'], 'selectInventory': select_inventory}
+if args.monitored:
+    hparams['monitored_hosts'] = True
+if args.with_inventory:
+    hparams['withInventory'] = True
+if args.count_by and "hostgroup" in args.count_by:
+    hparams['selectHostGroups'] = ['name']
+
+def select_hosts(hgids=None):
+    ''' Add the host selection to hparams'''
     if args.hostgroups:
+        if not hgids:
+            sys.exit("Error: No hostgroups found")
+        hparams['groupids'] = hgids
+    elif args.hostnames:
         if args.numeric:
-            # We are getting numeric hostgroup ID's, let put them in a list
+            # We are getting numeric host ID's, let put them in a list
             # (ignore any non digit items)
-            hgids = [s for s in args.hostgroups if s.isdigit()]
-            for hgid in hgids:
-                exists = zapi.hostgroup.exists(groupid=hgid)
-                if not exists:
-                    sys.exit("Error: Hostgroupid "+hgid+" does not exist")
-
+            hparams['hostids'] = [s for s in args.hostnames if s.isdigit()]
         else:
-            # We are using hostgroup names, let's resolve them to ids.
-            # First, get the named hostgroups via an API call
-            hglookup = zapi.hostgroup.get(filter=({'name': args.hostgroups}))
-
-            # hgids will hold the numeric hostgroup ids
-            hgids = []
-            for hg in range(len(hglookup)):
-                # Create the list of hostgroup ids
-                hgids.append(int(hglookup[hg]['groupid']))
-
-        # Now that we have resolved the hostgroup ids, we can make an API call to retrieve the member hosts
+            # We are using hostnames, let the server filter them
+            hparams['filter'] = {'host': args.hostnames}
+    elif not args.all_hosts:
+        # uhm... what were we supposed to do?
+        sys.exit("Error: Nothing to do here")
 
-        if args.monitored:
-            if args.with_inventory:
-                hlookup = zapi.host.get(
-                    output=['hostid'], monitored_hosts=True, withInventory=True, groupids=hgids)
+class InventoryCSV:
+    """
+    Write hosts to stdout in CSV format as they are added, one row per host.
+    With -A the header comes from the first host that has an inventory, hosts
+    added before that are kept until it is known.
+    """
+
+    def __init__(self):
+        #self.output = UnicodeWriter(sys.stdout, delimiter=',',quotechar='"', quoting=csv.QUOTE_ALL)
+        self.output = csv.writer(sys.stdout,delimiter=',',quotechar='"', quoting=csv.QUOTE_ALL)
+        self.fieldnames = qfields
+        self.pending = []
+        self.rows = 0
+
+    def add(self, hosts):
+        if self.fieldnames is None:
+            # Find returned fieldnames (hosts without inventory return an empty list)
+            for host in hosts:
+                if host['inventory']:
+                    self.fieldnames = [f for f in host['inventory'] if f != 'hostid']
+                    break
+            if self.fieldnames is None:
+                self.pending.extend(hosts)
+                return
+        if self.rows == 0:
+            self.output.writerow(["id", "host"] + self.fieldnames)
+            hosts = self.pending + list(hosts)
+            self.pending = []
+        for host in hosts:
+            inventory = host['inventory'] or {}
+            self.output.writerow([host['hostid'], host['host']] + [inventory.get(field, "") for field in self.fieldnames])
+            self.rows += 1
+
+    def close(self):
+        if self.rows == 0 and (self.fieldnames is not None or self.pending):
+            # No host had an inventory at all
+            if self.fieldnames is None:
+                self.fieldnames = []
+            hosts = self.pending
+            self.pending = []
+            self.add(hosts)
+        sys.stdout.flush()
+
+class InventoryChanges:
+    """
+    Compare hosts with the snapshot of the previous run as they are added and
+    write only the differences to stdout in CSV format:
+    added/removed hosts and changed fields, with old and new value.
+    The snapshot (hostid -> host name and field values, gzipped JSON) is
+    replaced with the current data when done.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        try:
+            with gzip.open(snapshot, "rt", encoding="utf-8") as file:
+                self.old = json.load(file)
+        except (OSError, ValueError):
+            self.old = {}
+        self.new = {}
+        self.output = csv.writer(sys.stdout,delimiter=',',quotechar='"', quoting=csv.QUOTE_ALL)
+        self.output.writerow(["change", "id", "host", "field", "old", "new"])
+
+    def add(self, hosts):
+        for host in hosts:
+            inventory = host['inventory'] or {}
+            if qfields:
+                fields = {f: inventory.get(f, "") for f in qfields}
             else:
-                hlookup = zapi.host.get(
-                    output=['hostid'], monitored_hosts=True, groupids=hgids)
+                fields = {f: v for f, v in inventory.items() if f != 'hostid'}
+            current = {'host': host['host'], 'fields': fields}
+            self.new[host['hostid']] = current
+            previous = self.old.get(host['hostid'])
+            if previous is None:
+                self.output.writerow(["added", host['hostid'], host['host'], "", "", ""])
+                continue
+            if previous['host'] != current['host']:
+                self.output.writerow(["changed", host['hostid'], host['host'], "host", previous['host'], current['host']])
+            # Only compare fields that are in both the snapshot and the current run
+            for field, value in fields.items():
+                if field in previous['fields'] and previous['fields'][field] != value:
+                    self.output.writerow(["changed", host['hostid'], host['host'], field,
+                                          previous['fields'][field], value])
+
+    def close(self):
+        for hostid in sorted(set(self.old) - set(self.new), key=int):
+            self.output.writerow(["removed", hostid, self.old[hostid]['host'], "", "", ""])
+        sys.stdout.flush()
+        try:
+            with replaced_file(self.snapshot, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as file:
+                json.dump(self.new, file, separators=(',', ':'))
+        except OSError as e:
+            sys.exit("Error: Could not write snapshot " + self.snapshot + ": " + str(e))
+
+class InventoryCounts:
+    """
+    Count hosts by the values of each of the --count-by fields as they are
+    added, and print one compact table per field (largest counts first) when
+    done, or a single table of the combinations of their values with --joint.
+    The "hostgroup" field counts a host once for every group it belongs to.
+    """
+
+    def __init__(self, fields, joint=False):
+        self.fields = fields
+        self.joint = joint
+        if joint:
+            self.counts = {tuple(fields): collections.Counter()}
         else:
-            if args.with_inventory:
-                hlookup = zapi.host.get(
-                    output=['hostid'], withInventory=True, groupids=hgids)
-            else:
-                hlookup = zapi.host.get(output=['hostid'], groupids=hgids)
-
-    elif args.hostnames:
+            self.counts = {(field,): collections.Counter() for field in fields}
+        self.hosts = 0
+
+    def add(self, hosts):
+        for host in hosts:
+            self.hosts += 1
+            inventory = host['inventory'] or {}
+            values = {f: [inventory.get(f, "")] for f in self.fields if f != "hostgroup"}
+            if "hostgroup" in self.fields:
+                values["hostgroup"] = [g['name'] for g in host.get('hostgroups', [])] or [""]
+            for fields, counts in self.counts.items():
+                for combination in itertools.product(*[values[f] for f in fields]):
+                    counts[combination] += 1
+
+    def close(self):
+        for n, (fields, counts) in enumerate(self.counts.items()):
+            if n:
+                print()
+            self.print_table(list(fields), counts)
+        sys.stdout.flush()
+
+    def print_table(self, fields, counts):
+        rows = [[v if v != "" else "(empty)" for v in combination] + [str(count)]
+                for combination, count in sorted(counts.items(), key=lambda x: (-x[1], x[0]))]
+        header = fields + ["count"]
+        widths = [max([len(header[i])] + [len(row[i]) for row in rows]) for i in range(len(header))]
+        print("  ".join(h.ljust(w) for h, w in zip(header, widths)))
+        for row in rows:
+            print("  ".join(v.ljust(w) for v, w in zip(row[:-1], widths)) + "  " + row[-1].rjust(widths[-1]))
+        print("%s hosts, %s distinct values" % (self.hosts, len(rows)))
+
+def new_output():
+    ''' Return the writer for the selected output mode'''
+    if args.count_by:
+        return InventoryCounts(args.count_by, args.joint)
+    if args.changes:
+        return InventoryChanges(args.changes)
+    return InventoryCSV()
+
+def write_csv(result):
+    ''' Output the result in CSV format, one row per host'''
+    output = new_output()
+    output.add(result)
+    output.close()
+
+def overloaded(error):
+    ''' Tell if an API error looks like the frontend ran out of memory or time'''
+    message = str(error).lower()
+    for hint in ["memory", "timeout", "timed out", "time out", "execution time",
+                 "internal server error", "bad gateway", "gateway time"]:
+        if hint in message:
+            return True
+    return False
+
+def hostid_params():
+    ''' hparams to get only the ids of the selected hosts'''
+    params = dict(hparams, output=['hostid'])
+    del params['selectInventory']
+    return params
+
+def chunk_params(hostids):
+    ''' hparams to get the inventory of a chunk of hosts'''
+    params = {k: v for k, v in hparams.items() if k in ['output', 'selectInventory', 'selectHostGroups']}
+    params['hostids'] = hostids
+    return params
+
+def chunks(hostids):
+    ''' split hostids (sorted numerically) in chunks of --chunk-size hosts'''
+    hostids = sorted((h['hostid'] for h in hostids), key=int)
+    return [hostids[i:i+args.chunk_size] for i in range(0, len(hostids), args.chunk_size)]
+
+def fetch_chunk(hostids):
+    '''
+    API flow (see apiflow.py) returning the inventory of a chunk of hosts,
+    splitting it in halves when the server runs out of memory or time
+    '''
+    try:
+        return (yield apiflow.call('host.get', **chunk_params(hostids)))
+    except Exception as e:
+        if len(hostids) < 2 or not overloaded(e):
+            raise
+        half = len(hostids) // 2
+        print("Warning: chunk of %s hosts failed (%s), retrying in two halves" % (len(hostids), e),
+              file=sys.stderr)
+        return (yield from fetch_chunk(hostids[:half])) + (yield from fetch_chunk(hostids[half:]))
+
+def export_inventory():
+    ''' API flow (see apiflow.py): select the hosts and write their inventory'''
+    hgids = None
+    if args.hostgroups:
         if args.numeric:
-            # We are getting numeric host ID's, let put them in a list
+            # We are getting numeric hostgroup ID's, let put them in a list
             # (ignore any non digit items)
-            hids = [s for s in args.hostnames if s.isdigit()]
-            if args.monitored:
-                if args.with_inventory:
-                    hlookup = zapi.host.get(
-                        output=['hostid'], monitored_hosts=True, withInventory=True, hostids=hids)
-                else:
-                    hlookup = zapi.host.get(
-                        output=['hostid'], monitored_hosts=True, hostids=hids)
-            else:
-                if args.with_inventory:
-                    hlookup = zapi.host.get(
-                        output=['hostid'], withInventory=True, hostids=hids)
-                else:
-                    hlookup = zapi.host.get(output=['hostid'], hostids=hids)
-
+            hgids = [s for s in args.hostgroups if s.isdigit()]
+            exists = yield [apiflow.call('hostgroup.exists', groupid=hgid) for hgid in hgids]
+            for hgid, found in zip(hgids, exists):
+                if not found:
+                    sys.exit("Error: Hostgroupid "+hgid+" does not exist")
         else:
-            # We are using hostnames, let's resolve them to ids.
-            # Get hosts via an API call
-
-            if args.monitored:
-                if args.with_inventory:
-                    hlookup = zapi.host.get(output=[
-                                            'hostid'], monitored_hosts=True, withInventory=True, filter=({'host': args.hostnames}))
-                else:
-                    hlookup = zapi.host.get(
-                        output=['hostid'], monitored_hosts=True, filter=({'host': args.hostnames}))
-            else:
-                if args.with_inventory:
-                    hlookup = zapi.host.get(
-                        output=['hostid'], withInventory=True, filter=({'host': args.hostnames}))
-                else:
-                    hlookup = zapi.host.get(
-                        output=['hostid'], filter=({'host': args.hostnames}))
+            # We are using hostgroup names, let's resolve them to ids.
+            # First, get the named hostgroups via an API call
+            hglookup = yield apiflow.call('hostgroup.get', output=['groupid'], filter=({'name': args.hostgroups}))
 
+            # hgids will hold the numeric hostgroup ids
+            hgids = [int(hg['groupid']) for hg in hglookup]
+
+    select_hosts(hgids)
+
+    if args.chunk_size and not (args.hostnames and len(args.hostnames) <= args.chunk_size):
+        # Large host sets: get the selected hostids first, then fetch the
+        # inventory in chunks of hosts with --workers concurrent requests
+        hostids = yield apiflow.call('host.get', **hostid_params())
+        if not hostids:
+            sys.exit("Error: No hosts found")
+        hchunks = chunks(hostids)
+        output = new_output()
+        # Chunks are written in order, a window of 4 * --workers chunks at a
+        # time, so only that many chunks are kept in memory
+        window = 4 * args.workers
+        for start in range(0, len(hchunks), window):
+            for result in (yield [fetch_chunk(chunk) for chunk in hchunks[start:start+window]]):
+                output.add(result)
+        output.close()
     else:
-        # uhm... what were we supposed to do?
-        sys.exit("Error: Nothing to do here")
+        # One call: the server selects the hosts and returns their inventory
+        result = yield apiflow.call('host.get', **hparams)
 
-if not hlookup:
-    sys.exit("Error: No hosts found")
-
-# Convert hlookup to a usable parameter for host.get
-hostids = []
-for dict in hlookup:
-    for key, value in dict.items():
-        hostids.append(value)
-
-# Fetch all inventory field data
-if args.all_fields:
-    result = zapi.host.get(
-        output=['host', 'hostid'], hostids=hostids, selectInventory=True)
+        if result:
+            write_csv(result)
+        else:
+            sys.exit("Error: No hosts found")
 
-# Fetch only specified fields
-elif args.fields:
-    qfields = []
-    for qfield in args.fields:
-        qfields.append(qfield)
-    result = zapi.host.get(
-        output=['host', 'hostid'], hostids=hostids, selectInventory=qfields)
+if args.use_async:
+    apiflow.run_async(export_inventory(), api, username, password, verify, args.workers)
 else:
-    # uhm... what were we supposed to do?
-    sys.exit("Error: Nothing to do here")
-
-if result:
-    header = ["id", "host"]
-
-    # Find returned fieldnames
+    # Create instance, get url, login and password from user config file
+    zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
     try:
-        if qfields:
-            fieldnames = qfields
-    except:
-        fieldnames = []
-        for fieldname in result[0]['inventory']:
-            if fieldname != 'hostid':
-                fieldnames.append(fieldname)
-    for fieldname in fieldnames:
-        header.append(fieldname)
-
-    # Output the result in CSV format
-    #output = UnicodeWriter(sys.stdout, delimiter=',',quotechar='"', quoting=csv.QUOTE_ALL)
-    output = csv.writer(sys.stdout,delimiter=',',quotechar='"', quoting=csv.QUOTE_ALL)
-    output.writerow(header)
-    for host in result:
-        row = [host['hostid'], host['host']]
-        for field in fieldnames:
-            if len(host['inventory']) > 0:
-                row.append(host['inventory'][field])
-            else:
-                row.append("")
-        output.writerow(row)
-    sys.stdout.close()
-else:
-    sys.exit("Error: No results")
-
-zapi.logout()
+        apiflow.run(zapi, export_inventory(), args.workers)
+    finally:
+        zapi.logout()
 # And we're done...
@@ -2,15 +2,24 @@
 #
 #
 import argparse
+import asyncio
+import atexit
+import concurrent.futures
 import configparser
+import csv
+import html
+import json
 import os
 import os.path
 import sys
+import tempfile
 import textwrap
 import time
 from datetime import datetime, timedelta, timezone
 from icecream import ic
 from zabbix_utils import ZabbixAPI
+from triggercache import cachefile_path, get_triggers
+import apiflow
 from zoneinfo import ZoneInfo
 from termcolor import colored
 
@@ -112,89 +121,180 @@ def alertstatusmap(status, atype=0):
         map = ['Run', 'Not run']
     return map[status]
 
-def gen_html_table(log_entries, ts, outfile):
-    mydate = ts.strftime("%a %Y-%m-%d H%H:%M")
-    if(len(log_entries)>0):
-        html = """
-        <html>
-        <head>
-            <style>
-                table {
-                    width: 80%;
-                    border-collapse: collapse;
-                    margin: 20px 0;
-                    font-size: 12px;
-                    text-align: left;
-                }
-                th, td {
-                    padding: 8px;
-                    border: 1px solid black;
-                }
-                th {
-                    background-color: #f2f2f2;
-                }
-                .INFO { background-color: #7499FF; }
-                .WARNING { background-color: #FFC859; }
-                .AVERAGE { background-color: #FFA059; }
-                .HIGH { background-color: #E97659; }
-                .DISASTER { background-color: #E45959; }
-            </style>
-        </head>
-        <body>"""
-
-        html += f"""
-            <h2>Zabbix Open Problems Status - {mydate}</h2>
-            """
-        
-        html += """
-            <table>
-                <tr>
-                    <th>Timestamp</th>
-                    <th>Severity</th>
-                    <th>Host</th>
-                    <th>Problem</th>
-                    <th>Age</th>
-                </tr>
-        """
-    
-        for entry in log_entries:
-            html += f"""
-                <tr class="{entry['severity']}">
-                    <td>{entry['etime']}</td>
-                    <td>{entry['severity']}</td>
-                    <td>{entry['hostname']}</td>
-                    <td>{entry['trigger']}</td>
-                    <td>{entry['age']}</td>
-                </tr>
-            """
-
-        html += """
-            </table>
-            <br><hr>Sincerely, Your kind Zabbix majordomo
-        </body>
-        </html>
-        """
+# Zabbix severity parser: accepts a numeric level (0-5) or a severity name
+def severityparse(value):
+    names = ['NOT CLASSIFIED', 'INFORMATION',
+             'WARNING', 'AVERAGE', 'HIGH', 'DISASTER']
+    value = value.strip().upper().replace('_', ' ')
+    if value.isdigit() and int(value) < 6:
+        return int(value)
+    if value in names:
+        return names.index(value)
+    raise argparse.ArgumentTypeError("invalid severity: %s" % value)
+
+# Zabbix tag filter parser:
+#  "tag"       -> tag exists
+#  "tag=value" -> tag equals value
+#  "tag~value" -> tag contains value
+def tagparse(value):
+    if '=' in value:
+        tag, tvalue = value.split('=', 1)
+        return {'tag': tag, 'value': tvalue, 'operator': 1}
+    elif '~' in value:
+        tag, tvalue = value.split('~', 1)
+        return {'tag': tag, 'value': tvalue, 'operator': 0}
     else:
-        html += f"""
-            <html><body><h2>Urrah! No open problems at {mydate}</h2>
-            <br><hr>Sincerely, Your kind Zabbix majordomo
-            </body>
-            </html>
-            """
-    with open(outfile, "w", encoding="utf-8") as file:
-        file.write(html)
-    
-    return
+        return {'tag': value, 'operator': 4}
+
+def current_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+class ProblemRenderer:
+    """
+    Write problems one by one to a (buffered) output file in html, csv
+    or ndjson format, so the whole report is never kept in memory.
+    Use "-" as outfile to write to stdout. A file is written under a
+    temporary name and only replaces the previous report on close, so a
+    failed run leaves the previous report in place.
+    The instances that did not answer are listed at the end of the report.
+    """
+
+    html_head = """<html>
+<head>
+    <style>
+        table {
+            width: 80%;
+            border-collapse: collapse;
+            margin: 20px 0;
+            font-size: 12px;
+            text-align: left;
+        }
+        th, td {
+            padding: 8px;
+            border: 1px solid black;
+        }
+        th {
+            background-color: #f2f2f2;
+        }
+        .INFO, .INFORMATION { background-color: #7499FF; }
+        .WARNING { background-color: #FFC859; }
+        .AVERAGE { background-color: #FFA059; }
+        .HIGH { background-color: #E97659; }
+        .DISASTER { background-color: #E45959; }
+        .FAILED { color: #E45959; }
+    </style>
+</head>
+<body>
+"""
+    html_footer = """<br><hr>Sincerely, Your kind Zabbix majordomo
+</body>
+</html>
+"""
+    fields = ["etime", "severity", "hostname", "eventid", "trigger",
+              "triggerid", "acknowledged", "age"]
+
+    def __init__(self, fmt, outfile, ts, instances=False):
+        self.fmt = fmt
+        # Add an instance column when merging several Zabbix servers
+        self.instances = instances
+        if instances:
+            self.fields = ["instance"] + self.fields
+        self.mydate = ts.strftime("%a %Y-%m-%d H%H:%M")
+        self.rows = 0
+        self.outfile = outfile
+        self.tmpfile = None
+        if outfile == "-":
+            self.file = sys.stdout
+        else:
+            fd, self.tmpfile = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(outfile)),
+                                                prefix="." + os.path.basename(outfile) + ".")
+            self.file = open(fd, "w", encoding="utf-8", newline="", buffering=65536)
+            # removed again when the run ends before close()
+            atexit.register(self.discard)
+        if fmt == "csv":
+            self.csv = csv.writer(self.file, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
+            self.csv.writerow(self.fields)
+
+    def row(self, entry):
+        if self.fmt == "html":
+            if self.rows == 0:
+                # Only start the table once we know there is something to show
+                self.file.write(self.html_head)
+                instance_th = "            <th>Instance</th>\n" if self.instances else ""
+                self.file.write(f"""    <h2>Zabbix Open Problems Status - {self.mydate}</h2>
+    <table>
+        <tr>
+{instance_th}            <th>Timestamp</th>
+            <th>Severity</th>
+            <th>Host</th>
+            <th>Problem</th>
+            <th>Age</th>
+        </tr>
+""")
+            severity = html.escape(str(entry['severity']))
+            instance_td = ""
+            if self.instances:
+                instance_td = f"            <td>{html.escape(str(entry['instance']))}</td>\n"
+            self.file.write(f"""        <tr class="{severity}">
+{instance_td}            <td>{html.escape(str(entry['etime']))}</td>
+            <td>{severity}</td>
+            <td>{html.escape(str(entry['hostname']))}</td>
+            <td>{html.escape(str(entry['trigger']))}</td>
+            <td>{html.escape(str(entry['age']))}</td>
+        </tr>
+""")
+        elif self.fmt == "csv":
+            self.csv.writerow([entry[f] for f in self.fields])
+        elif self.fmt == "ndjson":
+            self.file.write(json.dumps({f: entry[f] for f in self.fields}, default=str) + "\n")
+        self.rows += 1
+
+    def close(self, failed=None):
+        ''' failed: {instance: error} of the instances that did not answer'''
+        failed = failed or {}
+        if self.fmt == "html":
+            if self.rows > 0:
+                self.file.write("    </table>\n")
+            elif failed:
+                self.file.write(self.html_head)
+                self.file.write(f"""    <h2>No open problems on the instances that answered at {self.mydate}</h2>
+""")
+            else:
+                self.file.write(f"""<html><body><h2>Urrah! No open problems at {self.mydate}</h2>
+""")
+            for instance, error in failed.items():
+                self.file.write(f"""    <h3 class="FAILED">Instance {html.escape(instance)} did not answer: {html.escape(error)}</h3>
+""")
+            self.file.write(self.html_footer)
+        elif self.fmt == "csv":
+            for instance, error in failed.items():
+                self.csv.writerow([instance if f == "instance" else "<Instance failed>" if f == "severity"
+                                   else error if f == "trigger" else "" for f in self.fields])
+        elif self.fmt == "ndjson":
+            for instance, error in failed.items():
+                self.file.write(json.dumps({"instance": instance, "error": error}) + "\n")
+        if self.file is sys.stdout:
+            self.file.flush()
+        else:
+            self.file.close()
+            # mkstemp creates the file readable by the owner only
+            os.chmod(self.tmpfile, 0o666 & ~current_umask())
+            os.replace(self.tmpfile, self.outfile)
+            self.tmpfile = None
+
+    def discard(self):
+        if self.tmpfile:
+            self.file.close()
+            os.unlink(self.tmpfile)
+            self.tmpfile = None
 
 # set default vars
 try:
     defconf = os.getenv("HOME") + "/.zabbix-api.conf"
 except:
     defconf = None
-username = ""
-password = ""
-api = ""
-noverify = ""
 
 # Define commandline arguments
 parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description='Find open problems and print them in syslog or html table.', epilog="""
@@ -207,6 +307,16 @@ To use this type of storage, create a conf file (the default is $HOME/.zabbix-ap
  api=https://zabbix.mycompany.com/path/to/zabbix/frontend/
  no_verify=true
 
+Several Zabbix servers can be queried at the same time with -I/--instances or --all-instances:
+each one needs its own [Zabbix API <name>] section, with the same parameters.
+The instances that do not answer are listed in the report and the summary and
+the exit status is 1; when none of them answers no report is written at all.
+
+ [Zabbix API emea]
+ username=johndoe
+ password=verysecretpassword
+ api=https://zabbix-emea.mycompany.com/
+
 """)
 
 group = parser.add_mutually_exclusive_group(required=True)
@@ -229,14 +339,35 @@ parser.add_argument('-t', '--time-period',
                     help='Timeperiod in seconds, default is one week. Set to 0 to disable.', 
                     type=int, default=604800)
 parser.add_argument('-o', '--output-format',
-                    choices=["syslog", "html"], default="syslog",
-                    help='Output format: syslog (default) or html (simple table).')
+                    choices=["syslog", "html", "csv", "ndjson"], default="syslog",
+                    help='Output format: syslog (default), html (simple table), csv or ndjson (one JSON object per line).')
 parser.add_argument('-f', '--file-html', type=str, 
-                    help="Output file for html, default _problems.html",
-                    default="_problems.html")
-parser.add_argument('-S', '--print-summary', help="Print a one-line summary count by severity", action='store_true')
+                    help="Output file for html, csv and ndjson, use - for stdout. Default is _problems.html for html, stdout for csv and ndjson")
+parser.add_argument('-S', '--print-summary', action='store_true',
+                    help="Print a one-line summary count by severity, to stderr when the report goes to stdout")
 group.add_argument('-s', '--start-time', help='Unix timestamp to search from', type=int)
+parser.add_argument('--min-severity', type=severityparse,
+                    help='Only return problems with at least this severity (name or 0-5)')
+parser.add_argument('--max-severity', type=severityparse,
+                    help='Only return problems with at most this severity (name or 0-5)')
+parser.add_argument('--tags', type=tagparse, nargs='+',
+                    help='Only return problems matching these tags: "tag" (exists), "tag=value" (equals) or "tag~value" (contains)')
+parser.add_argument('--tag-evaltype', choices=["and", "or"], default="and",
+                    help='How to combine multiple --tags, default is and.')
+parser.add_argument('--suppressed', choices=["yes", "no"],
+                    help='Only return suppressed (yes) or unsuppressed (no) problems, default is both.')
+parser.add_argument('--cache-ttl', type=int, default=3600,
+                    help='Seconds before a cached trigger description is expanded again, default is 3600. '
+                         'Descriptions with macros ({ITEM.LASTVALUE}, {HOST.NAME}, ...) are not cached '
+                         'and expanded on every run.')
+parser.add_argument('--no-cache', help='Do not use the trigger metadata cache', action='store_true')
 parser.add_argument('-i', '--ids', help='Output only eventids', action='store_true')
+parser.add_argument('-I', '--instances', nargs='+',
+                    help='Query these Zabbix servers concurrently, as defined in [Zabbix API <name>] config sections')
+parser.add_argument('--all-instances', action='store_true',
+                    help='Query all the Zabbix servers defined in [Zabbix API <name>] config sections concurrently')
+parser.add_argument('--async', dest='use_async', action='store_true',
+                    help='Use the asyncio API client (needs aiohttp): independent API calls are run at the same time')
 parser.add_argument('-u', '--username', help='User for the Zabbix api')
 parser.add_argument('-p', '--password', help='Password for the Zabbix api user')
 parser.add_argument('-a', '--api', help='Zabbix API URL')
@@ -260,50 +391,76 @@ else:
     if os.path.isfile(defconf) and os.access(defconf, os.R_OK):
         Config.read(defconf)
 
-# try to load available settings from config file
-try:
-    username = ConfigSectionMap("Zabbix API")['username']
-    password = ConfigSectionMap("Zabbix API")['password']
-    api = ConfigSectionMap("Zabbix API")['api']
-    noverify = bool(strtobool(ConfigSectionMap("Zabbix API")["no_verify"]))
-except:
-    pass
+# Settings for a single [Zabbix API ...] config section
+def instance_settings(section):
+    settings = {'username': "", 'password': "", 'api': "", 'noverify': ""}
+    try:
+        settings['username'] = ConfigSectionMap(section)['username']
+        settings['password'] = ConfigSectionMap(section)['password']
+        settings['api'] = ConfigSectionMap(section)['api']
+        settings['noverify'] = bool(strtobool(ConfigSectionMap(section)["no_verify"]))
+    except:
+        pass
+    return settings
+
+if args.instances or args.all_instances:
+    # Multi-instance mode: every [Zabbix API <name>] section is a server,
+    # with the connection settings of its own section only
+    if args.username or args.password or args.api or args.no_verify:
+        sys.exit("Error: -u, -p, -a and --no-verify can not be used with -I or --all-instances")
+    sections = [x for x in Config.sections() if x.startswith("Zabbix API ")]
+    if args.instances:
+        wanted = ["Zabbix API " + x for x in args.instances]
+        for section in wanted:
+            if section not in sections:
+                sys.exit("Error: No [" + section + "] section in config file")
+        sections = wanted
+    if not sections:
+        sys.exit("Error: No [Zabbix API <name>] sections in config file")
+    instances = []
+    for section in sections:
+        settings = instance_settings(section)
+        settings['name'] = section[len("Zabbix API "):]
+        for needed in ['username', 'password', 'api']:
+            if not settings[needed]:
+                sys.exit("Error: " + needed + " not set for [" + section + "]")
+        instances.append(settings)
+    multi = True
+else:
+    # try to load available settings from config file
+    settings = instance_settings("Zabbix API")
+    settings['name'] = ""
 
-# override settings if they are provided as arguments
-if args.username:
-    username = args.username
+    # override settings if they are provided as arguments
+    if args.username:
+        settings['username'] = args.username
 
-if args.password:
-    password = args.password
+    if args.password:
+        settings['password'] = args.password
 
-if args.api:
-    api = args.api
+    if args.api:
+        settings['api'] = args.api
 
-if args.no_verify:
-    noverify = args.no_verify
+    if args.no_verify:
+        settings['noverify'] = args.no_verify
 
-if args.output_format:
-    output = args.output_format
-else:
-    output = "syslog"
+    # test for needed params
+    if not settings['username']:
+        sys.exit("Error: API User not set")
 
-# test for needed params
-if not username:
-    sys.exit("Error: API User not set")
+    if not settings['password']:
+        sys.exit("Error: API Password not set")
 
-if not password:
-    sys.exit("Error: API Password not set")
+    if not settings['api']:
+        sys.exit("Error: API URL is not set")
 
-if not api:
-    sys.exit("Error: API URL is not set")
+    instances = [settings]
+    multi = False
 
-if noverify == True:
-    verify = False
+if args.output_format:
+    output = args.output_format
 else:
-    verify = True
-
-# Create instance, get url, login and password from user config file
-zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
+    output = "syslog"
 
 # Fix current execution time
 now = datetime.now()
@@ -313,13 +470,16 @@ now = datetime.now()
 ##################################
 
 # Base API call
+# Only request the fields we actually use: host, trigger description and
+# severity are taken from the trigger.get below
 call = { 'sortfield': 'eventid',
         'sortorder': 'DESC',
-        'output': 'extend',
-        'selectHosts': 'extend',
-        'selectRelatedObject': 'extend',
+        'output': ['eventid', 'clock', 'acknowledged', 'objectid'],
         'source': 0 }
 
+if args.ids:
+    call['output'] = ['eventid']
+
 if args.limit != 0:
     call['limit'] = args.limit
 
@@ -340,146 +500,292 @@ if args.time_period != 0:
     else:
         call['time_from'] = int(time.time())-args.time_period
 
+# Let the server do the filtering on severity, tags and suppression
+if args.min_severity is not None or args.max_severity is not None:
+    minsev = args.min_severity if args.min_severity is not None else 0
+    maxsev = args.max_severity if args.max_severity is not None else 5
+    if minsev > maxsev:
+        sys.exit("Error: --min-severity is higher than --max-severity")
+    call['severities'] = list(range(minsev, maxsev+1))
+
+if args.tags:
+    call['tags'] = args.tags
+    # evaltype: 0 - And/Or, 2 - Or
+    if args.tag_evaltype == "or":
+        call['evaltype'] = 2
+    else:
+        call['evaltype'] = 0
+
+if args.suppressed:
+    call['suppressed'] = (args.suppressed == "yes")
+
 if args.file_html:
     out_html_file = args.file_html
-else:
+elif output == "html":
     out_html_file = '_problems.html'
+else:
+    out_html_file = '-'
+
+def get_problems(instance, trigger_cache):
+    '''
+    API flow (see apiflow.py) returning the problems of one Zabbix server,
+    one dict per problem (only the eventid in --ids mode)
+    '''
+    icall = dict(call)
+
+    if args.hostgroups:
+        if args.numeric:
+            # We are getting numeric hostgroup ID's, let put them in a list
+            # (ignore any non digit items)
+            hgids = [s for s in args.hostgroups if s.isdigit()]
+            exists = yield [apiflow.call('hostgroup.exists', groupid=hgid) for hgid in hgids]
+            for hgid, found in zip(hgids, exists):
+                if not found:
+                    sys.exit("Error: Hostgroupid "+hgid+" does not exist")
+        else:
+            # We are using hostgroup names, let's resolve them to ids.
+            # First, get the named hostgroups via an API call
+            hglookup = yield apiflow.call('hostgroup.get', output=['groupid'], filter=({'name': args.hostgroups}))
 
-if args.hostgroups:
-    if args.numeric:
-        # We are getting numeric hostgroup ID's, let put them in a list
-        # (ignore any non digit items)
-        hgids = [s for s in args.hostgroups if s.isdigit()]
-        for hgid in hgids:
-            exists = zapi.hostgroup.exists(groupid=hgid)
-            if not exists:
-                sys.exit("Error: Hostgroupid "+hgid+" does not exist")
-    else:
-        # We are using hostgroup names, let's resolve them to ids.
-        # First, get the named hostgroups via an API call
-        hglookup = zapi.hostgroup.get(filter=({'name': args.hostgroups}))
-
-        # hgids will hold the numeric hostgroup ids
-        hgids = []
-        for hg in range(len(hglookup)):
-            # Create the list of hostgroup ids
-            hgids.append(int(hglookup[hg]['groupid']))
-
-    if len(hgids) > 0:
-        call['groupids'] = hgids
-    else:
-        sys.exit("Error: No hostgroups found")
-
-elif args.hostnames:
-    if args.numeric:
-        # We are getting numeric host ID's, let put them in a list
-        # (ignore any non digit items)
-        hids = [s for s in args.hostnames if s.isdigit()]
-        for hid in hids:
-            exists = zapi.host.exists(hostid=hid)
-            if not exists:
-                sys.exit("Error: Hostid "+hid+" does not exist")
-    else:
-        # We are using hostnames, let's resolve them to ids.
-        # Get hosts via an API call
-        hlookup = zapi.host.get(
-            output='hostid', filter=({'host': args.hostnames}))
-        hids = []
-        for h in range(len(hlookup)):
-            # Create the list of hostgroup ids
-            hids.append(int(hlookup[h]['hostid']))
-
-    if len(hids) > 0:
-        call['hostids'] = hids
-    else:
-        sys.exit("Error: No hosts found")
+            # hgids will hold the numeric hostgroup ids
+            hgids = [int(hg['groupid']) for hg in hglookup]
 
-elif args.triggerids:
-    tids = [s for s in args.triggerids]
-    if len(tids) > 0:
-        call['objectids'] = tids
+        if len(hgids) > 0:
+            icall['groupids'] = hgids
+        else:
+            sys.exit("Error: No hostgroups found")
+
+    elif args.hostnames:
+        if args.numeric:
+            # We are getting numeric host ID's, let put them in a list
+            # (ignore any non digit items)
+            hids = [s for s in args.hostnames if s.isdigit()]
+            exists = yield [apiflow.call('host.exists', hostid=hid) for hid in hids]
+            for hid, found in zip(hids, exists):
+                if not found:
+                    sys.exit("Error: Hostid "+hid+" does not exist")
+        else:
+            # We are using hostnames, let's resolve them to ids.
+            # Get hosts via an API call
+            hlookup = yield apiflow.call('host.get', output='hostid', filter=({'host': args.hostnames}))
+            hids = [int(h['hostid']) for h in hlookup]
+
+        if len(hids) > 0:
+            icall['hostids'] = hids
+        else:
+            sys.exit("Error: No hosts found")
+
+    elif args.triggerids:
+        tids = [s for s in args.triggerids]
+        if len(tids) > 0:
+            icall['objectids'] = tids
+        else:
+            sys.exit("Error: No triggers found")
+
+    # We consider ONLY hosts that are ENABLED and not in maintenance:
+    # resolve them once with a single host.get and pass them to problem.get,
+    # instead of looking up the host of every single problem afterwards.
+    # (--ids mode is left unfiltered, as it always was)
+    if not args.ids:
+        hcall = {'output': ['hostid'],
+                 'monitored_hosts': True,
+                 'filter': {'maintenance_status': 0}}
+        if 'groupids' in icall:
+            hcall['groupids'] = icall['groupids']
+        if 'hostids' in icall:
+            hcall['hostids'] = icall['hostids']
+        mhosts = yield apiflow.call('host.get', **hcall)
+        icall['hostids'] = [int(h['hostid']) for h in mhosts]
+        if len(icall['hostids']) == 0:
+            return []
+
+    problems = yield apiflow.call('problem.get', **icall)
+
+    if not problems:
+        return []
+
+    # In this mode it will return ONLY Event ID
+    if args.ids:
+        return [{"instance": instance, "eventid": problem['eventid']} for problem in problems]
+
+    triggerids = [problem['objectid'] for problem in problems]
+    triggers = yield from get_triggers(triggerids, trigger_cache, args.cache_ttl)
+    return list(problem_entries(problems, triggers, instance))
+
+def problem_entries(problems, triggers, instance):
+    ''' yield one dict per problem, with host and trigger details'''
+    for problem in problems:
+        eventid = problem['eventid']
+        etime = timestr(problem['clock'])
+        age=timestamp_to_age(problem['clock'], now)
+        hostname = "<Unknown Host>"
+        trigger = "<Unknown Trigger>"
+        triggerid = "<Unknown Triggerid>"
+        severity = "<Unknown Severity>"
+        try:
+            hostname = triggers[problem['objectid']]['hosts'][0]['host']
+            trigger = triggers[problem['objectid']]['description']
+            severity = severitymap(triggers[problem['objectid']]['priority'], False)
+            triggerid = problem['objectid']
+        except:
+            pass
+        acked = ackmap(problem['acknowledged'])
+        if acked == True:
+            acknowledged = "Ack: Yes"
+        else:
+            acknowledged = "Ack: No"
+        # Hosts have already been filtered by the server (enabled and
+        # not in maintenance), see the host.get above
+        yield {
+            "instance": instance,
+            "clock": int(problem['clock']),
+            "etime": etime,
+            "severity": severity,
+            "hostname": hostname,
+            "eventid": eventid,
+            "trigger": trigger,
+            "triggerid": triggerid,
+            "acknowledged": acknowledged,
+            "age": age
+        }
+
+def trigger_cachefile(settings):
+    ''' Expanded trigger descriptions are cached between runs'''
+    if args.no_cache:
+        return None
+    return cachefile_path(settings['api'], settings['username'], "triggers")
+
+async def async_fetch_instances(instances):
+    ''' run get_problems() with AsyncZabbixAPI for all the instances at the same time'''
+    async def fetch(settings):
+        try:
+            async with apiflow.async_login(settings['api'], settings['username'], settings['password'],
+                                           not settings['noverify']) as zapi:
+                return await apiflow.async_run(zapi, get_problems(settings['name'], trigger_cachefile(settings))), None
+        except SystemExit as e:
+            if not multi:
+                raise
+            return [], str(e)
+        except Exception as e:
+            if not multi:
+                raise
+            return [], "%s: %s" % (type(e).__name__, e)
+    return await asyncio.gather(*[fetch(settings) for settings in instances])
+
+def connect(settings):
+    ''' login to a Zabbix server'''
+    if settings['noverify'] == True:
+        verify = False
     else:
-        sys.exit("Error: No triggers found")
+        verify = True
+
+    # Create instance, get url, login and password from user config file
+    return ZabbixAPI(url=settings['api'],user=settings['username'],password=settings['password'],validate_certs=verify)
+
+def fetch_instance(settings):
+    ''' fetch all the problems of one instance (used by the worker threads)'''
+    try:
+        zapi = connect(settings)
+        try:
+            return apiflow.run(zapi, get_problems(settings['name'], trigger_cachefile(settings))), None
+        finally:
+            zapi.logout()
+    except SystemExit as e:
+        return [], str(e)
+    except Exception as e:
+        return [], "%s: %s" % (type(e).__name__, e)
 
 def add_problem(p, plist):
     ''' add a problem to the list'''
     plist.append(p)
 
 problem_list = []
+problem_count = 0
 
 # Manual dict to count totals by severity
 severity_counts = {"NOT CLASSIFIED": 0, "INFORMATION": 0, "WARNING": 0, "AVERAGE": 0, "HIGH": 0, "DISASTER": 0}
+instance_counts = {}
+# {instance: error} of the instances that did not answer
+failed = {}
+
+if multi or args.use_async:
+    if args.use_async:
+        # asyncio path: servers and independent API calls are queried at the
+        # same time, logins and logouts are handled by async_fetch_instances()
+        results = asyncio.run(async_fetch_instances(instances))
+    else:
+        # Query all the servers at the same time: the total time is bounded
+        # by the slowest server, not by the sum of all of them
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(instances)) as executor:
+            results = list(executor.map(fetch_instance, instances))
+    problems = []
+    for settings, (iproblems, error) in zip(instances, results):
+        if error:
+            print("Warning: instance %s: %s" % (settings['name'], error), file=sys.stderr)
+            failed[settings['name']] = error
+        instance_counts[settings['name']] = len(iproblems)
+        problems.extend(iproblems)
+    if failed and len(failed) == len(instances):
+        # no report at all rather than one without problems
+        sys.exit("Error: None of the instances answered")
+    if multi and not args.ids:
+        # newest problems first, whatever server they come from
+        problems.sort(key=lambda p: p['clock'], reverse=True)
+else:
+    zapi = connect(instances[0])
+    problems = apiflow.run(zapi, get_problems("", trigger_cachefile(instances[0])))
 
-problems = zapi.problem.get(**call)
+# html, csv and ndjson rows are written out as they are processed,
+# syslog lines are kept to be printed after the summary
+if output != "syslog" and not args.ids:
+    renderer = ProblemRenderer(output, out_html_file, now, instances=multi)
+else:
+    renderer = None
 
-if problems:
-    # In this mode it will print ONLY Event ID
+for curr_p in problems:
     if args.ids:
-        for problem in problems:
-            eventid = problem['eventid']
-            print(eventid)
+        if multi:
+            print(curr_p['instance'] + ":" + curr_p['eventid'])
+        else:
+            print(curr_p['eventid'])
+        continue
+    if renderer:
+        renderer.row(curr_p)
     else:
-        triggerids = [problem['objectid'] for problem in problems]
-        triggers = zapi.trigger.get(triggerids=triggerids, output='extend',
-                                    expandDescription=1, preservekeys=1, expandComment=1, selectHosts='extend')
-        for problem in problems:
-            eventid = problem['eventid']
-            etime = timestr(problem['clock'])
-            age=timestamp_to_age(problem['clock'], now)
-            hostname = "<Unknown Host>"
-            trigger = "<Unknown Trigger>"
-            triggerid = "<Unknown Triggerid>"
-            severity = "<Unknown Severity>"
-            try:
-                hostname = triggers[problem['objectid']]['hosts'][0]['host']
-                trigger = triggers[problem['objectid']]['description']
-                severity = severitymap(triggers[problem['objectid']]['priority'], False)
-                triggerid = problem['objectid']
-            except:
-                pass
-            acked = ackmap(problem['acknowledged'])
-            if acked == True:
-                acknowledged = "Ack: Yes"
-            else:
-                acknowledged = "Ack: No"
-            # Save in a dict for later output processing
-            curr_p = {
-                "etime": etime,
-                "severity": severity,
-                "hostname": hostname,
-                "eventid": eventid,
-                "trigger": trigger,
-                "triggerid": triggerid,
-                "acknowledged": acknowledged,
-                "age": age
-            }
-            # We consider ONLY hosts that are ENABLED and not in maintenance
-            curr_host = zapi.host.get(output="extend", filter={"host": hostname})
-            if(len(curr_host)!=1):
-                sys.exit("Getting host detail: host not found or too many hosts (should not happens!)")
-            hmaintstatus=int(curr_host[0]["maintenance_status"])
-            hstatus=int(curr_host[0]["status"])   
-            if hmaintstatus==0 and hstatus==0:
-                add_problem(curr_p, problem_list)
-                severity_counts[severity] += 1            
-                        
+        add_problem(curr_p, problem_list)
+    problem_count += 1
+    if curr_p['severity'] in severity_counts:
+        severity_counts[curr_p['severity']] += 1
+
+if renderer:
+    renderer.close(failed)
+
 if args.print_summary:
+    # not mixed into an html, csv or ndjson report on stdout
+    summary_file = sys.stderr if args.ids or (renderer and renderer.file is sys.stdout) else sys.stdout
     mydate = now.strftime("%a %Y-%m-%d H%H:%M")
-    print("Zabbix Open Problems: %s || NC=%s I=%s W=%s A=%s H=%s D=%s - At: %s" % (len(problem_list), severity_counts['NOT CLASSIFIED'], 
+    print("Zabbix Open Problems: %s || NC=%s I=%s W=%s A=%s H=%s D=%s - At: %s" % (problem_count, severity_counts['NOT CLASSIFIED'], 
           severity_counts['INFORMATION'], severity_counts['WARNING'], severity_counts['AVERAGE'],
-          severity_counts['HIGH'], severity_counts['DISASTER'], mydate))
+          severity_counts['HIGH'], severity_counts['DISASTER'], mydate), file=summary_file)
+    if multi:
+        print("By instance: %s" % " ".join("%s=%s" % (k, "FAILED" if k in failed else v)
+                                           for k, v in instance_counts.items()), file=summary_file)
 
 if output == "syslog":
     # Dump list of problems to stdout in syslog-like format (eventually colorful)
     for p in problem_list:
-        print("%s [%s] %s [%s] %s (%s) [%s] [Age: %s]" % 
-              (p["etime"], p["severity"], p["hostname"], p["eventid"], p["trigger"], 
-               p["triggerid"], p["acknowledged"], p["age"] ))
-elif output == "html":
-    # Dump list of problems in a simple but effective HTML Table
-    # Write output to file (default _problems.html)
-    html_output = gen_html_table(problem_list, now, out_html_file)
-
-zapi.logout()
+        if multi:
+            print("%s [%s] [%s] %s [%s] %s (%s) [%s] [Age: %s]" % 
+                  (p["etime"], p["instance"], p["severity"], p["hostname"], p["eventid"], p["trigger"], 
+                   p["triggerid"], p["acknowledged"], p["age"] ))
+        else:
+            print("%s [%s] %s [%s] %s (%s) [%s] [Age: %s]" % 
+                  (p["etime"], p["severity"], p["hostname"], p["eventid"], p["trigger"], 
+                   p["triggerid"], p["acknowledged"], p["age"] ))
+
+if not multi and not args.use_async:
+    zapi.logout()
+if failed:
+    sys.exit("Error: Instance(s) %s did not answer" % ", ".join(failed))
 sys.exit()
 # And we're done...
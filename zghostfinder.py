@@ -4,11 +4,13 @@
 #
 import argparse
 import configparser
+import fnmatch
 import os
 import os.path
 import sys
 import distutils.util
 from zabbix_utils import ZabbixAPI
+from snapshotstore import snapshot_path, load_snapshot
 
 # define config helper function
 
@@ -26,6 +28,19 @@ def ConfigSectionMap(section):
     return dict1
 
 
+# Groups ({groupid: name}) matching any of the names or glob patterns, with their
+# nested groups ("parent/child") when recursive is set
+def match_groups(groups, patterns, recursive=False):
+    matched = {}
+    for pattern in patterns:
+        found = {groupid: name for groupid, name in groups.items()
+                 if fnmatch.fnmatchcase(name, pattern) or (recursive and fnmatch.fnmatchcase(name, pattern + "/*"))}
+        if not found:
+            sys.exit("Error: Could not find hostgroup \"" + pattern + "\"")
+        matched.update(found)
+    return matched
+
+
 # set default vars
 defconf = os.getenv("HOME") + "/.zabbix-api.conf"
 username = ""
@@ -44,8 +59,11 @@ To use this type of storage, create a conf file (the default is $HOME/.zabbix-ap
  api=https://zabbix.mycompany.com/path/to/zabbix/frontend/
  no_verify=true
 
+Hostgroups can be given as glob patterns, e.g. "Customers/ACME/*" for all the
+groups nested below Customers/ACME; -r adds the nested groups to every name.
+
 """)
-parser.add_argument('hostgroup', help='Find hosts in this hostgroup')
+parser.add_argument('hostgroup', nargs='+', help='Find hosts in these hostgroups (names or glob patterns)')
 parser.add_argument('-u', '--username', help='User for the Zabbix api')
 parser.add_argument('-p', '--password',
                     help='Password for the Zabbix api user')
@@ -60,8 +78,19 @@ parser.add_argument('-e', '--extended',
                     help='Return both hostids and host names separated with a ":"', action='store_true')
 parser.add_argument('-m', '--monitored',
                     help='Only return hosts that are being monitored', action='store_true')
+parser.add_argument('-r', '--recursive',
+                    help='Include the hosts of nested hostgroups ("group/subgroup")', action='store_true')
+parser.add_argument('--count',
+                    help='Only print the number of matching hosts (countOutput, no host data is transferred)', action='store_true')
+parser.add_argument('--offline', action='store_true',
+                    help='Answer from the snapshot zsnapshot.py saved for this URL/user instead of the API')
+parser.add_argument('--snapshot', metavar='FILE',
+                    help='Answer from this snapshot file saved by zsnapshot.py instead of the API (implies --offline)')
 args = parser.parse_args()
 
+if args.snapshot:
+    args.offline = True
+
 # load config module
 Config = configparser.ConfigParser()
 Config
@@ -100,13 +129,13 @@ if args.no_verify:
     noverify = args.no_verify
 
 # test for needed params
-if not username:
+if not username and not args.snapshot:
     sys.exit("Error: API User not set")
 
-if not password:
+if not password and not args.offline:
     sys.exit("Error: API Password not set")
 
-if not api:
+if not api and not args.snapshot:
     sys.exit("Error: API URL is not set")
 
 if noverify == True:
@@ -114,25 +143,47 @@ if noverify == True:
 else:
     verify = True
 
-zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
+if not args.offline:
+    zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
+else:
+    snapshot = load_snapshot(args.snapshot or snapshot_path(api, username))
 
 ##################################
 # Start actual API logic
 ##################################
 
 # Find the hostgroup we are looking for
-group_name = args.hostgroup
-group = zapi.hostgroup.get(output="extend", filter=({'name': group_name}))
+group_name = "\", \"".join(args.hostgroup)
+wildcards = args.recursive or any(char in name for name in args.hostgroup for char in "*?[")
+if args.offline:
+    groups = snapshot['groups']
+elif wildcards:
+    # patterns are matched against all the group names, fetched at once
+    groups = {group['groupid']: group['name'] for group in zapi.hostgroup.get(output=['groupid', 'name'])}
+else:
+    groups = {group['groupid']: group['name']
+              for group in zapi.hostgroup.get(output=['groupid', 'name'], filter=({'name': args.hostgroup}))}
+group = match_groups(groups, args.hostgroup, args.recursive)
 
 if group:
-    groupid = group[0]["groupid"]
-    # Find linked hosts
-    if args.monitored:
+    groupids = list(group)
+    # Find linked hosts, all groups at once
+    if args.offline:
+        hostids = set()
+        for groupid in groupids:
+            hostids.update(snapshot['group_hosts'].get(groupid, []))
+        hosts = [dict(snapshot['hosts'][hostid], hostid=hostid) for hostid in sorted(hostids, key=int)]
+        if args.monitored:
+            hosts = [host for host in hosts if host['status'] == '0']
+    elif args.monitored:
         hosts = zapi.host.get(
-            output="extend", monitored_hosts=True, groupids=groupid)
+            output="extend", countOutput=args.count, monitored_hosts=True, groupids=groupids)
     else:
-        hosts = zapi.host.get(output="extend", groupids=groupid)
-    if hosts:
+        hosts = zapi.host.get(output="extend", countOutput=args.count, groupids=groupids)
+    if args.count:
+        # countOutput answers with the number of matches only
+        print(len(hosts) if isinstance(hosts, list) else hosts)
+    elif hosts:
         if args.extended:
             # print ids and names
             for host in hosts:
@@ -151,5 +202,6 @@ if group:
 else:
     sys.exit("Error: Could not find hostgroup \"" + group_name + "\"")
 
-zapi.logout()
+if not args.offline:
+    zapi.logout()
 # And we're done...
@@ -8,6 +8,7 @@ import os.path
 import sys
 import distutils.util
 from zabbix_utils import ZabbixAPI
+from snapshotstore import snapshot_path, load_snapshot
 
 # define config helper function
 
@@ -64,8 +65,17 @@ parser.add_argument(
     '-n', '--numeric', help='Return numeric graphid instead of graph name', action='store_true')
 parser.add_argument('-e', '--extended',
                     help='Return both graphid and graph name separated with a ":"', action='store_true')
+parser.add_argument('--count',
+                    help='Only print the number of matching graphs (countOutput, no graph data is transferred)', action='store_true')
+parser.add_argument('--offline', action='store_true',
+                    help='Answer from the snapshot zsnapshot.py saved for this URL/user instead of the API')
+parser.add_argument('--snapshot', metavar='FILE',
+                    help='Answer from this snapshot file saved by zsnapshot.py instead of the API (implies --offline)')
 args = parser.parse_args()
 
+if args.snapshot:
+    args.offline = True
+
 # load config module
 Config = configparser.ConfigParser()
 Config
@@ -104,13 +114,13 @@ if args.no_verify:
     noverify = args.no_verify
 
 # test for needed params
-if not username:
+if not username and not args.snapshot:
     sys.exit("Error: API User not set")
 
-if not password:
+if not password and not args.offline:
     sys.exit("Error: API Password not set")
 
-if not api:
+if not api and not args.snapshot:
     sys.exit("Error: API URL is not set")
 
 if noverify == True:
@@ -118,7 +128,10 @@ if noverify == True:
 else:
     verify = True
 
-zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
+if not args.offline:
+    zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
+else:
+    snapshot = load_snapshot(args.snapshot or snapshot_path(api, username))
 
 ##################################
 # Start actual API logic
@@ -128,12 +141,22 @@ zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
 host_name = args.hostname
 
 # Find specified host from API
-hosts = zapi.host.get(output="extend", filter={"host": host_name})
+if args.offline:
+    hostid = snapshot['index_host'].get(host_name)
+    hosts = [dict(snapshot['hosts'][hostid], hostid=hostid)] if hostid else []
+else:
+    hosts = zapi.host.get(output="extend", filter={"host": host_name})
 
 if hosts:
     # Find defined graphs
-    graphs = zapi.graph.get(output="extend", hostids=hosts[0]["hostid"])
-    if graphs:
+    if args.offline:
+        graphs = snapshot['graphs'].get(hosts[0]["hostid"], [])
+    else:
+        graphs = zapi.graph.get(output="extend", countOutput=args.count, hostids=hosts[0]["hostid"])
+    if args.count:
+        # countOutput answers with the number of matches only
+        print(len(graphs) if isinstance(graphs, list) else graphs)
+    elif graphs:
         if args.extended:
             # print graphs ids and graph names
             for graph in graphs:
@@ -4,11 +4,13 @@
 #
 import argparse
 import configparser
+import csv
 import os
 import os.path
 import sys
 import distutils.util
 from zabbix_utils import ZabbixAPI
+from snapshotstore import snapshot_path, load_snapshot
 
 # define config helper function
 
@@ -25,6 +27,43 @@ def ConfigSectionMap(section):
             dict1[option] = None
     return dict1
 
+
+# Format a host, template or group the way -n/-e ask for
+def label(obj, idkey, namekey, numeric=False, extended=False):
+    if extended:
+        return format(obj[idkey]) + ":" + format(obj[namekey])
+    if numeric:
+        return format(obj[idkey])
+    return format(obj[namekey])
+
+# Print the links of many hosts, one "host<TAB>link" line per pair or as a host x link CSV matrix,
+# with count one "host<TAB>number of links" line per host
+def print_links(hosts, linkkey, idkey, namekey, matrix=False, numeric=False, extended=False, count=False):
+    if count:
+        for host in hosts:
+            links = host[linkkey]
+            print(label(host, "hostid", "host", numeric, extended) + "\t" +
+                  format(len(links) if isinstance(links, list) else links))
+    elif matrix:
+        columns = {}
+        for host in hosts:
+            for link in host[linkkey]:
+                columns[link[idkey]] = label(link, idkey, namekey, numeric, extended)
+        columns = sorted(columns.items(), key=lambda column: column[1])
+        writer = csv.writer(sys.stdout)
+        writer.writerow(["host"] + [column[1] for column in columns])
+        for host in hosts:
+            linked = set(link[idkey] for link in host[linkkey])
+            writer.writerow([label(host, "hostid", "host", numeric, extended)] +
+                            ["1" if column[0] in linked else "" for column in columns])
+    else:
+        for host in hosts:
+            hostlabel = label(host, "hostid", "host", numeric, extended)
+            if not host[linkkey]:
+                print(hostlabel + "\t")
+            for link in host[linkkey]:
+                print(hostlabel + "\t" + label(link, idkey, namekey, numeric, extended))
+
 # set default vars
 defconf = os.getenv("HOME") + "/.zabbix-api.conf"
 username = ""
@@ -44,7 +83,7 @@ To use this type of storage, create a conf file (the default is $HOME/.zabbix-ap
  no_verify=true
 
 """)
-parser.add_argument('hostname', help='List groups for the given hostname')
+parser.add_argument('hostname', nargs='*', help='List groups for the given hostname(s)')
 parser.add_argument('-u', '--username', help='User for the Zabbix api')
 parser.add_argument('-p', '--password',
                     help='Password for the Zabbix api user')
@@ -57,8 +96,20 @@ parser.add_argument(
     '-n', '--numeric', help='Return numeric group id instead of group name', action='store_true')
 parser.add_argument('-e', '--extended',
                     help='Return both group id and group name separated with a ":"', action='store_true')
+parser.add_argument('-A', '--all', help='Return the groups of all hosts', action='store_true')
+parser.add_argument('-M', '--matrix',
+                    help='Print a host x groups CSV matrix instead of one "host<TAB>group" line per link (used with many hosts)', action='store_true')
+parser.add_argument('--count',
+                    help='Only print the number of linked groups, per host when there are many hosts (no group data is transferred)', action='store_true')
+parser.add_argument('--offline', action='store_true',
+                    help='Answer from the snapshot zsnapshot.py saved for this URL/user instead of the API')
+parser.add_argument('--snapshot', metavar='FILE',
+                    help='Answer from this snapshot file saved by zsnapshot.py instead of the API (implies --offline)')
 args = parser.parse_args()
 
+if args.snapshot:
+    args.offline = True
+
 # load config module
 Config = configparser.ConfigParser()
 Config
@@ -97,13 +148,13 @@ if args.no_verify:
     noverify = args.no_verify
 
 # test for needed params
-if not username:
+if not username and not args.snapshot:
     sys.exit("Error: API User not set")
 
-if not password:
+if not password and not args.offline:
     sys.exit("Error: API Password not set")
 
-if not api:
+if not api and not args.snapshot:
     sys.exit("Error: API URL is not set")
 
 if noverify == True:
@@ -111,40 +162,80 @@ if noverify == True:
 else:
     verify = True
 
-zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
+if not args.offline:
+    zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
+else:
+    snapshot = load_snapshot(args.snapshot or snapshot_path(api, username))
 
 ##################################
 # Start actual API logic
 ##################################
 
-# Return the list of groups for the given single hostname
-host_name = args.hostname
-hosts = zapi.host.get(output="hostid", selectHostGroups="extend", filter=({'host': host_name}))
-
-# print(hosts[0]['hostgroups'])
-
-# sys.exit("Stop here....")
-
-if hosts:
-    groups = hosts[0]['hostgroups']
-    # Print group list, one per line
-    if groups:
-        for group in groups:
-            if args.extended:
-                # print ids and names
-                for host in hosts:
-                    print((format(group["groupid"])+":"+format(group["name"])))
-            else:
-                if args.numeric:
-                # print group ids only
-                    print((format(group["groupid"])))
-                else:
-                    # print group names only
-                    print((format(group["name"])))
+if not args.hostname and not args.all:
+    sys.exit("Error: No hostname given, use -A for all hosts")
+
+if args.all or args.matrix or len(args.hostname) > 1:
+    # Many hosts (or all): fetch all the groups with a single host.get,
+    # with --count only the number of links per host
+    links = 'count' if args.count else ['groupid', 'name']
+    if args.offline:
+        hosts = [{'hostid': hostid, 'host': host['host'],
+                  'hostgroups': [{'groupid': groupid, 'name': snapshot['groups'][groupid]}
+                                 for groupid in snapshot['host_groups'].get(hostid, [])]}
+                 for hostid, host in snapshot['hosts'].items() if args.all or host['host'] in args.hostname]
+    elif args.all:
+        hosts = zapi.host.get(output=['hostid', 'host'], selectHostGroups=links)
     else:
-        sys.exit("Error: No group(s) associated to host \"" + host_name + "\" (this SHOULD NOT HAPPEN in Zabbix")
+        hosts = zapi.host.get(output=['hostid', 'host'], selectHostGroups=links,
+                              filter={'host': args.hostname})
+    found = set(host['host'] for host in hosts)
+    for host_name in args.hostname:
+        if host_name not in found:
+            print("Warning: Could not find host " + host_name, file=sys.stderr)
+    if not hosts:
+        sys.exit("Error: No hosts found")
+    hosts.sort(key=lambda host: host['host'])
+    print_links(hosts, 'hostgroups', 'groupid', 'name', args.matrix, args.numeric, args.extended, args.count)
 else:
-    sys.exit("Error: Could not find hostname \"" + host_name + "\"")
+    # Return the list of groups for the given single hostname
+    host_name = args.hostname[0]
+    if args.offline:
+        hostid = snapshot['index_host'].get(host_name)
+        hosts = [{'hostid': hostid,
+                  'hostgroups': [{'groupid': groupid, 'name': snapshot['groups'][groupid]}
+                                 for groupid in snapshot['host_groups'].get(hostid, [])]}] if hostid else []
+    else:
+        hosts = zapi.host.get(output="hostid", selectHostGroups="count" if args.count else "extend",
+                              filter=({'host': host_name}))
+
+    # print(hosts[0]['hostgroups'])
+
+    # sys.exit("Stop here....")
+
+    if hosts:
+        groups = hosts[0]['hostgroups']
+        if args.count:
+            # selectHostGroups="count" answers with the number of groups only
+            print(len(groups) if isinstance(groups, list) else groups)
+        # Print group list, one per line
+        elif groups:
+            for group in groups:
+                if args.extended:
+                    # print ids and names
+                    for host in hosts:
+                        print((format(group["groupid"])+":"+format(group["name"])))
+                else:
+                    if args.numeric:
+                    # print group ids only
+                        print((format(group["groupid"])))
+                    else:
+                        # print group names only
+                        print((format(group["name"])))
+        else:
+            sys.exit("Error: No group(s) associated to host \"" + host_name + "\" (this SHOULD NOT HAPPEN in Zabbix")
+    else:
+        sys.exit("Error: Could not find hostname \"" + host_name + "\"")
 
-zapi.logout()
+if not args.offline:
+    zapi.logout()
 # And we're done...
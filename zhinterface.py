@@ -10,6 +10,7 @@ import os.path
 import sys
 import distutils.util
 from zabbix_utils import ZabbixAPI
+from snapshotstore import snapshot_path, load_snapshot
 
 # define config helper function
 
@@ -66,8 +67,17 @@ parser.add_argument(
     '-n', '--numeric', help='Return numeric interface id instead of interface name', action='store_true')
 parser.add_argument('-e', '--extended',
                     help='Return both interface id and name separated with a ":"', action='store_true')
+parser.add_argument('--count',
+                    help='Only print the number of matching interfaces (countOutput, no interface data is transferred)', action='store_true')
+parser.add_argument('--offline', action='store_true',
+                    help='Answer from the snapshot zsnapshot.py saved for this URL/user instead of the API')
+parser.add_argument('--snapshot', metavar='FILE',
+                    help='Answer from this snapshot file saved by zsnapshot.py instead of the API (implies --offline)')
 args = parser.parse_args()
 
+if args.snapshot:
+    args.offline = True
+
 # load config module
 Config = configparser.ConfigParser()
 Config
@@ -106,13 +116,13 @@ if args.no_verify:
     noverify = args.no_verify
 
 # test for needed params
-if not username:
+if not username and not args.snapshot:
     sys.exit("Error: API User not set")
 
-if not password:
+if not password and not args.offline:
     sys.exit("Error: API Password not set")
 
-if not api:
+if not api and not args.snapshot:
     sys.exit("Error: API URL is not set")
 
 if noverify == True:
@@ -127,7 +137,10 @@ interface_type = {
     "4": "JMX"
 }
 
-zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
+if not args.offline:
+    zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
+else:
+    snapshot = load_snapshot(args.snapshot or snapshot_path(api, username))
 
 ##################################
 # Start actual API logic
@@ -137,13 +150,23 @@ zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
 host_name = args.hostname
 
 # Find specified host from API
-hosts = zapi.host.get(output="extend", filter={"host": host_name})
+if args.offline:
+    hostid = snapshot['index_host'].get(host_name)
+    hosts = [dict(snapshot['hosts'][hostid], hostid=hostid)] if hostid else []
+else:
+    hosts = zapi.host.get(output="extend", filter={"host": host_name})
 
 if hosts:
     # Find interfaces
-    interfaces = zapi.hostinterface.get(output="extend", hostids=hosts[0]["hostid"])
+    if args.offline:
+        interfaces = snapshot['interfaces'].get(hosts[0]["hostid"], [])
+    else:
+        interfaces = zapi.hostinterface.get(output="extend", countOutput=args.count, hostids=hosts[0]["hostid"])
 
-    if interfaces:
+    if args.count:
+        # countOutput answers with the number of matches only
+        print(len(interfaces) if isinstance(interfaces, list) else interfaces)
+    elif interfaces:
         if args.extended:
             # print ids and names
             for interface in interfaces:
@@ -165,5 +188,6 @@ if hosts:
 else:
     sys.exit("Error: Could not find host " + host_name)
 
-zapi.logout()
+if not args.offline:
+    zapi.logout()
 # And we're done...
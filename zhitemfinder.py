@@ -4,9 +4,13 @@
 #
 import argparse
 import configparser
+import hashlib
 import os
 import os.path
+import re
+import sqlite3
 import sys
+import time
 import distutils.util
 from zabbix_utils import ZabbixAPI
 
@@ -25,6 +29,111 @@ def ConfigSectionMap(section):
             dict1[option] = None
     return dict1
 
+# Item names (with their $1..$9 macros expanded) and keys in the local search index,
+# with the host names to find the hostid. An index of another INDEX_VERSION is
+# dropped and filled again, bump it when the schema or what is stored changes.
+INDEX_VERSION = 1
+INDEX_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS items USING fts5(name, key_, hostid UNINDEXED, value_type UNINDEXED, status UNINDEXED, state UNINDEXED, tokenize='trigram')",
+    "CREATE TABLE IF NOT EXISTS hostnames (hostid INTEGER PRIMARY KEY, host TEXT)",
+    "CREATE INDEX IF NOT EXISTS hostnames_host ON hostnames (host)"
+]
+
+# Local search index location, one per URL/user
+def index_path(api, username, name):
+    cachedir = os.path.join(os.getenv("HOME", "."), ".cache", "zabbix-api-utils")
+    key = hashlib.sha1((api + "|" + username).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(cachedir, name + "-" + key + ".sqlite")
+
+def regexp(pattern, value):
+    return value is not None and re.search(pattern, value) is not None
+
+# Open the local search index, names are indexed by trigram (sqlite FTS5)
+def open_index(path):
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    db = sqlite3.connect(path, timeout=60)
+    os.chmod(path, 0o600)
+    db.create_function("REGEXP", 2, regexp, deterministic=True)
+    db.execute("PRAGMA journal_mode=WAL")
+    with db:
+        # one process checks the version (and recreates the tables) at a time
+        db.execute("BEGIN IMMEDIATE")
+        if db.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+            for table in ("items", "hostnames", "meta"):
+                db.execute("DROP TABLE IF EXISTS " + table)
+            db.execute("PRAGMA user_version = %d" % INDEX_VERSION)
+        db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        for statement in INDEX_SCHEMA:
+            db.execute(statement)
+    return db
+
+# Seconds since the index was last refreshed, None if it was never filled
+def index_age(db):
+    row = db.execute("SELECT value FROM meta WHERE key = 'refreshed'").fetchone()
+    if row is None:
+        return None
+    return time.time() - row[0]
+
+# Bring a table in line with rows ({rowid: (values...)}), only touching what changed
+def refresh_table(db, table, columns, rows):
+    current = {row[0]: tuple(row[1:]) for row in db.execute(
+        "SELECT rowid, " + ", ".join(columns) + " FROM " + table)}
+    changed = [(rowid,) + values for rowid, values in rows.items() if current.get(rowid) != values]
+    gone = [(rowid,) for rowid in current if rowid not in rows]
+    gone.extend((row[0],) for row in changed if row[0] in current)
+    db.executemany("DELETE FROM " + table + " WHERE rowid = ?", gone)
+    db.executemany("INSERT INTO " + table + " (rowid, " + ", ".join(columns) + ") VALUES (" +
+                   ", ".join("?" * (len(columns) + 1)) + ")", changed)
+
+# Condition matching column against a substring (case insensitive, like the API search) or a regex
+def match_clause(column, search, regex=False):
+    if regex:
+        return column + " REGEXP ?", search
+    if len(search) >= 3:
+        # trigram lookup, the quoted string matches as a substring
+        return column + " MATCH ?", '"' + search.replace('"', '""') + '"'
+    return "instr(lower(" + column + "), lower(?))", search
+
+# Refresh the index in a detached child process, the search is answered from the current index
+def refresh_in_background(path, api, username, password, verify):
+    db = open_index(path)
+    with db:
+        row = db.execute("SELECT value FROM meta WHERE key = 'refreshing'").fetchone()
+        if row is not None and time.time() - row[0] < 600:
+            # another refresh is still running
+            return
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('refreshing', ?)", (time.time(),))
+    db.close()
+    sys.stdout.flush()
+    if os.fork() == 0:
+        try:
+            os.setsid()
+            # do not hold on to the terminal or to a pipe we are part of
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in (0, 1, 2):
+                os.dup2(devnull, fd)
+            zapi = ZabbixAPI(url=api, user=username, password=password, validate_certs=verify)
+            db = open_index(path)
+            refresh_index(db, zapi)
+            with db:
+                db.execute("DELETE FROM meta WHERE key = 'refreshing'")
+            zapi.logout()
+        finally:
+            os._exit(0)
+
+# Reload item names and keys of all hosts from the API into the index, names are
+# stored with their $1..$9 macros expanded, like the API search returns them
+def refresh_index(db, zapi):
+    hosts = zapi.host.get(output=['hostid', 'host'])
+    items = zapi.item.get(output=['itemid', 'hostid', 'name', 'key_', 'value_type', 'status', 'state'],
+                          templated=False, expandName=1)
+    with db:
+        refresh_table(db, "hostnames", ("host",), {int(host['hostid']): (host['host'],) for host in hosts})
+        refresh_table(db, "items", ("name", "key_", "hostid", "value_type", "status", "state"),
+                      {int(item['itemid']): (item['name'], item['key_'], item['hostid'], item['value_type'],
+                                             item['status'], item['state']) for item in items})
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('refreshed', ?)", (time.time(),))
+
 
 # set default vars
 defconf = os.getenv("HOME") + "/.zabbix-api.conf"
@@ -66,6 +175,14 @@ group2.add_argument(
     '-k', '--key', help='Show only items with a key containing this search string')
 group2.add_argument('-E', '--enabled',
                     help='Show only enabled items', action='store_true')
+parser.add_argument('--count',
+                    help='Only print the number of matching items (countOutput, no item data is transferred)', action='store_true')
+parser.add_argument('-C', '--cached',
+                    help='Search a local trigram index of item names and keys instead of the API, it is refreshed in the background when older than --cache-ttl', action='store_true')
+parser.add_argument('-r', '--regex',
+                    help='Treat the -s/-k search string as a regular expression (implies --cached)', action='store_true')
+parser.add_argument('--cache-ttl', type=int, default=3600,
+                    help='Seconds before the local index is refreshed, default is 3600.')
 args = parser.parse_args()
 
 # load config module
@@ -121,7 +238,10 @@ else:
     verify = True
 
 # Create instance, get url, login and password from user config file
-zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
+# (the local index is searched without logging in)
+zapi = None
+if not (args.cached or args.regex):
+    zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
 
 ##################################
 # Start actual API logic
@@ -130,24 +250,56 @@ zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
 # set the hostname we are looking for
 host_name = args.hostname
 
-hosts = zapi.host.get(output="extend", filter={"host": host_name})
+if args.cached or args.regex:
+    indexfile = index_path(api, username, "itemindex")
+    db = open_index(indexfile)
+    age = index_age(db)
+    if age is None:
+        # First use, fill the index before searching it
+        zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
+        refresh_index(db, zapi)
+    elif age > args.cache_ttl:
+        refresh_in_background(indexfile, api, username, password, verify)
+    hosts = [{'hostid': str(row[0]), 'host': row[1]}
+             for row in db.execute("SELECT hostid, host FROM hostnames WHERE host = ?", (host_name,))]
+else:
+    hosts = zapi.host.get(output="extend", filter={"host": host_name})
 
 if hosts:
     # Find items
-    if args.search:
-        items = zapi.item.get(filter={'host': host_name}, output='extend', search={
+    if args.cached or args.regex:
+        where = ["hostid = ?"]
+        params = [hosts[0]["hostid"]]
+        if args.search:
+            clause, param = match_clause("name", args.search, args.regex)
+        elif args.key:
+            clause, param = match_clause("key_", args.key, args.regex)
+        if args.search or args.key:
+            where.append(clause)
+            params.append(param)
+        elif args.enabled:
+            where.append("status = '0'")
+        items = [{'itemid': str(row[0]), 'name': row[1], 'key_': row[2], 'value_type': row[3],
+                  'status': row[4], 'state': row[5]}
+                 for row in db.execute("SELECT rowid, name, key_, value_type, status, state FROM items WHERE " +
+                                       " AND ".join(where) + " ORDER BY rowid", params)]
+    elif args.search:
+        items = zapi.item.get(filter={'host': host_name}, output='extend', countOutput=args.count, search={
                               'name': args.search}, expandName=1)
     elif args.key:
-        items = zapi.item.get(filter={'host': host_name}, output='extend', search={
+        items = zapi.item.get(filter={'host': host_name}, output='extend', countOutput=args.count, search={
                               'key_': args.key}, expandName=1)
     elif args.enabled:
         items = zapi.item.get(
-            filter={'host': host_name, 'status': 0}, output='extend', expandName=1)
+            filter={'host': host_name, 'status': 0}, output='extend', countOutput=args.count, expandName=1)
     else:
         items = zapi.item.get(
-            filter={'host': host_name}, output='extend', expandName=1)
+            filter={'host': host_name}, output='extend', countOutput=args.count, expandName=1)
 
-    if items:
+    if args.count:
+        # countOutput answers with the number of matches only
+        print(len(items) if isinstance(items, list) else items)
+    elif items:
         if args.extended:
             # print ids and descriptions
             for item in items:
@@ -167,5 +319,6 @@ if hosts:
 else:
     sys.exit("Error: Could not find host " + host_name)
 
-zapi.logout()
+if zapi is not None:
+    zapi.logout()
 # And we're done...
@@ -4,11 +4,16 @@
 #
 import argparse
 import configparser
+import hashlib
 import os
 import os.path
+import re
+import sqlite3
 import sys
+import time
 import distutils.util
 from zabbix_utils import ZabbixAPI
+from snapshotstore import snapshot_path, load_snapshot
 
 # define config helper function
 
@@ -25,6 +30,96 @@ def ConfigSectionMap(section):
             dict1[option] = None
     return dict1
 
+
+# Host names in the local search index
+INDEX_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS hosts USING fts5(host, name UNINDEXED, status UNINDEXED, tokenize='trigram')"
+]
+
+# Local search index location, one per URL/user
+def index_path(api, username, name):
+    cachedir = os.path.join(os.getenv("HOME", "."), ".cache", "zabbix-api-utils")
+    key = hashlib.sha1((api + "|" + username).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(cachedir, name + "-" + key + ".sqlite")
+
+def regexp(pattern, value):
+    return value is not None and re.search(pattern, value) is not None
+
+# Open the local search index, names are indexed by trigram (sqlite FTS5)
+def open_index(path):
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    db = sqlite3.connect(path, timeout=60)
+    os.chmod(path, 0o600)
+    db.create_function("REGEXP", 2, regexp, deterministic=True)
+    db.execute("PRAGMA journal_mode=WAL")
+    with db:
+        db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        for statement in INDEX_SCHEMA:
+            db.execute(statement)
+    return db
+
+# Seconds since the index was last refreshed, None if it was never filled
+def index_age(db):
+    row = db.execute("SELECT value FROM meta WHERE key = 'refreshed'").fetchone()
+    if row is None:
+        return None
+    return time.time() - row[0]
+
+# Bring a table in line with rows ({rowid: (values...)}), only touching what changed
+def refresh_table(db, table, columns, rows):
+    current = {row[0]: tuple(row[1:]) for row in db.execute(
+        "SELECT rowid, " + ", ".join(columns) + " FROM " + table)}
+    changed = [(rowid,) + values for rowid, values in rows.items() if current.get(rowid) != values]
+    gone = [(rowid,) for rowid in current if rowid not in rows]
+    gone.extend((row[0],) for row in changed if row[0] in current)
+    db.executemany("DELETE FROM " + table + " WHERE rowid = ?", gone)
+    db.executemany("INSERT INTO " + table + " (rowid, " + ", ".join(columns) + ") VALUES (" +
+                   ", ".join("?" * (len(columns) + 1)) + ")", changed)
+
+# Condition matching column against a substring (case insensitive, like the API search) or a regex
+def match_clause(column, search, regex=False):
+    if regex:
+        return column + " REGEXP ?", search
+    if len(search) >= 3:
+        # trigram lookup, the quoted string matches as a substring
+        return column + " MATCH ?", '"' + search.replace('"', '""') + '"'
+    return "instr(lower(" + column + "), lower(?))", search
+
+# Refresh the index in a detached child process, the search is answered from the current index
+def refresh_in_background(path, api, username, password, verify):
+    db = open_index(path)
+    with db:
+        row = db.execute("SELECT value FROM meta WHERE key = 'refreshing'").fetchone()
+        if row is not None and time.time() - row[0] < 600:
+            # another refresh is still running
+            return
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('refreshing', ?)", (time.time(),))
+    db.close()
+    sys.stdout.flush()
+    if os.fork() == 0:
+        try:
+            os.setsid()
+            # do not hold on to the terminal or to a pipe we are part of
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in (0, 1, 2):
+                os.dup2(devnull, fd)
+            zapi = ZabbixAPI(url=api, user=username, password=password, validate_certs=verify)
+            db = open_index(path)
+            refresh_index(db, zapi)
+            with db:
+                db.execute("DELETE FROM meta WHERE key = 'refreshing'")
+            zapi.logout()
+        finally:
+            os._exit(0)
+
+# Reload host names from the API into the index
+def refresh_index(db, zapi):
+    hosts = zapi.host.get(output=['hostid', 'host', 'name', 'status'])
+    with db:
+        refresh_table(db, "hosts", ("host", "name", "status"),
+                      {int(host['hostid']): (host['host'], host['name'], host['status']) for host in hosts})
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('refreshed', ?)", (time.time(),))
+
 # set default vars
 defconf = os.getenv("HOME") + "/.zabbix-api.conf"
 username = ""
@@ -62,8 +157,23 @@ parser.add_argument('-e', '--extended',
                     help='Return both hostids and host names separated with a ":"', action='store_true')
 parser.add_argument('-m', '--monitored',
                     help='Only return hosts that are being monitored', action='store_true')
+parser.add_argument('--count',
+                    help='Only print the number of matching hosts (countOutput, no host data is transferred)', action='store_true')
+parser.add_argument('--offline', action='store_true',
+                    help='Answer from the snapshot zsnapshot.py saved for this URL/user instead of the API')
+parser.add_argument('--snapshot', metavar='FILE',
+                    help='Answer from this snapshot file saved by zsnapshot.py instead of the API (implies --offline)')
+parser.add_argument('-C', '--cached',
+                    help='Search a local trigram index of host names instead of the API, it is refreshed in the background when older than --cache-ttl', action='store_true')
+parser.add_argument('-r', '--regex',
+                    help='Treat the search string as a regular expression (implies --cached)', action='store_true')
+parser.add_argument('--cache-ttl', type=int, default=3600,
+                    help='Seconds before the local index is refreshed, default is 3600.')
 args = parser.parse_args()
 
+if args.snapshot:
+    args.offline = True
+
 # load config module
 Config = configparser.ConfigParser()
 Config
@@ -102,13 +212,13 @@ if args.no_verify:
     noverify = args.no_verify
 
 # test for needed params
-if not username:
+if not username and not args.snapshot:
     sys.exit("Error: API User not set")
 
-if not password:
+if not password and not args.offline:
     sys.exit("Error: API Password not set")
 
-if not api:
+if not api and not args.snapshot:
     sys.exit("Error: API URL is not set")
 
 if noverify == True:
@@ -116,7 +226,11 @@ if noverify == True:
 else:
     verify = True
 
-zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
+zapi = None
+if args.offline:
+    snapshot = load_snapshot(args.snapshot or snapshot_path(api, username))
+elif not (args.cached or args.regex):
+    zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
 
 ##################################
 # Start actual API logic
@@ -125,23 +239,62 @@ zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
 # Find the hostgroup we are looking for
 search_name = args.search
 
-if search_name:
+if args.offline:
+    # Answer from the snapshot, same fields as host.get
+    hosts = [dict(host, hostid=hostid) for hostid, host in snapshot['hosts'].items()]
+    if search_name:
+        hosts = [host for host in hosts if search_name.lower() in host['host'].lower()]
+    elif not args.all:
+        sys.exit("Error: No hosts to find")
+    if args.monitored:
+        hosts = [host for host in hosts if host['status'] == '0']
+elif args.cached or args.regex:
+    indexfile = index_path(api, username, "hostindex")
+    db = open_index(indexfile)
+    age = index_age(db)
+    if age is None:
+        # First use, fill the index before searching it
+        zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
+        refresh_index(db, zapi)
+    where = []
+    params = []
+    if search_name:
+        clause, param = match_clause("host", search_name, args.regex)
+        where.append(clause)
+        params.append(param)
+    elif not args.all:
+        sys.exit("Error: No hosts to find")
+    if args.monitored:
+        where.append("status = '0'")
+    query = "SELECT rowid, host, name, status FROM hosts"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY rowid"
+    hosts = [{'hostid': str(row[0]), 'host': row[1], 'name': row[2], 'status': row[3]}
+             for row in db.execute(query, params)]
+    db.close()
+    if age is not None and age > args.cache_ttl:
+        refresh_in_background(indexfile, api, username, password, verify)
+elif search_name:
     # Find matching hosts
     if args.monitored:
-        hosts = zapi.host.get(output="extend", monitored_hosts=True, search={
+        hosts = zapi.host.get(output="extend", countOutput=args.count, monitored_hosts=True, search={
                               "host": search_name})
     else:
-        hosts = zapi.host.get(output="extend", search={"host": search_name})
+        hosts = zapi.host.get(output="extend", countOutput=args.count, search={"host": search_name})
 elif args.all:
     # Find matching hosts
     if args.monitored:
-        hosts = zapi.host.get(output="extend", monitored_hosts=True)
+        hosts = zapi.host.get(output="extend", countOutput=args.count, monitored_hosts=True)
     else:
-        hosts = zapi.host.get(output="extend")
+        hosts = zapi.host.get(output="extend", countOutput=args.count)
 else:
     sys.exit("Error: No hosts to find")
 
-if hosts:
+if args.count:
+    # countOutput answers with the number of matches only
+    print(len(hosts) if isinstance(hosts, list) else hosts)
+elif hosts:
     if args.extended:
         # print ids and names
         for host in hosts:
@@ -158,5 +311,6 @@ if hosts:
 else:
     sys.exit("Error: Could not find any hosts matching \"" + search_name + "\"")
 
-zapi.logout()
+if zapi is not None:
+    zapi.logout()
 # And we're done...
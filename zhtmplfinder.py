@@ -4,11 +4,13 @@
 #
 import argparse
 import configparser
+import csv
 import os
 import os.path
 import sys
 import distutils.util
 from zabbix_utils import ZabbixAPI
+from snapshotstore import snapshot_path, load_snapshot
 
 # define config helper function
 
@@ -25,6 +27,43 @@ def ConfigSectionMap(section):
             dict1[option] = None
     return dict1
 
+
+# Format a host, template or group the way -n/-e ask for
+def label(obj, idkey, namekey, numeric=False, extended=False):
+    if extended:
+        return format(obj[idkey]) + ":" + format(obj[namekey])
+    if numeric:
+        return format(obj[idkey])
+    return format(obj[namekey])
+
+# Print the links of many hosts, one "host<TAB>link" line per pair or as a host x link CSV matrix,
+# with count one "host<TAB>number of links" line per host
+def print_links(hosts, linkkey, idkey, namekey, matrix=False, numeric=False, extended=False, count=False):
+    if count:
+        for host in hosts:
+            links = host[linkkey]
+            print(label(host, "hostid", "host", numeric, extended) + "\t" +
+                  format(len(links) if isinstance(links, list) else links))
+    elif matrix:
+        columns = {}
+        for host in hosts:
+            for link in host[linkkey]:
+                columns[link[idkey]] = label(link, idkey, namekey, numeric, extended)
+        columns = sorted(columns.items(), key=lambda column: column[1])
+        writer = csv.writer(sys.stdout)
+        writer.writerow(["host"] + [column[1] for column in columns])
+        for host in hosts:
+            linked = set(link[idkey] for link in host[linkkey])
+            writer.writerow([label(host, "hostid", "host", numeric, extended)] +
+                            ["1" if column[0] in linked else "" for column in columns])
+    else:
+        for host in hosts:
+            hostlabel = label(host, "hostid", "host", numeric, extended)
+            if not host[linkkey]:
+                print(hostlabel + "\t")
+            for link in host[linkkey]:
+                print(hostlabel + "\t" + label(link, idkey, namekey, numeric, extended))
+
 # set default vars
 defconf = os.getenv("HOME") + "/.zabbix-api.conf"
 username = ""
@@ -45,7 +84,7 @@ To use this type of storage, create a conf file (the default is $HOME/.zabbix-ap
 
 """)
 parser.add_argument(
-    'hostname', help='Hostname to find the linked templates for')
+    'hostname', nargs='*', help='Hostname(s) to find the linked templates for')
 parser.add_argument('-u', '--username', help='User for the Zabbix api')
 parser.add_argument('-p', '--password',
                     help='Password for the Zabbix api user')
@@ -58,8 +97,20 @@ parser.add_argument(
     '-n', '--numeric', help='Return numeric templateids instead of template names', action='store_true')
 parser.add_argument('-e', '--extended',
                     help='Return both templateid and template name separated with a ":"', action='store_true')
+parser.add_argument('-A', '--all', help='Return the templates of all hosts', action='store_true')
+parser.add_argument('-M', '--matrix',
+                    help='Print a host x templates CSV matrix instead of one "host<TAB>template" line per link (used with many hosts)', action='store_true')
+parser.add_argument('--count',
+                    help='Only print the number of linked templates, per host when there are many hosts (no template data is transferred)', action='store_true')
+parser.add_argument('--offline', action='store_true',
+                    help='Answer from the snapshot zsnapshot.py saved for this URL/user instead of the API')
+parser.add_argument('--snapshot', metavar='FILE',
+                    help='Answer from this snapshot file saved by zsnapshot.py instead of the API (implies --offline)')
 args = parser.parse_args()
 
+if args.snapshot:
+    args.offline = True
+
 # load config module
 Config = configparser.ConfigParser()
 Config
@@ -98,13 +149,13 @@ if args.no_verify:
     noverify = args.no_verify
 
 # test for needed params
-if not username:
+if not username and not args.snapshot:
     sys.exit("Error: API User not set")
 
-if not password:
+if not password and not args.offline:
     sys.exit("Error: API Password not set")
 
-if not api:
+if not api and not args.snapshot:
     sys.exit("Error: API URL is not set")
 
 if noverify == True:
@@ -113,40 +164,81 @@ else:
     verify = True
 
 # Create instance, get url, login and password from user config file
-zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
+if not args.offline:
+    zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
+else:
+    snapshot = load_snapshot(args.snapshot or snapshot_path(api, username))
 
 ##################################
 # Start actual API logic
 ##################################
 
-# set the hostname we are looking for
-host_name = args.hostname
-
-# Find specified host from API
-hosts = zapi.host.get(output="extend", filter={"host": host_name})
-
-if hosts:
-    # Find linked templates
-    templates = zapi.template.get(output="extend", hostids=hosts[0]["hostid"])
-    if templates:
-        if args.extended:
-            # print ids and names
-            for template in templates:
-                print((format(template["templateid"]) +
-                      ":"+format(template["host"])))
+if not args.hostname and not args.all:
+    sys.exit("Error: No hostname given, use -A for all hosts")
+
+if args.all or args.matrix or len(args.hostname) > 1:
+    # Many hosts (or all): fetch all the links with a single host.get,
+    # with --count only the number of links per host
+    links = 'count' if args.count else ['templateid', 'host']
+    if args.offline:
+        hosts = [{'hostid': hostid, 'host': host['host'],
+                  'parentTemplates': [{'templateid': templateid, 'host': snapshot['templates'][templateid]['host']}
+                                      for templateid in snapshot['host_templates'].get(hostid, [])]}
+                 for hostid, host in snapshot['hosts'].items() if args.all or host['host'] in args.hostname]
+    elif args.all:
+        hosts = zapi.host.get(output=['hostid', 'host'], selectParentTemplates=links)
+    else:
+        hosts = zapi.host.get(output=['hostid', 'host'], selectParentTemplates=links,
+                              filter={'host': args.hostname})
+    found = set(host['host'] for host in hosts)
+    for host_name in args.hostname:
+        if host_name not in found:
+            print("Warning: Could not find host " + host_name, file=sys.stderr)
+    if not hosts:
+        sys.exit("Error: No hosts found")
+    hosts.sort(key=lambda host: host['host'])
+    print_links(hosts, 'parentTemplates', 'templateid', 'host', args.matrix, args.numeric, args.extended, args.count)
+else:
+    # set the hostname we are looking for
+    host_name = args.hostname[0]
+
+    # Find specified host from API
+    if args.offline:
+        hostid = snapshot['index_host'].get(host_name)
+        hosts = [dict(snapshot['hosts'][hostid], hostid=hostid)] if hostid else []
+    else:
+        hosts = zapi.host.get(output="extend", filter={"host": host_name})
+
+    if hosts:
+        # Find linked templates
+        if args.offline:
+            templates = [dict(snapshot['templates'][templateid], templateid=templateid)
+                         for templateid in snapshot['host_templates'].get(hosts[0]["hostid"], [])]
         else:
-            if args.numeric:
-                # print template ids
+            templates = zapi.template.get(output="extend", countOutput=args.count, hostids=hosts[0]["hostid"])
+        if args.count:
+            # countOutput answers with the number of matches only
+            print(len(templates) if isinstance(templates, list) else templates)
+        elif templates:
+            if args.extended:
+                # print ids and names
                 for template in templates:
-                    print((format(template["templateid"])))
+                    print((format(template["templateid"]) +
+                          ":"+format(template["host"])))
             else:
-                # print template names
-                for template in templates:
-                    print((format(template["host"])))
+                if args.numeric:
+                    # print template ids
+                    for template in templates:
+                        print((format(template["templateid"])))
+                else:
+                    # print template names
+                    for template in templates:
+                        print((format(template["host"])))
+        else:
+            sys.exit("Error: No templates linked to " + host_name)
     else:
-        sys.exit("Error: No templates linked to " + host_name)
-else:
-    sys.exit("Error: Could not find host " + host_name)
+        sys.exit("Error: Could not find host " + host_name)
 
-zapi.logout()
+if not args.offline:
+    zapi.logout()
 # And we're done...
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+#
+# zabbix_utils is needed, see https://github.com/zabbix/python-zabbix-utils
+#
+import argparse
+import configparser
+import os
+import os.path
+import sys
+import distutils.util
+import time
+from zabbix_utils import ZabbixAPI
+from snapshotstore import snapshot_path, save_snapshot
+
+# define config helper function
+
+def ConfigSectionMap(section):
+    dict1 = {}
+    options = Config.options(section)
+    for option in options:
+        try:
+            dict1[option] = Config.get(section, option)
+            if dict1[option] == -1:
+                DebugPrint("skip: %s" % option)
+        except:
+            print(("exception on %s!" % option))
+            dict1[option] = None
+    return dict1
+
+# Append a value to a list in an index dict
+def index_add(index, key, value):
+    index.setdefault(key, []).append(value)
+
+# set default vars
+defconf = os.getenv("HOME") + "/.zabbix-api.conf"
+username = ""
+password = ""
+api = ""
+noverify = ""
+
+# Define commandline arguments
+parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description='Saves a snapshot of the Zabbix topology (hosts, groups, templates, interfaces and graphs) that the finder scripts can query with --offline.', epilog="""
+This program can use .ini style configuration files to retrieve the needed API connection information.
+To use this type of storage, create a conf file (the default is $HOME/.zabbix-api.conf) that contains at least the [Zabbix API] section and any of the other parameters:
+
+ [Zabbix API]
+ username=johndoe
+ password=verysecretpassword
+ api=https://zabbix.mycompany.com/path/to/zabbix/frontend/
+ no_verify=true
+
+The snapshot is a gzipped JSON file with ids, names, links between them and
+prebuilt name indexes. By default it is saved in $HOME/.cache/zabbix-api-utils,
+one per Zabbix URL and user, where the finders look for it.
+
+Usage example:
+zsnapshot.py && zghostfinder.py --offline "Linux servers"
+zsnapshot.py -o /tmp/prod.json.gz && zhtmplfinder.py --snapshot /tmp/prod.json.gz web001
+
+""")
+parser.add_argument('-u', '--username', help='User for the Zabbix api')
+parser.add_argument('-p', '--password',
+                    help='Password for the Zabbix api user')
+parser.add_argument('-a', '--api', help='Zabbix API URL')
+parser.add_argument(
+    '--no-verify', help='Disables certificate validation when using a secure connection', action='store_true')
+parser.add_argument(
+    '-c', '--config', help='Config file location (defaults to $HOME/.zabbix-api.conf)')
+parser.add_argument('-o', '--output',
+                    help='Snapshot file to write (defaults to $HOME/.cache/zabbix-api-utils/snapshot-<url/user>.json.gz)')
+args = parser.parse_args()
+
+# load config module
+Config = configparser.ConfigParser()
+Config
+
+# if configuration argument is set, test the config file
+if args.config:
+    if os.path.isfile(args.config) and os.access(args.config, os.R_OK):
+        Config.read(args.config)
+
+# if not set, try default config file
+else:
+    if os.path.isfile(defconf) and os.access(defconf, os.R_OK):
+        Config.read(defconf)
+
+# try to load available settings from config file
+try:
+    username = ConfigSectionMap("Zabbix API")['username']
+    password = ConfigSectionMap("Zabbix API")['password']
+    api = ConfigSectionMap("Zabbix API")['api']
+    noverify = bool(distutils.util.strtobool(
+        ConfigSectionMap("Zabbix API")["no_verify"]))
+except:
+    pass
+
+# override settings if they are provided as arguments
+if args.username:
+    username = args.username
+
+if args.password:
+    password = args.password
+
+if args.api:
+    api = args.api
+
+if args.no_verify:
+    noverify = args.no_verify
+
+# test for needed params
+if not username:
+    sys.exit("Error: API User not set")
+
+if not password:
+    sys.exit("Error: API Password not set")
+
+if not api:
+    sys.exit("Error: API URL is not set")
+
+if noverify == True:
+    verify = False
+else:
+    verify = True
+
+zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
+
+##################################
+# Start actual API logic
+##################################
+
+snapshot = {
+    'version': 2,
+    'created': int(time.time()),
+    'api': api,
+    'hosts': {},
+    'groups': {},
+    'templates': {},
+    'host_groups': {},
+    'host_templates': {},
+    'template_templates': {},
+    'interfaces': {},
+    'graphs': {},
+    # name -> id
+    'index_host': {},
+    'index_group': {},
+    'index_template': {},
+    # id -> member hostids
+    'group_hosts': {},
+    'template_hosts': {}
+}
+
+# Hosts with their groups, directly linked templates and interfaces
+hosts = zapi.host.get(output=['hostid', 'host', 'name', 'status'],
+                      selectHostGroups=['groupid'], selectParentTemplates=['templateid'],
+                      selectInterfaces=['interfaceid', 'ip', 'dns'])
+for host in hosts:
+    hostid = host['hostid']
+    snapshot['hosts'][hostid] = {'host': host['host'], 'name': host['name'], 'status': host['status']}
+    snapshot['index_host'][host['host']] = hostid
+    for group in host['hostgroups']:
+        index_add(snapshot['host_groups'], hostid, group['groupid'])
+        index_add(snapshot['group_hosts'], group['groupid'], hostid)
+    for template in host['parentTemplates']:
+        index_add(snapshot['host_templates'], hostid, template['templateid'])
+        index_add(snapshot['template_hosts'], template['templateid'], hostid)
+    snapshot['interfaces'][hostid] = [{'interfaceid': i['interfaceid'], 'ip': i['ip'], 'dns': i['dns']}
+                                      for i in host['interfaces']]
+
+for group in zapi.hostgroup.get(output=['groupid', 'name']):
+    snapshot['groups'][group['groupid']] = group['name']
+    snapshot['index_group'][group['name']] = group['groupid']
+
+# Templates with the templates they are linked to
+for template in zapi.template.get(output=['templateid', 'host', 'name'], selectParentTemplates=['templateid']):
+    snapshot['templates'][template['templateid']] = {'host': template['host'], 'name': template['name']}
+    snapshot['index_template'][template['host']] = template['templateid']
+    snapshot['template_templates'][template['templateid']] = [t['templateid'] for t in template['parentTemplates']]
+
+for graph in zapi.graph.get(output=['graphid', 'name'], selectHosts=['hostid'], templated=False):
+    for host in graph['hosts']:
+        index_add(snapshot['graphs'], host['hostid'], {'graphid': graph['graphid'], 'name': graph['name']})
+
+# Items are left out: they are most of the data of a large instance and no
+# finder answers from them (zhitemfinder.py keeps its own search index)
+
+zapi.logout()
+
+# Write the snapshot, readable only by the owner
+if args.output:
+    outfile = args.output
+else:
+    outfile = snapshot_path(api, username)
+    os.makedirs(os.path.dirname(outfile), mode=0o700, exist_ok=True)
+save_snapshot(outfile, snapshot)
+
+print("Snapshot of %s hosts, %s groups, %s templates saved to %s" % (len(snapshot['hosts']), len(snapshot['groups']),
+      len(snapshot['templates']), outfile))
+# And we're done...
@@ -6,11 +6,15 @@
 #
 import argparse
 import configparser
+import json
 import os
 import os.path
 import sys
+import time
 import distutils.util
 from zabbix_utils import ZabbixAPI
+from snapshotstore import snapshot_path, load_snapshot
+from triggercache import cachefile_path, replaced_file
 
 # define config helper function
 
@@ -28,6 +32,48 @@ def ConfigSectionMap(section):
     return dict1
 
 
+# Template link graph {templateid: {'host': name, 'parents': [templateids]}}, read from
+# the cache file unless it is older than ttl seconds or one of the template names
+# is not in it (a template created after the cache was written)
+def template_graph(zapi, cachefile=None, ttl=3600, names=()):
+    if cachefile:
+        try:
+            with open(cachefile, "r", encoding="utf-8") as file:
+                cache = json.load(file)
+            known = set(template['host'] for template in cache['templates'].values())
+            if time.time() - cache['time'] < ttl and known.issuperset(names):
+                return cache['templates']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+    graph = {}
+    for template in zapi.template.get(output=['templateid', 'host'], selectParentTemplates=['templateid']):
+        graph[template['templateid']] = {'host': template['host'],
+                                         'parents': [parent['templateid'] for parent in template['parentTemplates']]}
+    if cachefile:
+        try:
+            os.makedirs(os.path.dirname(cachefile), mode=0o700, exist_ok=True)
+            with replaced_file(cachefile) as file:
+                json.dump({'time': time.time(), 'templates': graph}, file)
+        except OSError:
+            pass
+    return graph
+
+# The given templates plus every template linking them, directly or through other templates
+def linked_templates(graph, templateids):
+    children = {}
+    for templateid, template in graph.items():
+        for parentid in template['parents']:
+            children.setdefault(parentid, []).append(templateid)
+    found = set(templateids)
+    todo = list(templateids)
+    while todo:
+        for childid in children.get(todo.pop(), []):
+            if childid not in found:
+                found.add(childid)
+                todo.append(childid)
+    return found
+
+
 # set default vars
 defconf = os.getenv("HOME") + "/.zabbix-api.conf"
 username = ""
@@ -48,9 +94,13 @@ To use this type of storage, create a conf file (the default is $HOME/.zabbix-ap
 
 Usage example:
 zthostfinder.py -n "Windows by Zabbix agent"
+zthostfinder.py -m "ICMP Ping" "Linux by Zabbix agent"
+
+Hosts linked to a template that links the given template (nested templates)
+are found as well, use -d to only return the directly linked hosts.
 
 """)
-parser.add_argument('template', help='Template to find linked hosts for')
+parser.add_argument('template', nargs='+', help='Template(s) to find linked hosts for')
 parser.add_argument('-u', '--username', help='User for the Zabbix api')
 parser.add_argument('-p', '--password',
                     help='Password for the Zabbix api user')
@@ -67,8 +117,22 @@ parser.add_argument('-V', '--visible-name',
                     help='Return visible name instead of technical name', action='store_true')
 parser.add_argument('-m', '--monitored',
                     help='Only return monitored hosts', action='store_true')
+parser.add_argument('-d', '--direct',
+                    help='Only return hosts linked directly to the template(s), not through nested templates', action='store_true')
+parser.add_argument('--cache-ttl', type=int, default=3600,
+                    help='Seconds before the cached template link graph is fetched again, default is 3600.')
+parser.add_argument('--no-cache', help='Do not use the template link graph cache', action='store_true')
+parser.add_argument('--count',
+                    help='Only print the number of matching hosts (countOutput, no host data is transferred)', action='store_true')
+parser.add_argument('--offline', action='store_true',
+                    help='Answer from the snapshot zsnapshot.py saved for this URL/user instead of the API')
+parser.add_argument('--snapshot', metavar='FILE',
+                    help='Answer from this snapshot file saved by zsnapshot.py instead of the API (implies --offline)')
 args = parser.parse_args()
 
+if args.snapshot:
+    args.offline = True
+
 # load config module
 Config = configparser.ConfigParser()
 Config
@@ -107,13 +171,13 @@ if args.no_verify:
     noverify = args.no_verify
 
 # test for needed params
-if not username:
+if not username and not args.snapshot:
     sys.exit("Error: API User not set")
 
-if not password:
+if not password and not args.offline:
     sys.exit("Error: API Password not set")
 
-if not api:
+if not api and not args.snapshot:
     sys.exit("Error: API URL is not set")
 
 if noverify == True:
@@ -121,29 +185,51 @@ if noverify == True:
 else:
     verify = True
 
-zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
+if not args.offline:
+    zapi = ZabbixAPI(url=api,user=username,password=password,validate_certs=verify)
+else:
+    snapshot = load_snapshot(args.snapshot or snapshot_path(api, username))
 
 ##################################
 # Start actual API logic
 ##################################
 
-# Find the template we are looking for
-tmpl_name = args.template
-template = zapi.template.get(output="extend", filter={"host": tmpl_name})
-#if len(template) == 0:
-if not template:
-    sys.exit("Error: Template \"" + tmpl_name + "\" not found")
+# Find the templates we are looking for in the template link graph
+if args.offline:
+    graph = {templateid: {'host': template['host'], 'parents': snapshot['template_templates'].get(templateid, [])}
+             for templateid, template in snapshot['templates'].items()}
+elif args.no_cache:
+    graph = template_graph(zapi)
 else:
-    templateid = template[0]["templateid"]
+    graph = template_graph(zapi, cachefile_path(api, username, "templategraph"), args.cache_ttl, args.template)
+tmpl_name = "\", \"".join(args.template)
+templateids = []
+for name in args.template:
+    ids = [templateid for templateid, template in graph.items() if template['host'] == name]
+    if not ids:
+        sys.exit("Error: Template \"" + name + "\" not found")
+    templateids.extend(ids)
 
-if templateid:
-    # Find linked hosts
-    if args.monitored:
+if templateids:
+    if not args.direct:
+        templateids = linked_templates(graph, templateids)
+    # Find linked hosts, all templates at once
+    if args.offline:
+        hostids = set()
+        for templateid in templateids:
+            hostids.update(snapshot['template_hosts'].get(templateid, []))
+        hosts = [dict(snapshot['hosts'][hostid], hostid=hostid) for hostid in sorted(hostids, key=int)]
+        if args.monitored:
+            hosts = [host for host in hosts if host['status'] == '0']
+    elif args.monitored:
         hosts = zapi.host.get(
-            output="extend", templateids=templateid, monitored_hosts='1')
+            output="extend", countOutput=args.count, templateids=list(templateids), monitored_hosts='1')
     else:
-        hosts = zapi.host.get(output="extend", templateids=templateid)
-    if hosts:
+        hosts = zapi.host.get(output="extend", countOutput=args.count, templateids=list(templateids))
+    if args.count:
+        # countOutput answers with the number of matches only
+        print(len(hosts) if isinstance(hosts, list) else hosts)
+    elif hosts:
         if args.extended:
             # print ids and names
             for host in hosts:
@@ -167,5 +253,6 @@ if templateid:
 else:
     sys.exit("Error: Could not find template \"" + tmpl_name + "\"")
 
-zapi.logout()
+if not args.offline:
+    zapi.logout()
 # And we're done...